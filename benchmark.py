@@ -0,0 +1,567 @@
+"""
+Speed benchmarks for the open-unmix inference path.
+
+By default the benchmarks use randomly initialized models with the
+architecture of the pre-trained `umxhq` model, so that no weights need to be
+downloaded. Pass `--model` to benchmark pre-trained or user-trained models.
+"""
+import argparse
+import time
+import numpy as np
+import torch
+import model
+import utils
+import test
+
+
+def get_models(args):
+    """Returns a list of eval mode models for `args.targets`"""
+    if args.model:
+        return [
+            test.load_model(target=target, model_name=args.model)
+            for target in args.targets
+        ]
+
+    unmixes = []
+    for target in args.targets:
+        unmix = model.OpenUnmix(
+            n_fft=4096,
+            n_hop=1024,
+            nb_channels=2,
+            hidden_size=512,
+            max_bin=utils.bandwidth_to_max_bin(44100, 4096, 16000)
+        )
+        unmix.stft.center = True
+        unmix.eval()
+        unmixes.append(unmix)
+    return unmixes
+
+
+def save_models(args, path):
+    """
+    Saves the models of `get_models` in the format of a model directory,
+    see `test.load_model`, and returns the path
+    """
+    import json
+
+    for target, unmix in zip(args.targets, get_models(args)):
+        torch.save(unmix.state_dict(), str(path / (target + '.pth')))
+        with open(str(path / (target + '.json')), 'w') as f:
+            json.dump({'args': {
+                'nfft': unmix.stft.n_fft,
+                'nhop': unmix.stft.n_hop,
+                'nb_channels': unmix.fc3.out_features // unmix.nb_output_bins,
+                'hidden_size': unmix.hidden_size,
+                'bandwidth': 16000,
+            }}, f)
+    return str(path)
+
+
+def timeit(func, repeat):
+    """Returns the median wall clock time of `repeat` calls to `func`"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def report(name, seconds, duration):
+    print(
+        "{:<32} {:8.3f}s  (rtf {:6.3f})".format(
+            name, seconds, seconds / duration
+        )
+    )
+
+
+def bench_stft(args):
+    """Per-target STFTs vs. one shared mixture STFT per track"""
+    unmixes = get_models(args)
+    audio = torch.rand(1, 2, int(args.duration * 44100))
+
+    def per_target():
+        # one stft per target model and another one for the wiener filter
+        V = [unmix(audio) for unmix in unmixes]
+        X = unmixes[0].stft(audio)
+        return V, X
+
+    def shared():
+        X = unmixes[0].stft(audio)
+        spec = unmixes[0].spec(X)
+        V = [unmix.forward_spectrogram(spec) for unmix in unmixes]
+        return V, X
+
+    with torch.no_grad():
+        t_per_target = timeit(per_target, args.repeat)
+        t_shared = timeit(shared, args.repeat)
+
+    report('per-target stft', t_per_target, args.duration)
+    report('shared stft', t_shared, args.duration)
+    print(
+        "time saved per track: {:.3f}s".format(t_per_target - t_shared)
+    )
+
+
+def bench_istft(args):
+    """Per-target scipy ISTFT vs. one batched torch ISTFT"""
+    import scipy.signal
+
+    unmixes = get_models(args)
+    stft = unmixes[0].stft
+    audio = torch.rand(1, 2, int(args.duration * 44100))
+    with torch.no_grad():
+        X = stft(audio).numpy()
+    X = X[..., 0] + X[..., 1]*1j
+    # (nb_targets, nb_channels, nb_bins, nb_frames)
+    Y = np.repeat(X, len(unmixes), axis=0).astype(np.complex128)
+
+    def scipy_istft():
+        for j in range(Y.shape[0]):
+            scipy.signal.istft(
+                Y[j] / (stft.n_fft / 2),
+                44100,
+                nperseg=stft.n_fft,
+                noverlap=stft.n_fft - stft.n_hop,
+                boundary=True
+            )
+
+    def torch_istft():
+        test.istft(Y, n_fft=stft.n_fft, n_hopsize=stft.n_hop)
+
+    report('scipy istft (per target)', timeit(scipy_istft, args.repeat),
+           args.duration)
+    report('torch istft (batched)', timeit(torch_istft, args.repeat),
+           args.duration)
+
+
+def bench_torchscript(args):
+    """Eager vs. traced TorchScript bundle at several track lengths"""
+    bundle = model.OpenUnmixBundle(get_models(args)).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(
+            bundle, torch.zeros(1, 2, 44100), check_trace=False
+        )
+
+        for duration in args.durations:
+            audio = torch.rand(1, 2, int(duration * 44100))
+            # warm up the profiling executor of the traced module
+            traced(audio)
+            report(
+                'eager ({:.0f}s)'.format(duration),
+                timeit(lambda: bundle(audio), args.repeat),
+                duration
+            )
+            report(
+                'torchscript ({:.0f}s)'.format(duration),
+                timeit(lambda: traced(audio), args.repeat),
+                duration
+            )
+
+
+def bench_onnx(args):
+    """Spectrogram core in torch vs. the exported graph in onnxruntime"""
+    import io
+    import onnxruntime
+    import export
+
+    unmixes = get_models(args)
+    bundle = model.OpenUnmixBundle(unmixes, input_is_spectrogram=True).eval()
+    graph = io.BytesIO()
+    export.export_onnx(graph, unmixes)
+    session = onnxruntime.InferenceSession(
+        graph.getvalue(), providers=['CPUExecutionProvider']
+    )
+
+    audio = torch.rand(1, 2, int(args.duration * 44100))
+    with torch.no_grad():
+        spec = bundle.spec(bundle.stft(audio))
+        report(
+            'torch', timeit(lambda: bundle(spec), args.repeat), args.duration
+        )
+    spec = spec.numpy()
+    report(
+        'onnxruntime',
+        timeit(lambda: session.run(None, {'spectrogram': spec}), args.repeat),
+        args.duration
+    )
+
+
+def bench_scaling(args):
+    """Real-time factor of the target models vs. CPU cores and workers"""
+    import os
+
+    unmixes = get_models(args)
+    audio = torch.rand(1, 2, int(args.duration * 44100))
+    with torch.no_grad():
+        X = unmixes[0].stft(audio)
+
+    nb_cores = [1]
+    while nb_cores[-1] * 2 <= (args.max_cores or os.cpu_count()):
+        nb_cores.append(nb_cores[-1] * 2)
+
+    print("{:>8} {:>6} {:>8} {:>8}".format(
+        'targets', 'cores', 'workers', 'rtf'
+    ))
+    for nb_targets in range(1, len(unmixes) + 1):
+        for cores in nb_cores:
+            for workers in sorted({1, min(nb_targets, cores)}):
+                with utils.torch_threads(cores):
+                    seconds = timeit(
+                        lambda: test.estimate_spectrograms(
+                            unmixes[:nb_targets], X, nb_workers=workers
+                        ),
+                        args.repeat
+                    )
+                print("{:8d} {:6d} {:8d} {:8.3f}".format(
+                    nb_targets, cores, workers, seconds / args.duration
+                ))
+
+
+def bench_resample(args):
+    """Torch polyphase resampler vs. resampy, speed and accuracy"""
+    import resampy
+
+    rng = np.random.RandomState(0)
+    print("{:<16} {:>10} {:>10} {:>10}".format(
+        'rates', 'resampy', 'torch', 'snr (dB)'
+    ))
+    for orig_sr, target_sr in [(48000, 44100), (22050, 44100), (44100, 16000)]:
+        # noise band-limited to 80% of the lower nyquist frequency
+        nb_timesteps = int(args.duration * orig_sr)
+        spectrum = np.fft.rfft(rng.randn(2, nb_timesteps))
+        cutoff = int(
+            0.8 * min(orig_sr, target_sr) / orig_sr * nb_timesteps / 2
+        )
+        spectrum[:, cutoff:] = 0
+        audio = np.fft.irfft(spectrum, nb_timesteps).astype(np.float32)
+        x = torch.from_numpy(audio)
+
+        reference = resampy.resample(audio, orig_sr, target_sr, axis=-1)
+        estimate = utils.resample(x, orig_sr, target_sr).numpy()
+        nb_timesteps = min(reference.shape[-1], estimate.shape[-1])
+        # ignore the filter transients at the borders
+        valid = slice(nb_timesteps // 10, -nb_timesteps // 10)
+        error = estimate[:, valid] - reference[:, valid]
+        snr = 10 * np.log10(
+            np.sum(reference[:, valid]**2) / np.sum(error**2)
+        )
+
+        t_resampy = timeit(
+            lambda: resampy.resample(audio, orig_sr, target_sr, axis=-1),
+            args.repeat
+        )
+        t_torch = timeit(
+            lambda: utils.resample(x, orig_sr, target_sr), args.repeat
+        )
+        print("{:<16} {:9.3f}s {:9.3f}s {:10.1f}".format(
+            '{}->{}'.format(orig_sr, target_sr), t_resampy, t_torch, snr
+        ))
+
+
+def import_times(command):
+    """
+    Runs `command` with `python -X importtime` and returns the wall clock
+    time and a dict of the cumulative import time in seconds per module
+    """
+    import subprocess
+    import sys
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + command,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    seconds = time.perf_counter() - start
+    modules = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative) / 1e6
+    return seconds, modules
+
+
+def bench_startup(args):
+    """Cold start time of the command line entry points with `--help`"""
+    for script in args.scripts:
+        runs = [import_times([script, '--help']) for _ in range(args.repeat)]
+        seconds = np.median([run[0] for run in runs])
+        modules = runs[-1][1]
+        print("{:<32} {:8.3f}s".format(script + ' --help', seconds))
+        top_level = {
+            name: value for name, value in modules.items()
+            if '.' not in name
+        }
+        for name in sorted(top_level, key=top_level.get, reverse=True)[
+            :args.top
+        ]:
+            print("    {:<28} {:8.3f}s".format(name, top_level[name]))
+
+
+def bench_sink(args):
+    """Peak memory of writing concatenated vs. block-wise chunked estimates"""
+    import tempfile
+    from pathlib import Path
+
+    audio = np.random.RandomState(0).randn(
+        int(args.duration * 44100), 2
+    ).astype(np.float32) * 0.1
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        model_name = args.model or save_models(args, tmp)
+        outdir = tmp / 'estimates'
+        outdir.mkdir()
+        chunk_size = int(args.chunk_dur * 44100)
+
+        for nb_targets in range(1, len(args.targets) + 1):
+            kwargs = dict(
+                targets=args.targets[:nb_targets], model_name=model_name,
+                chunk_size=chunk_size, chunk_overlap=chunk_size // 10
+            )
+            # load the models before measuring
+            test.load_models(kwargs['targets'], model_name=model_name)
+
+            def concatenated():
+                blocks = list(test.separate_chunked(audio, **kwargs))
+                test.write_estimates({
+                    target: np.concatenate([block[target] for block in blocks])
+                    for target in blocks[0]
+                }, outdir)
+
+            def sink():
+                with test.EstimateWriter(outdir) as writer:
+                    for blocks in test.separate_chunked(audio, **kwargs):
+                        writer.write(blocks)
+
+            for name, func in [('concatenated', concatenated), ('sink', sink)]:
+                print("{:<32} {:8.1f}MB".format(
+                    '{} ({} targets)'.format(name, nb_targets),
+                    peak_memory(func)
+                ))
+
+
+def median_sdr(scores):
+    """Returns the median SDR of each target of museval json scores"""
+    return {
+        target['name']: np.nanmedian(
+            [frame['metrics']['SDR'] for frame in target['frames']]
+        )
+        for target in scores['targets']
+    }
+
+
+def peak_memory(func):
+    """
+    Returns the peak memory in MB of `func`, measured as the increase of the
+    peak resident set size of a forked process running it
+    """
+    import multiprocessing
+    import resource
+
+    ctx = multiprocessing.get_context('fork')
+    result = ctx.Queue()
+
+    def run(func):
+        try:
+            start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func()
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result.put((peak - start) / 1024)
+        except Exception as e:
+            # report the error instead of leaving the parent waiting
+            result.put(e)
+
+    process = ctx.Process(target=run, args=(func,))
+    process.start()
+    memory = result.get()
+    process.join()
+    if isinstance(memory, Exception):
+        raise memory
+    return memory
+
+
+def compare_on_reference(args, variants):
+    """
+    Separates the track of the regression test with every variant of the
+    `test.separate` keyword arguments in `variants` and prints the median
+    SDR per target, the separation time and the peak memory.
+    The reference scores in `tests/data` are computed with `umx`, which is
+    used unless `--model` is given.
+    """
+    import os
+    import json
+    import musdb
+    import museval
+
+    track_name = 'Al James - Schoolboy Facination'
+    with open(os.path.join('tests', 'data', track_name + '.json')) as f:
+        reference = median_sdr(json.load(f))
+
+    mus = musdb.DB(download=True)
+    track = [track for track in mus.tracks if track.name == track_name][0]
+    model_name = args.model or 'umx'
+
+    sdr = {}
+    times = {}
+    memory = {}
+    for name, kwargs in variants.items():
+        def separate():
+            return test.separate(
+                track.audio, args.targets, model_name=model_name, **kwargs
+            )
+        # load the models before measuring
+        estimates = separate()
+        times[name] = timeit(separate, args.repeat)
+        memory[name] = peak_memory(separate)
+        scores = museval.eval_mus_track(track, estimates)
+        sdr[name] = median_sdr(json.loads(scores.json))
+
+    names = list(variants)
+    print(("{:<10} {:>10}" + " {:>10}" * (len(names) + 1)).format(
+        'target', 'reference', *names, 'change'
+    ))
+    for target in args.targets:
+        values = [sdr[name][target] for name in names]
+        print(("{:<10} {:10.3f}" + " {:10.3f}" * len(names) + " {:+10.3f}")
+              .format(target, reference.get(target, np.nan), *values,
+                      values[-1] - values[0]))
+
+    for name in names:
+        report(name, times[name], track.duration)
+        print("{:<32} {:8.1f}MB".format(name + ' peak memory', memory[name]))
+    print("speedup: {:.2f}x".format(times[names[0]] / times[names[-1]]))
+
+
+def bench_quantize(args):
+    """SDR change and speedup of int8 quantized models on the test track"""
+    compare_on_reference(
+        args, {'float32': {}, 'int8': {'quantize': True}}
+    )
+
+
+def bench_bfloat16(args):
+    """SDR change, speedup and memory of bfloat16 models on the test track"""
+    compare_on_reference(
+        args, {'float32': {}, 'bfloat16': {'dtype': torch.bfloat16}}
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Open Unmix Benchmarks',
+        add_help=False
+    )
+
+    parser.add_argument(
+        '--targets',
+        nargs='+',
+        default=['vocals', 'drums', 'bass', 'other'],
+        type=str,
+        help='targets to be processed'
+    )
+
+    parser.add_argument(
+        '--model',
+        type=str,
+        help='name or path of the model, defaults to random weights'
+    )
+
+    parser.add_argument(
+        '--duration',
+        type=float,
+        default=30.0,
+        help='duration of the benchmark signal in seconds'
+    )
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='number of repetitions, the median time is reported'
+    )
+
+    main_parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = main_parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    subparsers.add_parser(
+        'stft', parents=[parser], help=bench_stft.__doc__
+    ).set_defaults(func=bench_stft)
+
+    subparsers.add_parser(
+        'istft', parents=[parser], help=bench_istft.__doc__
+    ).set_defaults(func=bench_istft)
+
+    torchscript_parser = subparsers.add_parser(
+        'torchscript', parents=[parser], help=bench_torchscript.__doc__
+    )
+    torchscript_parser.set_defaults(func=bench_torchscript)
+    torchscript_parser.add_argument(
+        '--durations',
+        nargs='+',
+        type=float,
+        default=[5.0, 30.0, 120.0],
+        help='durations of the benchmark signals in seconds'
+    )
+
+    subparsers.add_parser(
+        'onnx', parents=[parser], help=bench_onnx.__doc__
+    ).set_defaults(func=bench_onnx)
+
+    subparsers.add_parser(
+        'quantize', parents=[parser], help=bench_quantize.__doc__
+    ).set_defaults(func=bench_quantize)
+
+    subparsers.add_parser(
+        'bfloat16', parents=[parser], help=bench_bfloat16.__doc__
+    ).set_defaults(func=bench_bfloat16)
+
+    subparsers.add_parser(
+        'resample', parents=[parser], help=bench_resample.__doc__
+    ).set_defaults(func=bench_resample)
+
+    startup_parser = subparsers.add_parser(
+        'startup', parents=[parser], help=bench_startup.__doc__
+    )
+    startup_parser.set_defaults(func=bench_startup)
+    startup_parser.add_argument(
+        '--scripts',
+        nargs='+',
+        default=['test.py', 'eval.py'],
+        help='entry points to be started'
+    )
+    startup_parser.add_argument(
+        '--top',
+        type=int,
+        default=5,
+        help='number of slowest packages that are reported'
+    )
+
+    sink_parser = subparsers.add_parser(
+        'sink', parents=[parser], help=bench_sink.__doc__
+    )
+    sink_parser.set_defaults(func=bench_sink)
+    sink_parser.add_argument(
+        '--chunk-dur',
+        type=float,
+        default=30.0,
+        help='duration of the separated chunks in seconds'
+    )
+
+    scaling_parser = subparsers.add_parser(
+        'scaling', parents=[parser], help=bench_scaling.__doc__
+    )
+    scaling_parser.set_defaults(func=bench_scaling)
+    scaling_parser.add_argument(
+        '--max-cores',
+        type=int,
+        help='largest number of cores, defaults to all cores'
+    )
+
+    args = main_parser.parse_args()
+    args.func(args)
@@ -282,8 +282,14 @@ class AlignedDataset(torch.utils.data.Dataset):
         else:
             start = 0
 
-        X_audio = load_audio(input_path, start=start, dur=self.seq_duration)
-        Y_audio = load_audio(output_path, start=start, dur=self.seq_duration)
+        X_audio = load_audio(
+            input_path, start=start, dur=self.seq_duration,
+            sample_rate=self.sample_rate
+        )
+        Y_audio = load_audio(
+            output_path, start=start, dur=self.seq_duration,
+            sample_rate=self.sample_rate
+        )
         # return torch tensors
         return X_audio, Y_audio
 
@@ -372,7 +378,8 @@ class SourceFolderDataset(torch.utils.data.Dataset):
                 start = 0
 
             audio = load_audio(
-                source_path, start=start, dur=self.seq_duration
+                source_path, start=start, dur=self.seq_duration,
+                sample_rate=self.sample_rate
             )
             audio = self.source_augmentations(audio)
             audio_sources.append(audio)
@@ -474,7 +481,8 @@ class FixedSourcesTrackFolderDataset(torch.utils.data.Dataset):
         audio_sources = []
         # load target
         target_audio = load_audio(
-            track_path / self.target_file, start=start, dur=self.seq_duration
+            track_path / self.target_file, start=start, dur=self.seq_duration,
+            sample_rate=self.sample_rate
         )
         target_audio = self.source_augmentations(target_audio)
         audio_sources.append(target_audio)
@@ -487,7 +495,8 @@ class FixedSourcesTrackFolderDataset(torch.utils.data.Dataset):
                     start = random.uniform(0, min_duration - self.seq_duration)
 
             audio = load_audio(
-                track_path / source, start=start, dur=self.seq_duration
+                track_path / source, start=start, dur=self.seq_duration,
+                sample_rate=self.sample_rate
             )
             audio = self.source_augmentations(audio)
             audio_sources.append(audio)
@@ -589,7 +598,8 @@ class VariableSourcesTrackFolderDataset(torch.utils.data.Dataset):
         for source_path in sources:
             try:
                 audio = load_audio(
-                    source_path, start=start, dur=self.seq_duration
+                    source_path, start=start, dur=self.seq_duration,
+                    sample_rate=self.sample_rate
                 )
             except RuntimeError:
                 index = index - 1 if index > 0 else index + 1
@@ -1,12 +1,68 @@
 import argparse
-import musdb
-import museval
-import test
 import multiprocessing
 import functools
+import threading
+import time
 from pathlib import Path
-import torch
-import tqdm
+import utils
+import test
+
+# heavy modules are loaded on first use, see `utils.lazy_import`
+torch = utils.lazy_import('torch')
+tqdm = utils.lazy_import('tqdm')
+musdb = utils.lazy_import('musdb')
+museval = utils.lazy_import('museval')
+
+
+def init_worker(unmixes, targets, model_name, device, quantize, dtype):
+    """
+    Initializer of the pool workers: adds the models loaded by the parent
+    process to the model cache of the worker, see `test.cache_models`.
+    The weights are in shared memory, so the workers share one copy.
+    """
+    test.cache_models(
+        unmixes, targets, model_name=model_name, device=device,
+        quantize=quantize, dtype=dtype
+    )
+
+
+def save_estimates(estimates, track, output_dir):
+    """Writes the estimates of `track` in the folder structure of musdb"""
+    outdir = Path(output_dir, track.subset, track.name)
+    outdir.mkdir(parents=True, exist_ok=True)
+    test.write_estimates(estimates, outdir, track.rate)
+
+
+def estimate_key(track, targets, model_name='umxhq', **kwargs):
+    """
+    Returns the `utils.EstimateCache` key of the estimates of `track`
+    separated by `test.separate` with `kwargs`
+    """
+    return utils.EstimateCache.key(
+        track=track.name,
+        niter=kwargs.get('niter', 1),
+        alpha=kwargs.get('alpha', 1.0),
+        softmask=kwargs.get('softmask', False),
+        residual_model=kwargs.get('residual_model', False),
+        wiener_backend=kwargs.get('wiener_backend', 'norbert'),
+        **test.model_signature(targets, model_name, **kwargs)
+    )
+
+
+def separate_cached(track, cache=None, **kwargs):
+    """
+    Returns the estimates of `track`, computed with `test.separate` unless
+    they are found in `cache`, an `utils.EstimateCache`
+    """
+    if cache is None:
+        return test.separate(audio=track.audio, **kwargs)
+
+    key = estimate_key(track, **kwargs)
+    estimates = cache.get(key)
+    if estimates is None:
+        estimates = test.separate(audio=track.audio, **kwargs)
+        cache.put(key, estimates)
+    return estimates
 
 
 def separate_and_evaluate(
@@ -18,19 +74,35 @@ def separate_and_evaluate(
     softmask,
     output_dir,
     eval_dir,
-    device='cpu'
+    device='cpu',
+    fused=False,
+    wiener_backend='norbert',
+    backend='torch',
+    quantize=False,
+    dtype=None,
+    nb_cores=None,
+    nb_workers=1,
+    cache=None
 ):
-    estimates = test.separate(
-        audio=track.audio,
+    estimates = separate_cached(
+        track,
+        cache=cache,
         targets=targets,
         model_name=model_name,
         niter=niter,
         alpha=alpha,
         softmask=softmask,
-        device=device
+        device=device,
+        fused=fused,
+        wiener_backend=wiener_backend,
+        backend=backend,
+        quantize=quantize,
+        dtype=dtype,
+        nb_cores=nb_cores,
+        nb_workers=nb_workers
     )
     if output_dir:
-        mus.save_estimates(estimates, track, output_dir)
+        save_estimates(estimates, track, output_dir)
 
     scores = museval.eval_mus_track(
         track, estimates, output_dir=eval_dir
@@ -38,6 +110,184 @@ def separate_and_evaluate(
     return scores
 
 
+def separate_track(track, output_dir=None, cache=None, **kwargs):
+    """
+    Separation stage of `evaluate_pipeline`, returns the estimates of
+    `track` and the time in seconds it took
+    """
+    start = time.perf_counter()
+    estimates = separate_cached(track, cache=cache, **kwargs)
+    if output_dir:
+        save_estimates(estimates, track, output_dir)
+    return estimates, time.perf_counter() - start
+
+
+def score_track(track, estimates, eval_dir=None):
+    """
+    Scoring stage of `evaluate_pipeline`, returns the BSSEval scores of
+    `estimates` and the time in seconds it took
+    """
+    start = time.perf_counter()
+    scores = museval.eval_mus_track(track, estimates, output_dir=eval_dir)
+    return scores, time.perf_counter() - start
+
+
+def separator_pool(
+    nb_processes, targets, model_name='umxhq', device='cpu', quantize=False,
+    dtype=None
+):
+    """
+    Returns a process pool whose workers share the models of `targets`,
+    which are loaded once by the calling process, see `init_worker`
+    """
+    unmixes = test.load_models(
+        targets, model_name=model_name, device=device, quantize=quantize,
+        dtype=dtype
+    )
+    for unmix in unmixes:
+        unmix.share_memory()
+    return torch.multiprocessing.Pool(
+        nb_processes,
+        initializer=init_worker,
+        initargs=(unmixes, targets, model_name, device, quantize, dtype)
+    )
+
+
+def evaluate_pipeline(
+    tracks,
+    nb_separators=1,
+    nb_scorers=1,
+    queue_size=2,
+    output_dir=None,
+    eval_dir=None,
+    cache=None,
+    **kwargs
+):
+    """
+    Separates and scores `tracks` in two independently sized process
+    pools: the separators pass their estimates to the scorers, which
+    compute the BSSEval scores, so that both stages run concurrently.
+
+    Parameters
+    ----------
+    tracks: list of `musdb.audio_classes.MultiTrack`
+        tracks to be evaluated
+
+    nb_separators: int
+        number of separation processes, they share the models, see
+        `separator_pool`
+
+    nb_scorers: int
+        number of BSSEval scoring processes
+
+    queue_size: int
+        maximum number of separated tracks that wait for a free scorer.
+        No more tracks are separated while the queue is full, which bounds
+        the memory held by the estimates.
+
+    output_dir, eval_dir: str or None
+        see `separate_and_evaluate`
+
+    cache: `utils.EstimateCache` or None
+        estimates found in the cache are not separated again, see
+        `separate_cached`
+
+    kwargs:
+        all other parameters are passed to `test.separate`
+
+    Returns
+    -------
+    scores: list of `museval.TrackStore`
+        scores of the tracks, in the order they were completed
+    timings: `dict` [`str`, `utils.AverageMeter`]
+        seconds per track spent in the `separate` and `score` stages and
+        the total wall clock time of the pipeline as `total`, see
+        `report_throughput`
+    """
+    model_kwargs = {
+        name: kwargs[name]
+        for name in ['model_name', 'device', 'quantize', 'dtype']
+        if name in kwargs
+    }
+    separators = separator_pool(
+        nb_separators, kwargs['targets'], **model_kwargs
+    )
+    scorers = multiprocessing.Pool(nb_scorers)
+
+    timings = {
+        name: utils.AverageMeter() for name in ['separate', 'score', 'total']
+    }
+    scores = []
+    errors = []
+    # tracks that are separated, wait for a scorer or are scored
+    capacity = nb_separators + queue_size + nb_scorers
+    slots = threading.BoundedSemaphore(capacity)
+    lock = threading.Lock()
+
+    def failed(e):
+        errors.append(e)
+        slots.release()
+
+    def scored(result):
+        with lock:
+            scores.append(result[0])
+            timings['score'].update(result[1])
+        slots.release()
+
+    def separated(track, result):
+        estimates, seconds = result
+        with lock:
+            timings['separate'].update(seconds)
+        scorers.apply_async(
+            score_track, (track, estimates, eval_dir),
+            callback=scored, error_callback=failed
+        )
+
+    start = time.perf_counter()
+    for track in tracks:
+        slots.acquire()
+        if errors:
+            slots.release()
+            break
+        separators.apply_async(
+            functools.partial(
+                separate_track, output_dir=output_dir, cache=cache
+            ),
+            (track,), kwargs,
+            callback=functools.partial(separated, track),
+            error_callback=failed
+        )
+    # wait until all tracks are scored
+    for _ in range(capacity):
+        slots.acquire()
+    timings['total'].update(time.perf_counter() - start)
+
+    for pool in [separators, scorers]:
+        pool.close()
+        pool.join()
+    if errors:
+        raise errors[0]
+    return scores, timings
+
+
+def report_throughput(timings, nb_separators, nb_scorers):
+    """Prints the throughput and utilization of both pipeline stages"""
+    total = timings['total'].sum
+    print("{:<10} {:>8} {:>8} {:>12} {:>12} {:>12}".format(
+        'stage', 'workers', 'tracks', 's/track', 'tracks/h', 'utilization'
+    ))
+    for name, nb_processes in [
+        ('separate', nb_separators), ('score', nb_scorers)
+    ]:
+        meter = timings[name]
+        print("{:<10} {:8d} {:8d} {:12.2f} {:12.1f} {:11.0f}%".format(
+            name, nb_processes, meter.count, meter.avg,
+            meter.count / total * 3600 if total else 0,
+            100 * meter.sum / (total * nb_processes) if total else 0
+        ))
+    print("total: {:.1f}s".format(total))
+
+
 if __name__ == '__main__':
     # Training settings
     parser = argparse.ArgumentParser(
@@ -89,7 +339,47 @@ if __name__ == '__main__':
     parser.add_argument(
         '--cores',
         type=int,
-        default=1
+        default=1,
+        help='number of separation processes'
+    )
+
+    parser.add_argument(
+        '--scorers',
+        type=int,
+        default=0,
+        help='number of BSSEval scoring processes. If set, `--cores` '
+             'separation processes pass their estimates to the scorers, so '
+             'that separation and scoring run concurrently'
+    )
+
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=2,
+        help='maximum number of separated tracks that wait for a scorer'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='directory of the estimate cache. Estimates of tracks that '
+             'were separated before with the same models and parameters '
+             'are read from the cache instead of being separated again'
+    )
+
+    parser.add_argument(
+        '--cache-size',
+        type=float,
+        default=20.0,
+        help='maximum size of the estimate cache in GB, the least recently '
+             'used estimates are removed first'
+    )
+
+    parser.add_argument(
+        '--cache-dtype',
+        choices=['float32', 'float16'],
+        default='float32',
+        help='dtype of the cached estimates'
     )
 
     parser.add_argument(
@@ -117,8 +407,55 @@ if __name__ == '__main__':
         subsets=args.subset,
         is_wav=args.is_wav
     )
-    if args.cores > 1:
-        pool = multiprocessing.Pool(args.cores)
+    dtype = getattr(torch, args.dtype)
+    cache = utils.EstimateCache(
+        args.cache_dir,
+        maxsize=int(args.cache_size * 1e9),
+        dtype=args.cache_dtype
+    ) if args.cache_dir else None
+
+    if args.scorers > 0:
+        # the scorers keep one core each, the separators share the rest
+        nb_cores = args.threads or max(
+            1, (multiprocessing.cpu_count() - args.scorers) // args.cores
+        )
+        scores_list, timings = evaluate_pipeline(
+            mus.tracks,
+            nb_separators=args.cores,
+            nb_scorers=args.scorers,
+            queue_size=args.queue_size,
+            output_dir=args.outdir,
+            eval_dir=args.evaldir,
+            cache=cache,
+            targets=args.targets,
+            model_name=args.model,
+            niter=args.niter,
+            alpha=args.alpha,
+            softmask=args.softmask,
+            device=device,
+            fused=args.fused,
+            wiener_backend=args.wiener_backend,
+            backend=args.backend,
+            quantize=args.quantize,
+            dtype=dtype,
+            nb_cores=nb_cores,
+            nb_workers=args.target_workers
+        )
+        results = museval.EvalStore()
+        for scores in scores_list:
+            results.add_track(scores)
+        report_throughput(timings, args.cores, args.scorers)
+
+    elif args.cores > 1:
+        # split the cores between the processes to avoid oversubscription
+        nb_cores = args.threads or max(
+            1, multiprocessing.cpu_count() // args.cores
+        )
+        # load the models once and share their weights with the workers
+        pool = separator_pool(
+            args.cores, args.targets, model_name=args.model, device=device,
+            quantize=args.quantize, dtype=dtype
+        )
         results = museval.EvalStore()
         scores_list = list(
             pool.imap_unordered(
@@ -131,7 +468,15 @@ if __name__ == '__main__':
                     softmask=args.softmask,
                     output_dir=args.outdir,
                     eval_dir=args.evaldir,
-                    device=device
+                    cache=cache,
+                    device=device,
+                    fused=args.fused,
+                    wiener_backend=args.wiener_backend,
+                    backend=args.backend,
+                    quantize=args.quantize,
+                    dtype=dtype,
+                    nb_cores=nb_cores,
+                    nb_workers=args.target_workers
                 ),
                 iterable=mus.tracks,
                 chunksize=1
@@ -154,7 +499,15 @@ if __name__ == '__main__':
                 softmask=args.softmask,
                 output_dir=args.outdir,
                 eval_dir=args.evaldir,
-                device=device
+                cache=cache,
+                device=device,
+                fused=args.fused,
+                wiener_backend=args.wiener_backend,
+                backend=args.backend,
+                quantize=args.quantize,
+                dtype=dtype,
+                nb_cores=args.threads,
+                nb_workers=args.target_workers
             )
             results.add_track(scores)
 
@@ -0,0 +1,217 @@
+"""
+Export of open-unmix models for deployment.
+
+`torchscript` traces the STFT front end and the models of all targets into a
+single TorchScript file, that can be loaded with `torch.jit.load` without
+the open-unmix code:
+
+    python export.py torchscript --model umxhq --output umxhq.pt
+
+`onnx` exports the spectrogram-in/spectrogram-out core of the models of all
+targets to ONNX, to be run with onnxruntime, see the `backend` option of
+`test.separate`:
+
+    python export.py onnx --model umxhq --output umxhq.onnx
+"""
+import argparse
+import copy
+import inspect
+import json
+import torch
+import model
+import test
+
+
+def fold(unmixes):
+    """
+    Returns copies of `unmixes` with folded normalizations, see
+    `model.OpenUnmix.fuse`
+    """
+    return [copy.deepcopy(unmix).fuse() for unmix in unmixes]
+
+
+def export_torchscript(
+    path,
+    targets,
+    model_name='umxhq',
+    fused=False,
+    example_duration=10.0,
+    samplerate=44100
+):
+    """
+    Traces a `model.OpenUnmixBundle` of `targets` and saves it to `path`.
+    The normalizations of the models are folded into their Linear layers,
+    see `model.OpenUnmix.fuse`.
+    The targets and STFT parameters are stored as `config.json` in the
+    file, see `load_torchscript`.
+
+    Parameters
+    ----------
+    example_duration: float
+        duration in seconds of the example input used for tracing.
+        The traced model accepts inputs of any length and batch size.
+
+    Returns
+    -------
+    bundle: torch.jit.ScriptModule
+        the traced bundle
+    """
+    unmixes = fold(test.load_models(targets, model_name=model_name))
+    bundle = model.OpenUnmixBundle(unmixes, fused=fused).eval()
+    nb_channels = unmixes[0].fc3.out_features // unmixes[0].nb_output_bins
+    example = torch.zeros(
+        1, nb_channels, int(example_duration * samplerate)
+    )
+    with torch.no_grad():
+        traced = torch.jit.trace(bundle, example, check_trace=False)
+
+    config = {
+        'targets': list(targets),
+        'rate': samplerate,
+        'nfft': unmixes[0].stft.n_fft,
+        'nhop': unmixes[0].stft.n_hop,
+        'nb_channels': nb_channels,
+    }
+    traced.save(
+        str(path), _extra_files={'config.json': json.dumps(config)}
+    )
+    return traced
+
+
+def load_torchscript(path, device='cpu'):
+    """
+    Loads a bundle saved with `export_torchscript`.
+
+    Returns
+    -------
+    bundle: torch.jit.ScriptModule
+        see `model.OpenUnmixBundle`
+    config: dict
+        targets (in the order of the bundle output) and STFT parameters
+    """
+    extra_files = {'config.json': ''}
+    bundle = torch.jit.load(
+        str(path), map_location=device, _extra_files=extra_files
+    )
+    return bundle, json.loads(extra_files['config.json'])
+
+
+def export_onnx(f, unmixes, fused=False, opset_version=11):
+    """
+    Exports a `model.OpenUnmixBundle` of `unmixes` with spectrogram input and
+    folded normalizations to ONNX. The graph has the input `spectrogram`
+    (nb_frames, nb_samples, nb_channels, nb_bins) and the output `estimates`
+    (nb_targets, nb_frames, nb_samples, nb_channels, nb_bins), with dynamic
+    frame and sample axes.
+
+    Parameters
+    ----------
+    f: str or file-like object
+        where the graph is written to
+
+    unmixes: list of `model.OpenUnmix`
+        models of all targets, see `test.load_models`
+
+    fused: boolean
+        export the models fused into one batched pass
+    """
+    bundle = model.OpenUnmixBundle(
+        fold(unmixes), fused=fused, input_is_spectrogram=True
+    ).eval()
+    nb_channels = unmixes[0].fc3.out_features // unmixes[0].nb_output_bins
+    example = torch.rand(16, 1, nb_channels, unmixes[0].nb_output_bins)
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # newer torch defaults to the dynamo exporter, which needs
+        # onnxscript, the graph is traced like with older versions
+        kwargs['dynamo'] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            bundle,
+            example,
+            f,
+            input_names=['spectrogram'],
+            output_names=['estimates'],
+            dynamic_axes={
+                'spectrogram': {0: 'nb_frames', 1: 'nb_samples'},
+                'estimates': {1: 'nb_frames', 2: 'nb_samples'},
+            },
+            opset_version=opset_version,
+            **kwargs
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(add_help=False)
+
+    parser.add_argument(
+        '--targets',
+        nargs='+',
+        default=['vocals', 'drums', 'bass', 'other'],
+        type=str,
+        help='targets to be exported'
+    )
+
+    parser.add_argument(
+        '--model',
+        default='umxhq',
+        type=str,
+        help='path to mode base directory of pretrained models'
+    )
+
+    parser.add_argument(
+        '--output',
+        type=str,
+        required=True,
+        help='path of the exported file'
+    )
+
+    main_parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = main_parser.add_subparsers(dest='format')
+    subparsers.required = True
+
+    torchscript_parser = subparsers.add_parser(
+        'torchscript',
+        parents=[parser],
+        help='STFT and all target models in one TorchScript file'
+    )
+    torchscript_parser.add_argument(
+        '--fused',
+        action='store_true',
+        default=False,
+        help='export the models fused into one batched pass'
+    )
+
+    onnx_parser = subparsers.add_parser(
+        'onnx',
+        parents=[parser],
+        help='spectrogram core of all target models in one ONNX graph'
+    )
+    onnx_parser.add_argument(
+        '--fused',
+        action='store_true',
+        default=False,
+        help='export the models fused into one batched pass'
+    )
+    onnx_parser.add_argument(
+        '--opset',
+        type=int,
+        default=11,
+        help='ONNX opset version'
+    )
+
+    args = main_parser.parse_args()
+    if args.format == 'torchscript':
+        export_torchscript(
+            args.output, args.targets, model_name=args.model, fused=args.fused
+        )
+    elif args.format == 'onnx':
+        export_onnx(
+            args.output,
+            test.load_models(args.targets, model_name=args.model),
+            fused=args.fused,
+            opset_version=args.opset
+        )
@@ -0,0 +1,286 @@
+"""
+Multichannel wiener filtering in torch.
+
+This is a port of the `norbert` filtering functions used by `test.separate`
+to torch, so that the post-processing can run in float32 and on the same
+device as the model. Complex tensors are represented with a trailing
+dimension of size 2 holding the real and imaginary part, as returned by
+`model.STFT`. For details on the algorithms, see the `norbert` docs.
+"""
+import torch
+
+
+def _mul(a, b):
+    """complex product `a * b`"""
+    return torch.stack([
+        a[..., 0] * b[..., 0] - a[..., 1] * b[..., 1],
+        a[..., 0] * b[..., 1] + a[..., 1] * b[..., 0]
+    ], -1)
+
+
+def _conj(a):
+    """complex conjugate of `a`"""
+    return torch.stack([a[..., 0], -a[..., 1]], -1)
+
+
+def _norm(a):
+    """squared magnitude `|a|**2`"""
+    return a[..., 0]**2 + a[..., 1]**2
+
+
+def _inv(a):
+    """complex inverse `1 / a`"""
+    return _conj(a) / _norm(a)[..., None]
+
+
+def _matmul(a, b, equation):
+    """complex `torch.einsum` of two tensors"""
+    return torch.stack([
+        torch.einsum(equation, [a[..., 0], b[..., 0]]) -
+        torch.einsum(equation, [a[..., 1], b[..., 1]]),
+        torch.einsum(equation, [a[..., 0], b[..., 1]]) +
+        torch.einsum(equation, [a[..., 1], b[..., 0]])
+    ], -1)
+
+
+def _invert(M, eps):
+    """
+    Inverts complex matrices of shape (..., nb_channels, nb_channels, 2),
+    using analytical expressions for the 1x1 and 2x2 cases.
+    """
+    nb_channels = M.shape[-2]
+    if nb_channels == 1:
+        # scalar case
+        M = M.clone()
+        M[..., 0] += eps
+        return _inv(M)
+    elif nb_channels == 2:
+        # two channels case: analytical expression
+        det = (
+            _mul(M[..., 0, 0, :], M[..., 1, 1, :]) -
+            _mul(M[..., 0, 1, :], M[..., 1, 0, :])
+        )
+        inv_det = _inv(det)
+        invM = torch.empty_like(M)
+        invM[..., 0, 0, :] = _mul(inv_det, M[..., 1, 1, :])
+        invM[..., 1, 0, :] = -_mul(inv_det, M[..., 1, 0, :])
+        invM[..., 0, 1, :] = -_mul(inv_det, M[..., 0, 1, :])
+        invM[..., 1, 1, :] = _mul(inv_det, M[..., 0, 0, :])
+        return invM
+    else:
+        # general case: invert the equivalent real [[A, -B], [B, A]] matrix
+        A, B = M[..., 0], M[..., 1]
+        real = torch.cat([
+            torch.cat([A, -B], -1),
+            torch.cat([B, A], -1)
+        ], -2)
+        inv_real = torch.inverse(real)
+        return torch.stack([
+            inv_real[..., :nb_channels, :nb_channels],
+            inv_real[..., nb_channels:, :nb_channels]
+        ], -1)
+
+
+def get_local_gaussian_model(y, eps=1.):
+    """
+    Computes the power spectral densities and spatial covariance matrices of
+    all sources given their complex STFT.
+
+    Parameters
+    ----------
+    y: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, nb_sources, 2)]
+        complex STFT of the sources
+
+    eps: float
+        regularization term
+
+    Returns
+    -------
+    v: torch.Tensor [shape=(nb_frames, nb_bins, nb_sources)]
+        power spectral densities of the sources
+    R: torch.Tensor
+        [shape=(nb_bins, nb_channels, nb_channels, nb_sources, 2)]
+        spatial covariance matrices of the sources
+    """
+    v = torch.mean(_norm(y), dim=2)
+
+    # sum over frames of y y^H, weighted by the total power
+    R = _matmul(y, _conj(y), 'tbis,tbjs->bijs')
+    weight = eps + torch.sum(v, dim=0)
+    R = R / weight[:, None, None, :, None]
+    return v, R
+
+
+def expectation_maximization(
+    y, x, iterations=2, eps=None, batch_size=200
+):
+    """
+    Expectation maximization algorithm, for refining source separation
+    estimates, see `norbert.expectation_maximization`.
+
+    Parameters
+    ----------
+    y: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, nb_sources, 2)]
+        initial estimates for the sources
+
+    x: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, 2)]
+        complex STFT of the mixture signal
+
+    iterations: int
+        number of iterations for the EM algorithm.
+
+    eps: float or None
+        regularization epsilon, defaults to the epsilon of the dtype of `x`
+
+    batch_size: int
+        number of frames that are filtered at once, to bound the memory
+        used for the mixture covariance matrices.
+
+    Returns
+    -------
+    y: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, nb_sources, 2)]
+        estimated sources after iterations
+    v: torch.Tensor [shape=(nb_frames, nb_bins, nb_sources)]
+        estimated power spectral densities
+    R: torch.Tensor
+        [shape=(nb_bins, nb_channels, nb_channels, nb_sources, 2)]
+        estimated spatial covariance matrices
+    """
+    if eps is None:
+        eps = torch.finfo(x.dtype).eps
+
+    nb_frames, nb_bins, nb_channels = x.shape[:3]
+
+    regularization = torch.zeros(
+        nb_channels, nb_channels, 2, dtype=x.dtype, device=x.device
+    )
+    regularization[..., 0] = eps**0.5 * torch.eye(
+        nb_channels, dtype=x.dtype, device=x.device
+    )
+
+    y = y.clone()
+    for it in range(iterations):
+        # update the local gaussian model of all sources
+        v, R = get_local_gaussian_model(y, eps)
+
+        for t in range(0, nb_frames, batch_size):
+            frames = slice(t, t + batch_size)
+            # mixture covariance: sum_j v_j R_j
+            Cxx = torch.einsum(
+                'tbj,bikjc->tbikc', [v[frames], R]
+            ) + regularization
+            inv_Cxx = _invert(Cxx, eps)
+
+            # separate the sources with the wiener gains v_j R_j inv_Cxx,
+            # the mixture is whitened first so that it is shared by all j
+            z = _matmul(inv_Cxx, x[frames], 'tbkl,tbl->tbk')
+            y[frames] = _matmul(R, z, 'bikj,tbk->tbij') * (
+                v[frames, :, None, :, None]
+            )
+
+    return y, v, R
+
+
+def softmask(v, x, eps=None):
+    """
+    Separates a mixture with a ratio mask, see `norbert.softmask`.
+
+    Parameters
+    ----------
+    v: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, nb_sources)]
+        spectrograms of the sources
+    x: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, 2)]
+        complex STFT of the mixture signal
+
+    Returns
+    -------
+    y: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, nb_sources, 2)]
+        estimated sources
+    """
+    if eps is None:
+        eps = torch.finfo(x.dtype).eps
+    total_energy = torch.sum(v, dim=-1, keepdim=True)
+    mask = v / (eps + total_energy)
+    return mask[..., None] * x[..., None, :]
+
+
+def wiener(v, x, iterations=1, use_softmask=True, eps=None):
+    """
+    Wiener-based separation for multichannel audio, see `norbert.wiener`.
+
+    Parameters
+    ----------
+    v: torch.Tensor
+        [shape=(nb_frames, nb_bins, {1, nb_channels}, nb_sources)]
+        spectrograms of the sources.
+    x: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, 2)]
+        complex STFT of the mixture signal.
+    iterations: int
+        number of iterations for the EM algorithm
+    use_softmask: boolean
+        if `True` initial estimates are obtained with `softmask`, otherwise
+        the spectrograms are used with the mixture phase.
+    eps: float or None
+        regularization epsilon, defaults to the epsilon of the dtype of `x`
+
+    Returns
+    -------
+    y: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, nb_sources, 2)]
+        complex STFT of the estimated sources
+    """
+    if use_softmask:
+        y = softmask(v, x, eps=eps)
+    else:
+        angle = torch.atan2(x[..., 1], x[..., 0])[..., None]
+        y = torch.stack(
+            [v * torch.cos(angle), v * torch.sin(angle)], -1
+        )
+
+    if not iterations:
+        return y
+
+    # scale down the estimates for numerical stability
+    max_abs = max(1, torch.sqrt(_norm(x)).max().item() / 10.)
+    x = x / max_abs
+    y = expectation_maximization(y / max_abs, x, iterations, eps=eps)[0]
+    return y * max_abs
+
+
+def residual_model(v, x, alpha=1):
+    """
+    Computes a model for the residual based on spectral subtraction,
+    see `norbert.residual_model`.
+
+    Parameters
+    ----------
+    v: torch.Tensor
+        [shape=(nb_frames, nb_bins, {1, nb_channels}, nb_sources)]
+        estimated spectrograms for the sources
+    x: torch.Tensor [shape=(nb_frames, nb_bins, nb_channels, 2)]
+        complex STFT of the mixture signal
+    alpha: float
+        exponent of the spectrograms `v`
+
+    Returns
+    -------
+    v: torch.Tensor
+        [shape=(nb_frames, nb_bins, nb_channels, nb_sources + 1)]
+        spectrograms of the sources, with an appended one for the residual.
+    """
+    eps = torch.finfo(v.dtype).eps
+
+    # spectrogram of the mixture
+    vx = torch.clamp(_norm(x)**(alpha / 2.), min=eps)
+
+    # scale the provided spectrograms frequency-wise to fit the mixture
+    v_total = torch.sum(v, dim=-1)
+    gain = (
+        torch.sum(vx * v_total, dim=0, keepdim=True) /
+        (eps + torch.sum(v_total**2, dim=0, keepdim=True))
+    )
+    v_g = v * gain[..., None]
+
+    # residual is the difference between the observation and the model
+    vr = torch.clamp(vx - v_total, min=0)
+
+    return torch.cat([v_g, vr[..., None]], -1)
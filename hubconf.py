@@ -1,13 +1,31 @@
 import utils
-import torch.hub
+import store
 
 
 # Optional list of dependencies required by the package
 dependencies = ['torch', 'numpy']
 
+# urls of the weights of the pre-trained models, the filenames end with the
+# first digits of the sha256 hash of the weights, see `store.import_weights`
+target_urls = {
+    'umxhq': {
+        'bass': 'https://zenodo.org/api/files/1c8f83c5-33a5-4f59-b109-721fdd234875/bass-8d85a5bd.pth',
+        'drums': 'https://zenodo.org/api/files/1c8f83c5-33a5-4f59-b109-721fdd234875/drums-9619578f.pth',
+        'other': 'https://zenodo.org/api/files/1c8f83c5-33a5-4f59-b109-721fdd234875/other-b52fbbf7.pth',
+        'vocals': 'https://zenodo.org/api/files/1c8f83c5-33a5-4f59-b109-721fdd234875/vocals-b62c91ce.pth'
+    },
+    'umx': {
+        'bass': 'https://zenodo.org/api/files/d6105b95-8c52-430c-84ce-bd14b803faaf/bass-646024d3.pth',
+        'drums': 'https://zenodo.org/api/files/d6105b95-8c52-430c-84ce-bd14b803faaf/drums-5a48008b.pth',
+        'other': 'https://zenodo.org/api/files/d6105b95-8c52-430c-84ce-bd14b803faaf/other-f8e132cc.pth',
+        'vocals': 'https://zenodo.org/api/files/d6105b95-8c52-430c-84ce-bd14b803faaf/vocals-c8df74a5.pth'
+    }
+}
+
 
 def umxhq(
-    target='vocals', device='cpu', pretrained=True, *args, **kwargs
+    target='vocals', device='cpu', pretrained=True, quantize=False,
+    *args, **kwargs
 ):
     """
     Open Unmix 2-channel/stereo BiLSTM Model trained on MUSDB18-HQ
@@ -18,16 +36,10 @@ def umxhq(
                         ['vocals', 'drums', 'bass', 'other']
         pretrained (bool): If True, returns a model pre-trained on MUSDB18-HQ
         device (str): selects device to be used for inference
+        quantize (bool): If True, returns an int8 dynamic quantized model
+                         for CPU inference
     """
-    # set urls for weights
-    target_urls = {
-        'bass': 'https://zenodo.org/api/files/1c8f83c5-33a5-4f59-b109-721fdd234875/bass-8d85a5bd.pth',
-        'drums': 'https://zenodo.org/api/files/1c8f83c5-33a5-4f59-b109-721fdd234875/drums-9619578f.pth',
-        'other': 'https://zenodo.org/api/files/1c8f83c5-33a5-4f59-b109-721fdd234875/other-b52fbbf7.pth',
-        'vocals': 'https://zenodo.org/api/files/1c8f83c5-33a5-4f59-b109-721fdd234875/vocals-b62c91ce.pth'
-    }
-
-    from model import OpenUnmix
+    from model import OpenUnmix, quantize as quantize_model
 
     # determine the maximum bin count for a 16khz bandwidth model
     max_bin = utils.bandwidth_to_max_bin(
@@ -47,19 +59,25 @@ def umxhq(
 
     # enable centering of stft to minimize reconstruction error
     if pretrained:
-        state_dict = torch.hub.load_state_dict_from_url(
-            target_urls[target],
+        state_dict = store.load_state_dict(
+            target_urls['umxhq'][target],
+            model_name='umxhq',
+            target=target,
             map_location=device
         )
         unmix.load_state_dict(state_dict)
         unmix.stft.center = True
         unmix.eval()
 
-    return unmix.to(device)
+    unmix = unmix.to(device)
+    if quantize:
+        unmix = quantize_model(unmix.eval())
+    return unmix
 
 
 def umx(
-    target='vocals', device='cpu', pretrained=True, *args, **kwargs
+    target='vocals', device='cpu', pretrained=True, quantize=False,
+    *args, **kwargs
 ):
     """
     Open Unmix 2-channel/stereo BiLSTM Model trained on MUSDB18
@@ -70,16 +88,10 @@ def umx(
                         ['vocals', 'drums', 'bass', 'other']
         pretrained (bool): If True, returns a model pre-trained on MUSDB18-HQ
         device (str): selects device to be used for inference
+        quantize (bool): If True, returns an int8 dynamic quantized model
+                         for CPU inference
     """
-    # set urls for weights
-    target_urls = {
-        'bass': 'https://zenodo.org/api/files/d6105b95-8c52-430c-84ce-bd14b803faaf/bass-646024d3.pth',
-        'drums': 'https://zenodo.org/api/files/d6105b95-8c52-430c-84ce-bd14b803faaf/drums-5a48008b.pth',
-        'other': 'https://zenodo.org/api/files/d6105b95-8c52-430c-84ce-bd14b803faaf/other-f8e132cc.pth',
-        'vocals': 'https://zenodo.org/api/files/d6105b95-8c52-430c-84ce-bd14b803faaf/vocals-c8df74a5.pth'
-    }
-
-    from model import OpenUnmix
+    from model import OpenUnmix, quantize as quantize_model
 
     # determine the maximum bin count for a 16khz bandwidth model
     max_bin = utils.bandwidth_to_max_bin(
@@ -99,12 +111,17 @@ def umx(
 
     # enable centering of stft to minimize reconstruction error
     if pretrained:
-        state_dict = torch.hub.load_state_dict_from_url(
-            target_urls[target],
+        state_dict = store.load_state_dict(
+            target_urls['umx'][target],
+            model_name='umx',
+            target=target,
             map_location=device
         )
         unmix.load_state_dict(state_dict)
         unmix.stft.center = True
         unmix.eval()
 
-    return unmix.to(device)
+    unmix = unmix.to(device)
+    if quantize:
+        unmix = quantize_model(unmix.eval())
+    return unmix
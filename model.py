@@ -55,6 +55,80 @@ class STFT(nn.Module):
         return stft_f
 
 
+class ISTFT(nn.Module):
+    def __init__(
+        self,
+        n_fft=4096,
+        n_hop=1024,
+        center=False
+    ):
+        """
+        Inverse of `STFT` using a windowed overlap-add with the same
+        window and centering.
+        """
+        super(ISTFT, self).__init__()
+        self.window = nn.Parameter(
+            torch.hann_window(n_fft),
+            requires_grad=False
+        )
+        self.n_fft = n_fft
+        self.n_hop = n_hop
+        self.center = center
+
+    def forward(self, X, length=None):
+        """
+        Input: (..., nb_bins, nb_frames, 2)
+            e.g. (nb_targets, nb_samples, nb_channels, nb_bins, nb_frames, 2)
+        Output:(..., nb_timesteps)
+        """
+        shape = X.shape[:-3]
+        nb_bins, nb_frames = X.shape[-3], X.shape[-2]
+
+        # merge all leading dimensions to invert them in one batch
+        X = X.reshape(-1, nb_bins, nb_frames, 2).transpose(1, 2)
+
+        # (nb_batch, nb_frames, n_fft)
+        frames = torch.irfft(
+            X, 1, onesided=True, signal_sizes=(self.n_fft,)
+        ) * self.window
+
+        # overlap-add frames and the squared window for normalization
+        x = self.overlap_add(frames)
+        norm = self.overlap_add(
+            (self.window**2).expand(1, nb_frames, self.n_fft)
+        )[0]
+        x = x / torch.where(norm > 1e-10, norm, torch.ones_like(norm))
+        nb_timesteps = x.shape[-1]
+
+        if self.center:
+            x = x[:, self.n_fft // 2:nb_timesteps - self.n_fft // 2]
+        if length is not None:
+            x = x[:, :length]
+
+        return x.reshape(shape + (x.shape[-1],))
+
+    def overlap_add(self, frames):
+        """
+        Input: (nb_batch, nb_frames, n_fft)
+        Output:(nb_batch, (nb_frames - 1) * n_hop + n_fft)
+        """
+        nb_batch, nb_frames, n_fft = frames.shape
+        # split frames into hop sized segments, so that the overlap-add
+        # becomes a sum of shifted segments
+        nb_segments = -(-n_fft // self.n_hop)
+        frames = F.pad(frames, (0, nb_segments * self.n_hop - n_fft))
+        frames = frames.reshape(nb_batch, nb_frames, nb_segments, self.n_hop)
+
+        x = frames.new_zeros(
+            nb_batch, nb_frames + nb_segments - 1, self.n_hop
+        )
+        for k in range(nb_segments):
+            x[:, k:k + nb_frames] += frames[:, :, k]
+
+        nb_timesteps = (nb_frames - 1) * self.n_hop + n_fft
+        return x.reshape(nb_batch, -1)[:, :nb_timesteps]
+
+
 class Spectrogram(nn.Module):
     def __init__(
         self,
@@ -187,21 +261,117 @@ class OpenUnmix(nn.Module):
             torch.ones(self.nb_output_bins).float()
         )
 
+        # set by `fuse`
+        self.fused = False
+
+    def folded_linear_layers(self):
+        """
+        Returns the `(weight, bias)` of `fc1`, `fc2` and `fc3` of the eval
+        mode model, with the input scaler, the batch norms and the output
+        scaler folded in. The model is then equivalent to
+
+            x = tanh(fc1(x)), x = relu(fc2([x, lstm(x)])), x = fc3(x)
+        """
+        if self.fused:
+            return [
+                (fc.weight, fc.bias) for fc in [self.fc1, self.fc2, self.fc3]
+            ]
+
+        nb_channels = self.fc3.out_features // self.nb_output_bins
+        with torch.no_grad():
+            # input scaler: fc1((x + mean) * scale)
+            input_scale = self.input_scale.repeat(nb_channels)
+            input_mean = self.input_mean.repeat(nb_channels)
+            weight = self.fc1.weight * input_scale
+            bias = self.fc1.weight @ (input_mean * input_scale)
+            fc1 = _fold_batchnorm(weight, bias, self.bn1)
+
+            fc2 = _fold_batchnorm(self.fc2.weight, None, self.bn2)
+
+            # output scaler: bn3(fc3(x)) * scale + mean
+            weight, bias = _fold_batchnorm(self.fc3.weight, None, self.bn3)
+            output_scale = self.output_scale.repeat(nb_channels)
+            output_mean = self.output_mean.repeat(nb_channels)
+            fc3 = (
+                weight * output_scale[:, None],
+                bias * output_scale + output_mean
+            )
+        return [fc1, fc2, fc3]
+
+    def fuse(self):
+        """
+        Folds the input scaler, the batch norms and the output scaler into
+        `fc1`, `fc2` and `fc3` (see `folded_linear_layers`), which removes
+        these normalization passes from the forward pass. The model has to
+        be in eval mode and can not be trained afterwards, its state dict
+        differs from the unfused model. Returns the model.
+        """
+        if self.training:
+            raise ValueError('fuse requires an eval mode model')
+        if self.fused:
+            return self
+
+        for name, (weight, bias) in zip(
+            ['fc1', 'fc2', 'fc3'], self.folded_linear_layers()
+        ):
+            fc = Linear(weight.shape[1], weight.shape[0], bias=True)
+            fc.weight = Parameter(weight, requires_grad=False)
+            fc.bias = Parameter(bias, requires_grad=False)
+            setattr(self, name, fc)
+
+        self.bn1 = NoOp()
+        self.bn2 = NoOp()
+        self.bn3 = NoOp()
+        self.fused = True
+        return self
+
     def forward(self, x):
         # check for waveform or spectrogram
         # transform to spectrogram if (nb_samples, nb_channels, nb_timesteps)
         # and reduce feature dimensions, therefore we reshape
         x = self.transform(x)
-        nb_frames, nb_samples, nb_channels, nb_bins = x.data.shape
+        return self.forward_spectrogram(x)
+
+    def forward_spectrogram(self, x, lengths=None):
+        """
+        Input: Power/Mag Spectrogram
+            (nb_frames, nb_samples, nb_channels, nb_bins)
+            and optionally the number of valid frames of each sample,
+            for batches of zero-padded spectrograms
+        Output: Power/Mag Spectrogram
+            (nb_frames, nb_samples, nb_channels, nb_bins)
+        """
+        return self.forward_stateful(x, lengths=lengths)[0]
+
+    def forward_stateful(self, x, state=None, lengths=None):
+        """
+        Input: Power/Mag Spectrogram
+            (nb_frames, nb_samples, nb_channels, nb_bins)
+            and the LSTM state `(h, c)` returned by a previous call or `None`
+        Output: Power/Mag Spectrogram
+            (nb_frames, nb_samples, nb_channels, nb_bins)
+            and the LSTM state `(h, c)` after the last frame
+
+        For unidirectional models, processing consecutive blocks of frames
+        while passing on the state is equivalent to processing all frames
+        at once.
+        If `lengths` is given, the LSTM skips the padded frames of each
+        sample, so that the valid frames match the unpadded results.
+        """
+        nb_frames, nb_samples, nb_channels, nb_bins = x.shape
 
-        mix = x.detach().clone()
+        # the input is never modified in-place, no copy needed
+        mix = x.detach()
 
         # crop
         x = x[..., :self.nb_bins]
 
-        # shift and scale input to mean=0 std=1 (across all bins)
-        x += self.input_mean
-        x *= self.input_scale
+        if not self.fused:
+            # shift and scale input to mean=0 std=1 (across all bins)
+            # not in-place, the input spectrogram may be shared with other
+            # models
+            x = x + self.input_mean
+            x *= self.input_scale
 
         # to (nb_frames*nb_samples, nb_channels*nb_bins)
         # and encode to (nb_frames*nb_samples, hidden_size)
@@ -213,7 +383,7 @@ class OpenUnmix(nn.Module):
         x = torch.tanh(x)
 
         # apply 3-layers of stacked LSTM
-        lstm_out = self.lstm(x)
+        lstm_out = _lstm(self.lstm, x, state, lengths)
 
         # lstm skip connection
         x = torch.cat([x, lstm_out[0]], -1)
@@ -231,11 +401,262 @@ class OpenUnmix(nn.Module):
         # reshape back to original dim
         x = x.reshape(nb_frames, nb_samples, nb_channels, self.nb_output_bins)
 
-        # apply output scaling
-        x *= self.output_scale
-        x += self.output_mean
+        if not self.fused:
+            # apply output scaling
+            x *= self.output_scale
+            x += self.output_mean
+
+        # since our output is non-negative, we can apply RELU
+        x = F.relu(x) * mix
+
+        return x, lstm_out[1]
+
+
+def _lstm(lstm, x, state=None, lengths=None):
+    """
+    Applies `lstm` to `x`, skipping the padded frames beyond `lengths`
+    """
+    if lengths is None:
+        return lstm(x, state)
+
+    nb_frames = x.shape[0]
+    x = nn.utils.rnn.pack_padded_sequence(x, lengths, enforce_sorted=False)
+    out, state = lstm(x, state)
+    out, _ = nn.utils.rnn.pad_packed_sequence(out, total_length=nb_frames)
+    return out, state
+
+
+def _fold_batchnorm(weight, bias, bn):
+    """
+    Folds an eval-mode `BatchNorm1d` into the preceding linear map
+    `y = x @ weight.T + bias`, returning the new `(weight, bias)`
+    """
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    if bias is None:
+        bias = torch.zeros_like(bn.running_mean)
+    weight = weight * scale[:, None]
+    bias = (bias - bn.running_mean) * scale + bn.bias
+    return weight, bias
+
+
+def quantization_available():
+    """Returns if torch supports dynamic quantization (torch >= 1.3)"""
+    return hasattr(getattr(torch, 'quantization', None), 'quantize_dynamic')
+
+
+def bfloat16_available():
+    """
+    Returns if the Linear and LSTM layers run in bfloat16 on the CPU, which
+    requires a more recent torch than 1.2
+    """
+    global _bfloat16_available
+    if _bfloat16_available is None:
+        try:
+            x = torch.zeros(1, 1, 2, dtype=torch.bfloat16)
+            with torch.no_grad():
+                LSTM(2, 2).to(torch.bfloat16)(Linear(2, 2).to(x.dtype)(x))
+            _bfloat16_available = True
+        except (AttributeError, RuntimeError, TypeError):
+            _bfloat16_available = False
+    return _bfloat16_available
+
+
+# result of `bfloat16_available`, checked once per process
+_bfloat16_available = None
+
+
+def quantize(unmix):
+    """
+    Returns a copy of the eval mode model `unmix` with int8 dynamic
+    quantized LSTM and Linear layers for CPU inference: the weights are
+    stored as int8, the activations are quantized on the fly.
+    Requires torch >= 1.3.
+    """
+    if not quantization_available():
+        raise RuntimeError(
+            'dynamic quantization requires torch >= 1.3, found torch %s'
+            % torch.__version__
+        )
+    return torch.quantization.quantize_dynamic(
+        unmix, {LSTM, Linear}, dtype=torch.qint8
+    )
+
+
+class FusedOpenUnmix(nn.Module):
+    def __init__(self, unmixes):
+        """
+        Evaluates several OpenUnmix target models in one pass.
+        The spectrogram is computed once and shared between the targets,
+        the per-target dense layers are stacked and evaluated as batched
+        matrix products. Batch norms and input/output scalers are folded
+        into the dense layers, therefore the models have to be in eval mode.
+
+        Input: (nb_samples, nb_channels, nb_timesteps)
+            or (nb_frames, nb_samples, nb_channels, nb_bins)
+        Output: Power/Mag Spectrogram
+                (nb_targets, nb_frames, nb_samples, nb_channels, nb_bins)
+        """
+
+        super(FusedOpenUnmix, self).__init__()
+
+        unmixes = list(unmixes)
+        ref = unmixes[0]
+        for unmix in unmixes:
+            if unmix.training:
+                raise ValueError('FusedOpenUnmix requires eval mode models')
+            if not isinstance(unmix.fc1, Linear):
+                raise ValueError('Quantized models cannot be fused')
+            if (
+                unmix.nb_bins != ref.nb_bins or
+                unmix.nb_output_bins != ref.nb_output_bins or
+                unmix.hidden_size != ref.hidden_size or
+                unmix.fc3.out_features != ref.fc3.out_features
+            ):
+                raise ValueError('All target models must share one topology')
+
+        self.nb_targets = len(unmixes)
+        self.nb_bins = ref.nb_bins
+        self.nb_output_bins = ref.nb_output_bins
+        self.hidden_size = ref.hidden_size
+        self.nb_channels = ref.fc3.out_features // ref.nb_output_bins
+
+        self.stft = ref.stft
+        self.spec = ref.spec
+        self.transform = ref.transform
+
+        # the LSTMs stay native modules, a python level recurrence over
+        # stacked weights is considerably slower than the builtin kernels
+        self.lstms = nn.ModuleList([unmix.lstm for unmix in unmixes])
+
+        fc1_weight, fc1_bias = [], []
+        fc2_weight, fc2_bias = [], []
+        fc3_weight, fc3_bias = [], []
+        for unmix in unmixes:
+            fc1, fc2, fc3 = unmix.folded_linear_layers()
+            fc1_weight.append(fc1[0])
+            fc1_bias.append(fc1[1])
+            fc2_weight.append(fc2[0])
+            fc2_bias.append(fc2[1])
+            fc3_weight.append(fc3[0])
+            fc3_bias.append(fc3[1])
+
+        # fc1 shares its input between targets: one (in, T*hidden) matrix
+        self.register_buffer(
+            'fc1_weight', torch.cat(fc1_weight, 0).t().contiguous()
+        )
+        self.register_buffer('fc1_bias', torch.cat(fc1_bias, 0))
+        # (nb_targets, in, out) for batched matrix products
+        self.register_buffer(
+            'fc2_weight', torch.stack(fc2_weight).transpose(1, 2).contiguous()
+        )
+        self.register_buffer('fc2_bias', torch.stack(fc2_bias)[:, None, :])
+        self.register_buffer(
+            'fc3_weight', torch.stack(fc3_weight).transpose(1, 2).contiguous()
+        )
+        self.register_buffer('fc3_bias', torch.stack(fc3_bias)[:, None, :])
+
+    def forward(self, x):
+        x = self.transform(x)
+        return self.forward_spectrogram(x)
+
+    def forward_spectrogram(self, x, lengths=None):
+        """
+        Input: Power/Mag Spectrogram
+            (nb_frames, nb_samples, nb_channels, nb_bins)
+            and optionally the number of valid frames of each sample,
+            see `OpenUnmix.forward_stateful`
+        Output: Power/Mag Spectrogram
+            (nb_targets, nb_frames, nb_samples, nb_channels, nb_bins)
+        """
+        nb_frames, nb_samples, nb_channels, nb_bins = x.shape
+
+        mix = x.detach()
+
+        # crop and encode all targets at once to
+        # (nb_frames*nb_samples, nb_targets*hidden_size)
+        x = x[..., :self.nb_bins].reshape(-1, nb_channels*self.nb_bins)
+        x = torch.addmm(self.fc1_bias, x, self.fc1_weight)
+        x = torch.tanh(x)
+
+        # to (nb_targets, nb_frames, nb_samples, hidden_size)
+        x = x.reshape(
+            nb_frames, nb_samples, self.nb_targets, self.hidden_size
+        ).permute(2, 0, 1, 3)
+
+        # the LSTMs are not fused, each target runs its own LSTM on its
+        # slice of the stacked activations
+        lstm_out = torch.stack(
+            [
+                _lstm(lstm, x[j], None, lengths)[0]
+                for j, lstm in enumerate(self.lstms)
+            ]
+        )
+
+        # lstm skip connection
+        x = torch.cat([x, lstm_out], -1)
+
+        # dense stages for all targets
+        x = x.reshape(self.nb_targets, -1, x.shape[-1])
+        x = torch.baddbmm(self.fc2_bias, x, self.fc2_weight)
+        x = F.relu(x)
+        x = torch.baddbmm(self.fc3_bias, x, self.fc3_weight)
+
+        # reshape back to original dim
+        x = x.reshape(
+            self.nb_targets, nb_frames, nb_samples,
+            nb_channels, self.nb_output_bins
+        )
 
         # since our output is non-negative, we can apply RELU
         x = F.relu(x) * mix
 
         return x
+
+
+class OpenUnmixBundle(nn.Module):
+    def __init__(self, unmixes, fused=False, input_is_spectrogram=False):
+        """
+        Models of all targets with a shared STFT front end. The models
+        have to share the STFT and spectrogram setup.
+        If `fused`, the models are evaluated in one batched pass,
+        see `FusedOpenUnmix`.
+
+        Input: (nb_samples, nb_channels, nb_timesteps)
+            or (nb_frames, nb_samples, nb_channels, nb_bins)
+        Output: target spectrograms
+                (nb_targets, nb_frames, nb_samples, nb_channels, nb_bins)
+                and, if the input is a waveform, the mixture STFT
+                (nb_samples, nb_channels, nb_bins, nb_frames, 2)
+        """
+        super(OpenUnmixBundle, self).__init__()
+        ref = unmixes[0]
+        for unmix in unmixes:
+            if (
+                unmix.spec.power != ref.spec.power or
+                unmix.spec.mono != ref.spec.mono
+            ):
+                raise ValueError(
+                    'All target models must share the spectrogram setup'
+                )
+
+        self.stft = ref.stft
+        self.spec = ref.spec
+        self.input_is_spectrogram = input_is_spectrogram
+        self.fused = fused and len(unmixes) > 1
+        if self.fused:
+            self.unmixes = nn.ModuleList([FusedOpenUnmix(unmixes)])
+        else:
+            self.unmixes = nn.ModuleList(unmixes)
+
+    def forward(self, x):
+        if self.input_is_spectrogram:
+            return self.forward_spectrogram(x)
+        X = self.stft(x)
+        return self.forward_spectrogram(self.spec(X)), X
+
+    def forward_spectrogram(self, x):
+        if self.fused:
+            return self.unmixes[0].forward_spectrogram(x)
+        return torch.stack(
+            [unmix.forward_spectrogram(x) for unmix in self.unmixes]
+        )
@@ -0,0 +1,407 @@
+"""
+Local separation service.
+
+Keeps the models loaded in a long running process and separates the audio
+files posted to `http://<host>:<port>/separate`. Requests that arrive within
+`--max-latency` seconds are grouped and separated in one batch using
+`test.separate_batch`. Queue depth and latency percentiles are reported at
+`http://<host>:<port>/stats`.
+
+Start the service with
+
+    python server.py --model umxhq --port 8000
+
+and separate a file with `separate_remote` or from the command line
+
+    python server.py --client track.wav --port 8000
+"""
+import argparse
+import collections
+import http.server
+import io
+import json
+import queue
+import socketserver
+import threading
+import time
+import urllib.request
+import numpy as np
+import soundfile as sf
+import torch
+import test
+
+
+class SeparationQueue(object):
+    """
+    Queue of separation requests that are separated in batches by a
+    background thread.
+
+    Parameters
+    ----------
+    max_batch_size: int
+        maximum number of requests that are separated in one batch
+
+    max_latency: float
+        maximum time in seconds the first request of a batch waits for
+        further requests before the batch is separated
+
+    nb_latencies: int
+        number of most recent requests used for the latency statistics
+
+    kwargs:
+        all other parameters are passed to `test.separate_batch`
+    """
+    def __init__(
+        self,
+        max_batch_size=8,
+        max_latency=0.1,
+        nb_latencies=1000,
+        **kwargs
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.kwargs = kwargs
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=nb_latencies)
+        self.batch_sizes = collections.deque(maxlen=nb_latencies)
+        self.nb_requests = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, audio):
+        """
+        Separates `audio` and blocks until the estimates are available.
+
+        Parameters
+        ----------
+        audio: np.ndarray [shape=(nb_timesteps, nb_channels)]
+            mixture audio
+
+        Returns
+        -------
+        estimates: `dict` [`str`, `np.ndarray`]
+            see `test.separate`
+        """
+        request = {
+            'audio': audio,
+            'arrival': time.time(),
+            'done': threading.Event(),
+        }
+        self.requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['estimates']
+
+    def next_batch(self):
+        """Waits for a request and collects further ones until the deadline"""
+        batch = [self.requests.get()]
+        deadline = batch[0]['arrival'] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                estimates = test.separate_batch(
+                    [request['audio'] for request in batch], **self.kwargs
+                )
+                for request, request_estimates in zip(batch, estimates):
+                    request['estimates'] = request_estimates
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+
+            now = time.time()
+            with self.lock:
+                self.batch_sizes.append(len(batch))
+                for request in batch:
+                    self.latencies.append(now - request['arrival'])
+                self.nb_requests += len(batch)
+            for request in batch:
+                request['done'].set()
+
+    def stats(self):
+        """Returns the queue depth and latency percentiles in seconds"""
+        with self.lock:
+            latencies = list(self.latencies)
+            batch_sizes = list(self.batch_sizes)
+            nb_requests = self.nb_requests
+
+        stats = {
+            'queue_depth': self.requests.qsize(),
+            'nb_requests': nb_requests,
+            'mean_batch_size': (
+                float(np.mean(batch_sizes)) if batch_sizes else None
+            ),
+        }
+        for percentile in [50, 90, 99]:
+            stats['latency_p%d' % percentile] = (
+                float(np.percentile(latencies, percentile))
+                if latencies else None
+            )
+        return stats
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP server handling each request in a thread, as
+    `http.server.ThreadingHTTPServer` of python 3.7+"""
+    daemon_threads = True
+
+
+class SeparationHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles `POST /separate` with an audio file as body, responding with
+    the estimates as `.npz` archive, and `GET /stats` responding with the
+    statistics of the queue as json.
+    """
+    def send(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_message(self, code, message):
+        self.send(code, message.encode(), 'text/plain')
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error_message(404, 'unknown path %s' % self.path)
+            return
+        body = json.dumps(self.server.separation_queue.stats())
+        self.send(200, body.encode(), 'application/json')
+
+    def do_POST(self):
+        if self.path != '/separate':
+            self.send_error_message(404, 'unknown path %s' % self.path)
+            return
+
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        try:
+            audio = test.read_audio(io.BytesIO(data), self.server.samplerate)
+        except Exception as e:
+            self.send_error_message(400, 'could not read audio: %s' % e)
+            return
+
+        try:
+            estimates = self.server.separation_queue.submit(audio)
+        except Exception as e:
+            self.send_error_message(500, 'separation failed: %s' % e)
+            return
+
+        body = io.BytesIO()
+        np.savez(body, **estimates)
+        self.send(200, body.getvalue(), 'application/octet-stream')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(
+    host='localhost',
+    port=8000,
+    samplerate=44100,
+    verbose=False,
+    **kwargs
+):
+    """
+    Creates the separation server, use `port=0` to pick a free port.
+    The models are loaded before the server is returned.
+
+    Parameters
+    ----------
+    samplerate: int
+        model samplerate, posted audio files are resampled to it
+
+    kwargs:
+        all other parameters are passed to `SeparationQueue`
+
+    Returns
+    -------
+    server: `ThreadingHTTPServer`
+        call `server.serve_forever()` to start serving
+    """
+    # load the models once, so that they stay in the `test.model_cache`
+    test.load_models(
+        kwargs['targets'],
+        model_name=kwargs.get('model_name', 'umxhq'),
+        device=kwargs.get('device', 'cpu'),
+        quantize=kwargs.get('quantize', False),
+        dtype=kwargs.get('dtype', torch.float32)
+    )
+    server = ThreadingHTTPServer((host, port), SeparationHandler)
+    server.separation_queue = SeparationQueue(**kwargs)
+    server.samplerate = samplerate
+    server.verbose = verbose
+    return server
+
+
+def separate_remote(audio, url='http://localhost:8000', samplerate=44100):
+    """
+    Separates `audio` using a running separation server.
+
+    Parameters
+    ----------
+    audio: np.ndarray [shape=(nb_timesteps, nb_channels)]
+        mixture audio
+
+    url: str
+        address of the server
+
+    samplerate: int
+        samplerate of `audio`
+
+    Returns
+    -------
+    estimates: `dict` [`str`, `np.ndarray`]
+        see `test.separate`
+    """
+    body = io.BytesIO()
+    sf.write(body, audio, samplerate, format='WAV', subtype='FLOAT')
+    request = urllib.request.Request(
+        url + '/separate',
+        data=body.getvalue(),
+        headers={'Content-Type': 'audio/wav'}
+    )
+    with urllib.request.urlopen(request) as response:
+        estimates = np.load(io.BytesIO(response.read()))
+        return {name: estimates[name] for name in estimates.files}
+
+
+def server_stats(url='http://localhost:8000'):
+    """Returns the statistics of a running separation server"""
+    with urllib.request.urlopen(url + '/stats') as response:
+        return json.loads(response.read().decode())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        add_help=False
+    )
+
+    parser.add_argument(
+        '--targets',
+        nargs='+',
+        default=['vocals', 'drums', 'bass', 'other'],
+        type=str,
+        help='provide targets to be processed. \
+              If none, all available targets will be computed'
+    )
+
+    parser.add_argument(
+        '--model',
+        default='umxhq',
+        type=str,
+        help='path to mode base directory of pretrained models'
+    )
+
+    parser.add_argument(
+        '--host',
+        default='localhost',
+        type=str,
+        help='host name the server listens on'
+    )
+
+    parser.add_argument(
+        '--port',
+        default=8000,
+        type=int,
+        help='port the server listens on'
+    )
+
+    parser.add_argument(
+        '--max-batch-size',
+        default=8,
+        type=int,
+        help='maximum number of requests that are separated in one batch'
+    )
+
+    parser.add_argument(
+        '--max-latency',
+        default=0.1,
+        type=float,
+        help='maximum time in seconds a request waits for further '
+             'requests to be batched with'
+    )
+
+    parser.add_argument(
+        '--no-cuda',
+        action='store_true',
+        default=False,
+        help='disables CUDA inference'
+    )
+
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='log every request'
+    )
+
+    parser.add_argument(
+        '--client',
+        type=str,
+        nargs='+',
+        help='instead of starting a server, send these files to a '
+             'running server and write the estimates to `--outdir`'
+    )
+
+    parser.add_argument(
+        '--outdir',
+        type=str,
+        help='Results path of the client'
+    )
+
+    args, _ = parser.parse_known_args()
+    args = test.inference_args(parser, args)
+    url = 'http://{}:{}'.format(args.host, args.port)
+
+    if args.client:
+        for input_file in args.client:
+            audio = test.read_audio(input_file, args.samplerate)
+            estimates = separate_remote(audio, url, args.samplerate)
+            test.write_estimates(
+                estimates,
+                test.output_dir(input_file, args.model, args.outdir),
+                args.samplerate
+            )
+        print(json.dumps(server_stats(url), indent=2))
+    else:
+        use_cuda = not args.no_cuda and torch.cuda.is_available()
+        server = make_server(
+            host=args.host,
+            port=args.port,
+            samplerate=args.samplerate,
+            verbose=args.verbose,
+            max_batch_size=args.max_batch_size,
+            max_latency=args.max_latency,
+            targets=args.targets,
+            model_name=args.model,
+            niter=args.niter,
+            alpha=args.alpha,
+            softmask=args.softmask,
+            residual_model=args.residual_model,
+            device=torch.device("cuda" if use_cuda else "cpu"),
+            fused=args.fused,
+            wiener_backend=args.wiener_backend,
+            backend=args.backend,
+            quantize=args.quantize,
+            dtype=getattr(torch, args.dtype),
+            nb_cores=args.threads,
+            nb_workers=args.target_workers
+        )
+        print('serving on {}'.format(url))
+        server.serve_forever()
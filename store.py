@@ -0,0 +1,281 @@
+"""
+Local store of pre-trained weights.
+
+The weights of the pre-trained models (`umxhq`, `umx`) are kept in a
+content-addressed directory, `objects/<sha256>.pth`, and every model has an
+index `models/<model>.json` that maps its targets to the hashes. The store
+is located at `$UMX_STORE` and defaults to `~/.cache/open-unmix`.
+
+`hubconf.py` and `test.load_model` resolve the weights from the store and
+only download them when they are missing. With `UMX_OFFLINE=1` the network
+is never used and missing weights are an error. To populate the store of an
+air-gapped machine, download the `.pth` files from Zenodo and import them,
+their hash is verified against the suffix of the filename:
+
+    python store.py import --model umxhq path/to/umxhq-weights
+
+or download all targets of a model on a machine with network access:
+
+    python store.py fetch --model umxhq
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import urllib.parse
+from pathlib import Path
+import torch
+
+
+def store_root(root=None):
+    """Returns the root directory of the store"""
+    if root is None:
+        root = os.environ.get('UMX_STORE', '~/.cache/open-unmix')
+    return Path(root).expanduser()
+
+
+def is_offline(offline=None):
+    """Returns `offline`, or if it is None, if `UMX_OFFLINE` is set"""
+    if offline is None:
+        return os.environ.get('UMX_OFFLINE', '') not in ('', '0')
+    return offline
+
+
+def sha256sum(path, chunk_size=1 << 20):
+    """Returns the hex sha256 digest of the file at `path`"""
+    digest = hashlib.sha256()
+    with open(str(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_filename(filename):
+    """
+    Splits a weight filename `<target>-<hash prefix>.pth` as used on
+    torch.hub into the target and the hash prefix, which is None for
+    `<target>.pth`
+    """
+    match = re.match(
+        r'^(.+?)(?:-([0-9a-f]{8,64}))?\.pth$', Path(filename).name
+    )
+    if match is None:
+        raise ValueError('%s is not a .pth file' % filename)
+    return match.group(1), match.group(2)
+
+
+def _write_atomic(path, write):
+    """Writes `path` with `write(f)` through a temporary file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+        os.replace(tmp, str(path))
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def download_url_to_file(url, path):
+    """Downloads `url` to `path`"""
+    # torch < 1.4 only provides the private `_download_url_to_file`
+    download = getattr(torch.hub, 'download_url_to_file', None)
+    if download is None:
+        download = torch.hub._download_url_to_file
+    download(url, str(path), None, False)
+
+
+def read_index(model_name, root=None):
+    """Returns the targets of `model_name` in the store and their entries"""
+    path = store_root(root) / 'models' / (model_name + '.json')
+    if not path.exists():
+        return {}
+    with open(str(path), 'r') as f:
+        return json.load(f)
+
+
+def resolve(model_name, target, root=None):
+    """
+    Returns the path of the weights of `target` of `model_name`, or None
+    if they are not in the store. The weights are not hashed again, they
+    were verified when they were imported.
+    """
+    entry = read_index(model_name, root).get(target)
+    if entry is None:
+        return None
+    path = store_root(root) / 'objects' / (entry['sha256'] + '.pth')
+    return path if path.exists() else None
+
+
+def import_weights(path, model_name, target=None, filename=None, root=None):
+    """
+    Adds the weights file `path` to the store as `target` of `model_name`.
+
+    Parameters
+    ----------
+    target: str or None
+        defaults to the target in the filename, see `parse_filename`
+
+    filename: str or None
+        name of the file used for the target and the hash prefix, defaults
+        to the name of `path`
+
+    Returns
+    -------
+    sha256: str
+        hex digest of the weights
+
+    Raises
+    ------
+    ValueError
+        if the hash of the file does not match the hash prefix of its name
+    """
+    path = Path(path)
+    file_target, prefix = parse_filename(filename or path.name)
+    target = target or file_target
+    sha256 = sha256sum(path)
+    if prefix is not None and not sha256.startswith(prefix):
+        raise ValueError(
+            'hash of %s (%s) does not match its filename' % (path, sha256)
+        )
+
+    root = store_root(root)
+    obj = root / 'objects' / (sha256 + '.pth')
+    if not obj.exists():
+        obj.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(obj.parent), suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(str(path), tmp)
+        os.replace(tmp, str(obj))
+
+    index = read_index(model_name, root)
+    index[target] = {'sha256': sha256, 'filename': filename or path.name}
+    _write_atomic(
+        root / 'models' / (model_name + '.json'),
+        lambda f: json.dump(index, f, indent=2, sort_keys=True)
+    )
+    return sha256
+
+
+def import_path(path, model_name, root=None):
+    """
+    Imports a `.pth` file or all `.pth` files of a directory, see
+    `import_weights`. Returns a dict of the imported targets and hashes.
+    """
+    path = Path(path)
+    files = sorted(path.glob('*.pth')) if path.is_dir() else [path]
+    imported = {}
+    for weights in files:
+        target = parse_filename(weights.name)[0]
+        imported[target] = import_weights(weights, model_name, root=root)
+    return imported
+
+
+def fetch(url, model_name, target, root=None, offline=None):
+    """
+    Returns the path of the weights of `target` of `model_name`, downloading
+    them from `url` into the store if they are missing.
+
+    Raises
+    ------
+    RuntimeError
+        if the weights are missing in offline mode
+    """
+    path = resolve(model_name, target, root)
+    if path is not None:
+        return path
+    if is_offline(offline):
+        raise RuntimeError(
+            'weights of %s/%s are not in the store %s, import them with '
+            '`python store.py import` or unset UMX_OFFLINE'
+            % (model_name, target, store_root(root))
+        )
+
+    filename = Path(urllib.parse.urlparse(url).path).name
+    tmp_dir = store_root(root) / 'tmp'
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=str(tmp_dir)) as tmp:
+        download = Path(tmp, filename)
+        download_url_to_file(url, download)
+        import_weights(
+            download, model_name, target=target, filename=filename, root=root
+        )
+    return resolve(model_name, target, root)
+
+
+def load_state_dict(url, model_name, target, map_location=None, **kwargs):
+    """
+    Loads the state dict of `target` of `model_name` from the store, see
+    `fetch` for the remaining parameters
+    """
+    path = fetch(url, model_name, target, **kwargs)
+    return torch.load(str(path), map_location=map_location)
+
+
+def verify(root=None):
+    """Returns the paths of all objects whose content does not match"""
+    return [
+        path for path in sorted((store_root(root) / 'objects').glob('*.pth'))
+        if sha256sum(path) != path.stem
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        '--root',
+        type=str,
+        help='store directory, defaults to $UMX_STORE or ~/.cache/open-unmix'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    import_parser = subparsers.add_parser(
+        'import', help='import .pth files or directories of .pth files'
+    )
+    import_parser.add_argument('paths', nargs='+', type=str)
+    import_parser.add_argument(
+        '--model', type=str, required=True, help='name of the model'
+    )
+
+    fetch_parser = subparsers.add_parser(
+        'fetch', help='download all targets of a pre-trained model'
+    )
+    fetch_parser.add_argument(
+        '--model', type=str, default='umxhq', help='name of the model'
+    )
+
+    subparsers.add_parser('list', help='list the models in the store')
+    subparsers.add_parser('verify', help='check the hashes of all weights')
+
+    args = parser.parse_args()
+    if args.command == 'import':
+        for path in args.paths:
+            for target, sha256 in import_path(
+                path, args.model, root=args.root
+            ).items():
+                print('{}/{} {}'.format(args.model, target, sha256))
+    elif args.command == 'fetch':
+        import hubconf
+        for target, url in hubconf.target_urls[args.model].items():
+            fetch(url, args.model, target, root=args.root, offline=False)
+            print('{}/{} {}'.format(args.model, target, url))
+    elif args.command == 'list':
+        models = (store_root(args.root) / 'models').glob('*.json')
+        for model_name in sorted(path.stem for path in models):
+            index = read_index(model_name, args.root)
+            for target, entry in sorted(index.items()):
+                print('{}/{} {}'.format(model_name, target, entry['sha256']))
+    elif args.command == 'verify':
+        corrupted = verify(args.root)
+        for path in corrupted:
+            print('corrupted: {}'.format(path))
+        if corrupted:
+            raise SystemExit(1)
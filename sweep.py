@@ -0,0 +1,315 @@
+"""
+Grid search of the wiener filter post-processing on MUSDB18.
+
+The models run once per track, their target spectrograms `V` and the
+mixture STFT `X` are then post-processed with every combination of the
+given `--niter`, `--alpha`, `--softmask` and `--residual-model` values and
+scored with BSSEval. The median scores of every track, target and setting
+are written to one csv table and summarized per setting:
+
+    python sweep.py --model umxhq --niter 0 1 2 --alpha 1 2 --softmask 0 1
+
+With `--cache-dir`, `V` and `X` are also kept on disk, so that further
+sweeps on the same tracks skip the models altogether.
+"""
+import argparse
+import csv
+import itertools
+import json
+import utils
+import test
+
+# heavy modules are loaded on first use, see `utils.lazy_import`
+np = utils.lazy_import('numpy')
+torch = utils.lazy_import('torch')
+tqdm = utils.lazy_import('tqdm')
+musdb = utils.lazy_import('musdb')
+museval = utils.lazy_import('museval')
+
+METRICS = ['SDR', 'SIR', 'ISR', 'SAR']
+
+
+def grid(niter=(1,), alpha=(1.0,), softmask=(False,), residual_model=(False,)):
+    """Returns all combinations of the post-processing parameters as dicts"""
+    return [
+        dict(niter=n, alpha=a, softmask=s, residual_model=r)
+        for n, a, s, r in itertools.product(
+            niter, alpha, softmask, residual_model
+        )
+    ]
+
+
+def spectrograms(track, targets, model_name='umxhq', cache=None, **kwargs):
+    """
+    Returns the target spectrograms `V`, the mixture STFT `X` and the STFT
+    of the models for `track`, see `test.estimate`. They are read from
+    `cache`, an `utils.EstimateCache`, if they were computed before.
+    """
+    stft = test.load_models(targets, model_name=model_name, **{
+        name: kwargs[name] for name in ['device', 'quantize', 'dtype']
+        if name in kwargs
+    })[0].stft
+    if cache is not None:
+        key = utils.EstimateCache.key(
+            track=track.name,
+            stage='spectrograms',
+            **test.model_signature(targets, model_name, **kwargs)
+        )
+        cached = cache.get(key)
+        if cached is not None:
+            return (
+                torch.from_numpy(cached['V']), torch.from_numpy(cached['X']),
+                stft
+            )
+
+    V, X, stft = test.estimate(
+        track.audio, targets, model_name=model_name, **kwargs
+    )
+    if cache is not None:
+        cache.put(key, {'V': V.cpu().numpy(), 'X': X.cpu().numpy()})
+    return V, X, stft
+
+
+def score(track, estimates):
+    """
+    Returns the median BSSEval scores over all frames of `estimates`
+    as dict of targets and dicts of metrics
+    """
+    scores = json.loads(museval.eval_mus_track(track, estimates).json)
+    return {
+        target['name']: {
+            metric: float(np.nanmedian([
+                frame['metrics'][metric] for frame in target['frames']
+            ]))
+            for metric in METRICS
+        }
+        for target in scores['targets']
+    }
+
+
+def sweep_track(
+    track, configs, targets, model_name='umxhq', wiener_backend='norbert',
+    cache=None, **kwargs
+):
+    """
+    Separates `track` with every post-processing setting in `configs`
+    from a single pass of the models and returns a list of result rows.
+
+    Parameters
+    ----------
+    configs: list of dict
+        keyword arguments of `test.separate_spectrograms`, see `grid`
+
+    cache: `utils.EstimateCache` or None
+        cache of the model outputs, see `spectrograms`
+
+    kwargs:
+        all other parameters are passed to `test.estimate`
+
+    Returns
+    -------
+    rows: list of dict
+        parameters and median scores of every setting and target
+    """
+    V, X, stft = spectrograms(
+        track, targets, model_name=model_name, cache=cache, **kwargs
+    )
+    rows = []
+    for config in configs:
+        estimates = test.separate_spectrograms(
+            V, X, targets, wiener_backend=wiener_backend,
+            n_fft=stft.n_fft, n_hop=stft.n_hop, **config
+        )
+        for target, metrics in score(track, estimates).items():
+            row = dict(config, track=track.name, target=target)
+            row.update(metrics)
+            rows.append(row)
+    return rows
+
+
+def summarize(rows):
+    """
+    Returns the median scores over all tracks for every setting and target
+    """
+    groups = {}
+    for row in rows:
+        key = tuple(
+            (name, row[name])
+            for name in ['niter', 'alpha', 'softmask', 'residual_model',
+                         'target']
+        )
+        groups.setdefault(key, []).append(row)
+    return [
+        dict(
+            key,
+            nb_tracks=len(group),
+            **{
+                metric: float(np.nanmedian([row[metric] for row in group]))
+                for metric in METRICS
+            }
+        )
+        for key, group in groups.items()
+    ]
+
+
+def write_table(rows, path):
+    """Writes `rows` as csv file"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_table(rows):
+    columns = list(rows[0])
+    print(' '.join('{:>14}'.format(column) for column in columns))
+    for row in rows:
+        print(' '.join(
+            '{:14.3f}'.format(row[c]) if isinstance(row[c], float)
+            else '{:>14}'.format(str(row[c]))
+            for c in columns
+        ))
+
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise argparse.ArgumentTypeError('boolean value expected')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument(
+        '--targets',
+        nargs='+',
+        default=['vocals', 'drums', 'bass', 'other'],
+        type=str,
+        help='provide targets to be processed'
+    )
+
+    parser.add_argument(
+        '--model',
+        default='umxhq',
+        type=str,
+        help='path to mode base directory of pretrained models'
+    )
+
+    parser.add_argument(
+        '--niter',
+        nargs='+',
+        type=int,
+        default=[0, 1],
+        help='numbers of EM iterations of the sweep'
+    )
+
+    parser.add_argument(
+        '--alpha',
+        nargs='+',
+        type=float,
+        default=[1.0],
+        help='softmask exponents of the sweep'
+    )
+
+    parser.add_argument(
+        '--softmask',
+        nargs='+',
+        type=parse_bool,
+        default=[False, True],
+        help='softmask settings of the sweep, e.g. `0 1`'
+    )
+
+    parser.add_argument(
+        '--residual-model',
+        nargs='+',
+        type=parse_bool,
+        default=[False],
+        help='residual model settings of the sweep, e.g. `0 1`'
+    )
+
+    parser.add_argument(
+        '--wiener-backend',
+        choices=['norbert', 'torch'],
+        default='norbert',
+        help='implementation of the wiener filter post-processing'
+    )
+
+    parser.add_argument(
+        '--root',
+        type=str,
+        help='Path to MUSDB18'
+    )
+
+    parser.add_argument(
+        '--subset',
+        type=str,
+        default='train',
+        help='MUSDB subset (`train`/`test`)'
+    )
+
+    parser.add_argument(
+        '--split',
+        type=str,
+        default='valid',
+        help='MUSDB split of the subset (`train`/`valid`), '
+             'only used for the `train` subset'
+    )
+
+    parser.add_argument(
+        '--is-wav',
+        action='store_true', default=False,
+        help='flags wav version of the dataset'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help='directory where the model outputs are kept between sweeps'
+    )
+
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='sweep.csv',
+        help='csv file of the scores of every track, target and setting'
+    )
+
+    parser.add_argument(
+        '--no-cuda',
+        action='store_true',
+        default=False,
+        help='disables CUDA inference'
+    )
+
+    args = parser.parse_args()
+
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    mus = musdb.DB(
+        root=args.root,
+        download=args.root is None,
+        subsets=args.subset,
+        split=args.split if args.subset == 'train' else None,
+        is_wav=args.is_wav
+    )
+    cache = utils.EstimateCache(args.cache_dir) if args.cache_dir else None
+    configs = grid(
+        niter=args.niter, alpha=args.alpha, softmask=args.softmask,
+        residual_model=args.residual_model
+    )
+
+    rows = []
+    for track in tqdm.tqdm(mus.tracks):
+        rows += sweep_track(
+            track, configs, args.targets, model_name=args.model,
+            wiener_backend=args.wiener_backend, cache=cache, device=device
+        )
+
+    write_table(rows, args.output)
+    print_table(summarize(rows))
@@ -1,28 +1,142 @@
-import torch
-import numpy as np
 import argparse
-import soundfile as sf
-import norbert
+import hashlib
 import json
 from pathlib import Path
-import scipy.signal
-import resampy
-import model
 import utils
 import warnings
-import tqdm
 from contextlib import redirect_stderr
 import io
+import queue
+import concurrent.futures
+import threading
+import time
 
+# heavy modules are loaded on first use, so that the command line interface
+# starts without them, see `utils.lazy_import`
+torch = utils.lazy_import('torch')
+np = utils.lazy_import('numpy')
+sf = utils.lazy_import('soundfile')
+norbert = utils.lazy_import('norbert')
+tqdm = utils.lazy_import('tqdm')
+model = utils.lazy_import('model')
+filtering = utils.lazy_import('filtering')
+store = utils.lazy_import('store')
+hubconf = utils.lazy_import('hubconf')
 
-def load_model(target, model_name='umxhq', device='cpu'):
+
+# process wide cache of loaded models, shared by all `load_model` calls.
+# Use `model_cache.resize(n)` to change the number of kept models.
+model_cache = utils.LRUCache(maxsize=8)
+
+# digests of the model weights, see `weights_hash`
+weights_hashes = utils.LRUCache(maxsize=8)
+
+# onnxruntime sessions used by `estimate_spectrograms`, see `onnx_session`
+onnx_sessions = utils.LRUCache(maxsize=4)
+
+# fused models used by `estimate_spectrograms`, see `fused_model`
+fused_models = utils.LRUCache(maxsize=4)
+
+
+def load_model(
+    target, model_name='umxhq', device='cpu', dtype=None,
+    cache=True, quantize=False
+):
     """
     target model path can be either <target>.pth, or <target>-sha256.pth
-    (as used on torchub)
+    (as used on torchub). The weights of the pre-trained models are
+    resolved from the local weight store, see `store`.
+
+    Loaded models are kept in `model_cache`, keyed by
+    (model_name, target, device, dtype, quantize), so that repeated calls
+    return the same (shared) model instance instead of reloading the
+    weights. Set `cache=False` to always load a fresh copy.
+
+    If `quantize`, the LSTM and Linear layers are int8 dynamic quantized,
+    see `model.quantize`. Quantized models run on the CPU only.
+
+    For reduced precision dtypes (`torch.bfloat16`, `torch.float16`), the
+    STFT front end is kept in float32. `dtype` defaults to `torch.float32`.
+    bfloat16 on the cpu requires a torch version with bfloat16 kernels of
+    the LSTM and Linear layers, see `model.bfloat16_available`.
+    """
+    if dtype is None:
+        dtype = torch.float32
+    if quantize and (
+        torch.device(device).type != 'cpu' or dtype != torch.float32
+    ):
+        raise ValueError('Quantized models require float32 on the cpu')
+    if (
+        dtype == torch.bfloat16 and torch.device(device).type == 'cpu' and
+        not model.bfloat16_available()
+    ):
+        raise RuntimeError(
+            'bfloat16 models are not supported on the cpu by torch %s'
+            % torch.__version__
+        )
+
+    key = _model_key(target, model_name, device, dtype, quantize)
+    if cache:
+        unmix = model_cache.get(key)
+        if unmix is not None:
+            return unmix
+
+    unmix = _load_model(target, model_name=key[0], device=device)
+    unmix.to(dtype)
+    if torch.finfo(dtype).bits < 32:
+        unmix.stft.float()
+    if quantize:
+        unmix = model.quantize(unmix)
+
+    if cache:
+        model_cache.put(key, unmix)
+    return unmix
+
+
+def _model_key(target, model_name, device, dtype, quantize):
+    """Returns the key of a model in `model_cache`"""
+    model_path = Path(model_name).expanduser()
+    if model_path.exists():
+        model_name = model_path.resolve()
+    return (
+        str(model_name), target, str(torch.device(device)), dtype, quantize
+    )
+
+
+def cache_models(
+    unmixes, targets, model_name='umxhq', device='cpu', quantize=False,
+    dtype=None
+):
+    """
+    Adds models that were loaded elsewhere to `model_cache`, so that
+    `load_model` returns them instead of loading the weights again. E.g.
+    worker processes use it for models that were loaded once by the parent
+    process and moved to shared memory with `torch.nn.Module.share_memory`.
+    The parameters are the ones of the `load_models` call that returned
+    `unmixes`.
     """
+    if dtype is None:
+        dtype = torch.float32
+    for target, unmix in zip(targets, unmixes):
+        model_cache.put(
+            _model_key(target, model_name, device, dtype, quantize), unmix
+        )
+
+
+def _load_model(target, model_name='umxhq', device='cpu'):
     model_path = Path(model_name).expanduser()
-    if not model_path.exists():
+    if not model_path.exists() and str(model_name) in hubconf.target_urls:
+        # pre-trained model, the weights are resolved from the local
+        # `store` without resolving the repository on torch.hub
+        return getattr(hubconf, str(model_name))(
+            target=target, device=device, pretrained=True
+        )
+    elif not model_path.exists():
         # model path does not exist, use hubconf model
+        if store.is_offline():
+            raise NameError(
+                'Model %s is not available offline' % model_name
+            )
         try:
             # disable progress bar
             err = io.StringIO()
@@ -60,7 +174,8 @@ def load_model(target, model_name='umxhq', device='cpu'):
             n_hop=results['args']['nhop'],
             nb_channels=results['args']['nb_channels'],
             hidden_size=results['args']['hidden_size'],
-            max_bin=max_bin
+            max_bin=max_bin,
+            unidirectional=results['args'].get('unidirectional', False)
         )
 
         unmix.load_state_dict(state)
@@ -71,14 +186,16 @@ def load_model(target, model_name='umxhq', device='cpu'):
 
 
 def istft(X, rate=44100, n_fft=4096, n_hopsize=1024):
-    t, audio = scipy.signal.istft(
-        X / (n_fft / 2),
-        rate,
-        nperseg=n_fft,
-        noverlap=n_fft - n_hopsize,
-        boundary=True
-    )
-    return audio
+    """
+    Inverts a centered complex STFT of shape (..., nb_bins, nb_frames),
+    all leading dimensions are inverted in one batch.
+    Returns audio of shape (..., nb_timesteps)
+    """
+    # view complex64 as interleaved (real, imag) float32 pairs
+    X = np.ascontiguousarray(X, dtype=np.complex64)
+    X = torch.from_numpy(X.view(np.float32).reshape(X.shape + (2,)))
+    audio = model.ISTFT(n_fft=n_fft, n_hop=n_hopsize, center=True)(X)
+    return audio.numpy()
 
 
 def separate(
@@ -86,7 +203,9 @@ def separate(
     targets,
     model_name='umxhq',
     niter=1, softmask=False, alpha=1.0,
-    residual_model=False, device='cpu'
+    residual_model=False, device='cpu', fused=False,
+    wiener_backend='norbert', backend='torch', quantize=False,
+    dtype=None, nb_cores=None, nb_workers=1
 ):
     """
     Performing the separation on audio input
@@ -124,59 +243,1065 @@ def separate(
     device: str
         set torch device. Defaults to `cpu`.
 
+    fused: boolean
+        evaluate all target models in one batched pass using
+        `model.FusedOpenUnmix`. Requires all target models to share the
+        same topology, defaults to False
+
+    wiener_backend: str
+        implementation of the wiener filter, either `norbert` (numpy,
+        complex128) or `torch` (see `filtering.py`, float32, runs on
+        `device`). Defaults to `norbert`.
+
+    backend: str
+        runtime of the models, either `torch`, `onnxruntime` (the models
+        are exported to ONNX on first use, see `export.export_onnx`) or the
+        path of a graph exported with `export.py onnx`, exported with the
+        same `targets` in the same order. Defaults to `torch`.
+
+    quantize: boolean
+        use int8 dynamic quantized LSTM and Linear layers, see
+        `model.quantize`. Runs on the cpu only and requires torch >= 1.3,
+        defaults to False
+
+    dtype: torch.dtype or None
+        dtype of the models, e.g. `torch.bfloat16` for reduced precision
+        inference on the cpu (see `model.bfloat16_available`). The STFT,
+        the wiener filter and the ISTFT are computed in float32 or higher.
+        Defaults to None, i.e. `torch.float32`.
+
+    nb_cores: int or None
+        number of torch intra-op threads used by the separation, the
+        previous setting is restored afterwards. Defaults to None, which
+        keeps the current setting.
+
+    nb_workers: int
+        number of target models that are evaluated concurrently, each with
+        an even share of the threads, defaults to 1
+
     Returns
     -------
     estimates: `dict` [`str`, `np.ndarray`]
         dictionary of all restimates as performed by the separation model.
 
     """
+    with utils.torch_threads(nb_cores):
+        V, X, stft = estimate(
+            audio, targets, model_name=model_name, device=device,
+            fused=fused, backend=backend, quantize=quantize, dtype=dtype,
+            nb_workers=nb_workers
+        )
+        return separate_spectrograms(
+            V, X, targets,
+            niter=niter, softmask=softmask, alpha=alpha,
+            residual_model=residual_model, wiener_backend=wiener_backend,
+            n_fft=stft.n_fft, n_hop=stft.n_hop
+        )
+
+
+def estimate(
+    audio,
+    targets,
+    model_name='umxhq',
+    device='cpu', fused=False, backend='torch', quantize=False,
+    dtype=None, nb_workers=1
+):
+    """
+    Computes the mixture STFT and the target spectrograms of a single input,
+    i.e. everything of `separate` that comes before the wiener filter.
+    `separate_spectrograms` turns them into estimates, so that several
+    post-processing settings can be applied to one model pass.
+
+    Parameters
+    ----------
+    audio: np.ndarray [shape=(nb_timesteps, nb_channels)]
+        mixture audio
+
+    targets, model_name, device, fused, backend, quantize, dtype,
+    nb_workers:
+        see `separate`
+
+    Returns
+    -------
+    V: torch.Tensor [shape=(nb_targets, nb_frames, nb_channels, nb_bins)]
+        target spectrograms
+    X: torch.Tensor [shape=(nb_channels, nb_bins, nb_frames, 2)]
+        mixture STFT
+    stft: `model.STFT`
+        STFT of the models
+    """
     # convert numpy audio to torch
     audio_torch = torch.tensor(audio.T[None, ...]).float().to(device)
 
-    source_names = []
-    V = []
+    unmixes = load_models(
+        targets, model_name=model_name, device=device, quantize=quantize,
+        dtype=dtype
+    )
+
+    # the mixture stft is computed once and shared by all targets
+    stft = unmixes[0].stft
+    with torch.no_grad():
+        X = stft(audio_torch)
+
+    V = estimate_spectrograms(
+        unmixes, X, fused=fused, backend=backend, nb_workers=nb_workers
+    )
+    # remove sample dim
+    return V[:, :, 0, ...], X[0], stft
+
+
+def separate_batch(
+    audios,
+    targets,
+    model_name='umxhq',
+    niter=1, softmask=False, alpha=1.0,
+    residual_model=False, device='cpu', fused=False,
+    wiener_backend='norbert', backend='torch', quantize=False,
+    dtype=None, nb_cores=None, nb_workers=1
+):
+    """
+    Performing the separation on a batch of audio inputs
+
+    The inputs may differ in length. The models process all inputs as one
+    zero-padded batch while skipping the padded frames, the wiener filter
+    is applied on each input separately. Results are identical to calling
+    `separate` for each input.
 
-    for j, target in enumerate(tqdm.tqdm(targets)):
-        unmix_target = load_model(
-            target=target,
-            model_name=model_name,
-            device=device
+    Parameters
+    ----------
+    audios: list of np.ndarray [shape=(nb_timesteps, nb_channels)]
+        mixture audio of each input
+
+    targets, model_name, niter, softmask, alpha, residual_model, device,
+    fused, wiener_backend, backend, quantize, dtype, nb_cores, nb_workers:
+        see `separate`
+
+    Returns
+    -------
+    estimates: list of `dict` [`str`, `np.ndarray`]
+        estimates of each input, see `separate`
+    """
+    unmixes = load_models(
+        targets, model_name=model_name, device=device, quantize=quantize,
+        dtype=dtype
+    )
+
+    with utils.torch_threads(nb_cores):
+        # the stft is computed on each input, so that the frames at the end
+        # of shorter inputs are not affected by padding
+        stft = unmixes[0].stft
+        with torch.no_grad():
+            Xs = [
+                stft(torch.tensor(audio.T[None, ...]).float().to(device))[0]
+                for audio in audios
+            ]
+        lengths = [X.shape[-2] for X in Xs]
+        X = torch.stack([
+            torch.nn.functional.pad(X, (0, 0, 0, max(lengths) - X.shape[-2]))
+            for X in Xs
+        ])
+
+        V = estimate_spectrograms(
+            unmixes, X, fused=fused, lengths=lengths, backend=backend,
+            nb_workers=nb_workers
         )
-        Vj = unmix_target(audio_torch).cpu().detach().numpy()
-        if softmask:
-            # only exponentiate the model if we use softmask
-            Vj = Vj**alpha
-        # output is nb_frames, nb_samples, nb_channels, nb_bins
-        V.append(Vj[:, 0, ...])  # remove sample dim
-        source_names += [target]
 
-    V = np.transpose(np.array(V), (1, 3, 2, 0))
+        return [
+            separate_spectrograms(
+                V[:, :length, j, ...], Xs[j], targets,
+                niter=niter, softmask=softmask, alpha=alpha,
+                residual_model=residual_model, wiener_backend=wiener_backend,
+                n_fft=stft.n_fft, n_hop=stft.n_hop
+            )
+            for j, length in enumerate(lengths)
+        ]
 
-    X = unmix_target.stft(audio_torch).detach().cpu().numpy()
-    # convert to complex numpy type
-    X = X[..., 0] + X[..., 1]*1j
-    X = X[0].transpose(2, 1, 0)
+
+def load_models(
+    targets, model_name='umxhq', device='cpu', quantize=False,
+    dtype=None
+):
+    """
+    Loads the models of all `targets`. The models have to share the same
+    STFT parameters, so that the mixture STFT can be shared between them.
+    """
+    unmixes = [
+        load_model(
+            target=target, model_name=model_name, device=device,
+            quantize=quantize, dtype=dtype
+        )
+        for target in tqdm.tqdm(targets)
+    ]
+
+    stft = unmixes[0].stft
+    for unmix in unmixes:
+        if (
+            unmix.stft.n_fft != stft.n_fft or
+            unmix.stft.n_hop != stft.n_hop or
+            unmix.stft.center != stft.center
+        ):
+            raise ValueError('All target models must share the STFT setup')
+
+    return unmixes
+
+
+def _weights_file(target, model_name='umxhq'):
+    """
+    Returns the weights file of `target` of `model_name`, or None for
+    models that are loaded with `torch.hub.load`
+    """
+    model_path = Path(model_name).expanduser()
+    if model_path.exists():
+        return next(model_path.glob("%s*.pth" % target))
+    if str(model_name) in hubconf.target_urls:
+        return store.fetch(
+            hubconf.target_urls[str(model_name)][target],
+            str(model_name), target
+        )
+    return None
+
+
+def weights_hash(targets, model_name='umxhq'):
+    """
+    Returns the sha256 hex digest of the weights of the models of `targets`,
+    which identifies the estimates of these models, e.g. in an
+    `utils.EstimateCache`. The weight files are hashed, so that no further
+    copy of the models is loaded. The digests are kept in `weights_hashes`.
+    """
+    key = (_model_key(None, model_name, 'cpu', None, False)[0],) + tuple(
+        targets
+    )
+    digest = weights_hashes.get(key)
+    if digest is not None:
+        return digest
+
+    sha256 = hashlib.sha256()
+    for target in targets:
+        sha256.update(target.encode())
+        path = _weights_file(target, model_name)
+        if path is not None:
+            sha256.update(store.sha256sum(path).encode())
+            continue
+        # models of torch.hub repositories are only available as modules
+        unmix = load_model(target, model_name=model_name)
+        for name, value in sorted(unmix.state_dict().items()):
+            sha256.update(name.encode())
+            sha256.update(value.detach().cpu().contiguous().numpy().tobytes())
+    digest = sha256.hexdigest()
+    weights_hashes.put(key, digest)
+    return digest
+
+
+def model_signature(
+    targets, model_name='umxhq', fused=False, backend='torch',
+    quantize=False, dtype=None, **kwargs
+):
+    """
+    Returns the parameters of `separate` that select the models and their
+    runtime as dict of json serializable values, e.g. as part of the keys of
+    an `utils.EstimateCache`. All other keyword arguments are ignored.
+    """
+    return dict(
+        weights=weights_hash(targets, model_name),
+        targets=list(targets),
+        fused=fused,
+        backend=backend,
+        quantize=quantize,
+        dtype=str(dtype or torch.float32)
+    )
+
+
+def estimate_spectrograms(
+    unmixes, X, fused=False, lengths=None, backend='torch', nb_workers=1
+):
+    """
+    Computes the spectrograms of all targets from a shared mixture STFT
+
+    Parameters
+    ----------
+    unmixes: list of `model.OpenUnmix`
+        models of all targets, see `load_models`
+
+    X: torch.Tensor [shape=(nb_samples, nb_channels, nb_bins, nb_frames, 2)]
+        mixture STFT
+
+    fused: boolean
+        evaluate all models in one batched pass, see `separate`
+
+    lengths: list of int or None
+        number of valid frames of each sample of a zero-padded batch
+
+    backend: str
+        runtime of the models, see `separate`
+
+    nb_workers: int
+        number of target models that are evaluated concurrently, each with
+        an even share of the current torch intra-op threads
+
+    Returns
+    -------
+    V: torch.Tensor
+        [shape=(nb_targets, nb_frames, nb_samples, nb_channels, nb_bins)]
+        target spectrograms
+    """
+    if backend != 'torch':
+        session = onnx_session(unmixes, backend, fused=fused)
+        with torch.no_grad():
+            spec = unmixes[0].spec(X).cpu()
+
+        def run(spec):
+            V = session.run(None, {'spectrogram': spec.numpy()})[0]
+            return torch.from_numpy(V)
+
+        if lengths is None:
+            return run(spec).to(X.device)
+
+        # the graph has no notion of padding, run each sample on its
+        # valid frames
+        V = torch.zeros((len(unmixes),) + spec.shape)
+        for j, length in enumerate(lengths):
+            V[:, :length, j:j + 1] = run(spec[:length, j:j + 1])
+        return V.to(X.device)
+
+    # the magnitudes are computed in the dtype of the STFT and converted to
+    # the (possibly reduced precision) dtype of the models
+    dtype = unmixes[0].input_scale.dtype
+
+    with torch.no_grad():
+        if fused and len(unmixes) > 1:
+            fused_unmix = fused_model(unmixes, X.device)
+            return fused_unmix.forward_spectrogram(
+                fused_unmix.spec(X).to(dtype), lengths=lengths
+            ).to(X.dtype)
+
+        specs = {}
+        for unmix in unmixes:
+            # magnitudes are computed once per spectrogram setting
+            key = (unmix.spec.power, unmix.spec.mono)
+            if key not in specs:
+                specs[key] = unmix.spec(X).to(dtype)
+
+    def forward(unmix, nb_threads=None):
+        if nb_threads is not None:
+            torch.set_num_threads(nb_threads)
+        with torch.no_grad():
+            spec = specs[(unmix.spec.power, unmix.spec.mono)]
+            return unmix.forward_spectrogram(spec, lengths=lengths)
+
+    if nb_workers > 1 and len(unmixes) > 1:
+        nb_threads = max(1, torch.get_num_threads() // nb_workers)
+        # the intra-op threads are set in each worker thread (the pool
+        # initializer needs python 3.7), the current setting is restored in
+        # case the backend shares them
+        with utils.torch_threads(torch.get_num_threads()):
+            with concurrent.futures.ThreadPoolExecutor(nb_workers) as pool:
+                V = list(pool.map(
+                    forward, unmixes, [nb_threads] * len(unmixes)
+                ))
+    else:
+        V = [forward(unmix) for unmix in unmixes]
+    return torch.stack(V).to(X.dtype)
+
+
+def fused_model(unmixes, device='cpu'):
+    """
+    Returns the `model.FusedOpenUnmix` of `unmixes` on `device`, so that the
+    stacked weights are only built once. Fused models are kept in
+    `fused_models`.
+    """
+    key = tuple(id(unmix) for unmix in unmixes) + (str(device),)
+    entry = fused_models.get(key)
+    if entry is None:
+        # the models are kept with the fused model, so that their ids, used
+        # as key, are not reused by other models
+        entry = (unmixes, model.FusedOpenUnmix(unmixes).to(device))
+        fused_models.put(key, entry)
+    return entry[1]
+
+
+def onnx_session(unmixes, backend='onnxruntime', fused=False):
+    """
+    Returns an onnxruntime session of the spectrogram core of `unmixes`,
+    see `export.export_onnx`. With `backend='onnxruntime'` the models are
+    exported on first use, otherwise `backend` is the path of an exported
+    graph. Sessions are kept in `onnx_sessions`.
+    """
+    import onnxruntime
+    import export
+
+    if backend == 'onnxruntime':
+        key = tuple(id(unmix) for unmix in unmixes) + (fused,)
+    elif Path(backend).exists():
+        key = str(backend)
+    else:
+        raise ValueError('unknown backend {}'.format(backend))
+
+    entry = onnx_sessions.get(key)
+    if entry is None:
+        if backend == 'onnxruntime':
+            graph = io.BytesIO()
+            export.export_onnx(graph, unmixes, fused=fused)
+            graph = graph.getvalue()
+        else:
+            graph = str(backend)
+        session = onnxruntime.InferenceSession(
+            graph, providers=['CPUExecutionProvider']
+        )
+        # the models are kept with the session, so that their ids, used as
+        # key, are not reused by other models
+        entry = (unmixes, session)
+        onnx_sessions.put(key, entry)
+    return entry[1]
+
+
+def separate_spectrograms(
+    V, X, targets,
+    niter=1, softmask=False, alpha=1.0,
+    residual_model=False, wiener_backend='norbert',
+    n_fft=4096, n_hop=1024
+):
+    """
+    Applies the wiener filter post-processing and the inverse STFT to
+    the target spectrograms of a single input
+
+    Parameters
+    ----------
+    V: torch.Tensor [shape=(nb_targets, nb_frames, nb_channels, nb_bins)]
+        target spectrograms, see `estimate_spectrograms`
+
+    X: torch.Tensor [shape=(nb_channels, nb_bins, nb_frames, 2)]
+        mixture STFT
+
+    targets, niter, softmask, alpha, residual_model, wiener_backend:
+        see `separate`
+
+    n_fft, n_hop: int
+        STFT parameters of the models
+
+    Returns
+    -------
+    estimates: `dict` [`str`, `np.ndarray`]
+        dictionary of all restimates as performed by the separation model.
+    """
+    source_names = list(targets)
+
+    if softmask:
+        # only exponentiate the model if we use softmask
+        V = V**alpha
+
+    # to nb_frames, nb_bins, nb_channels, nb_sources
+    V = V.permute(1, 3, 2, 0)
+    # to nb_frames, nb_bins, nb_channels, 2
+    X = X.permute(2, 1, 0, 3)
 
     if residual_model or len(targets) == 1:
-        V = norbert.residual_model(V, X, alpha if softmask else 1)
         source_names += (['residual'] if len(targets) > 1
                          else ['accompaniment'])
 
-    Y = norbert.wiener(V, X.astype(np.complex128), niter,
-                       use_softmask=softmask)
+    if wiener_backend == 'torch':
+        if residual_model or len(targets) == 1:
+            V = filtering.residual_model(V, X, alpha if softmask else 1)
 
-    estimates = {}
-    for j, name in enumerate(source_names):
+        Y = filtering.wiener(V, X, niter, use_softmask=softmask)
+
+        # invert all sources and channels at once
+        istft_target = model.ISTFT(
+            n_fft=n_fft, n_hop=n_hop, center=True
+        ).to(X.device)
+        audio_hat = istft_target(Y.permute(3, 2, 1, 0, 4)).cpu().numpy()
+    elif wiener_backend == 'norbert':
+        V = V.cpu().numpy()
+        X = X.cpu().numpy()
+        # convert to complex numpy type
+        X = X[..., 0] + X[..., 1]*1j
+
+        if residual_model or len(targets) == 1:
+            V = norbert.residual_model(V, X, alpha if softmask else 1)
+
+        Y = norbert.wiener(V, X.astype(np.complex128), niter,
+                           use_softmask=softmask)
+
+        # invert all sources and channels at once
         audio_hat = istft(
-            Y[..., j].T,
-            n_fft=unmix_target.stft.n_fft,
-            n_hopsize=unmix_target.stft.n_hop
+            np.transpose(Y, (3, 2, 1, 0)),
+            n_fft=n_fft,
+            n_hopsize=n_hop
         )
-        estimates[name] = audio_hat.T
+    else:
+        raise ValueError('Unknown wiener backend: %s' % wiener_backend)
+
+    estimates = {}
+    for j, name in enumerate(source_names):
+        estimates[name] = audio_hat[j].T
 
     return estimates
 
 
+def separate_chunked(
+    audio,
+    targets,
+    chunk_size=44100 * 30,
+    chunk_overlap=44100 * 3,
+    **kwargs
+):
+    """
+    Performing the separation on consecutive, overlapping chunks of the
+    audio input. Results are crossfaded in the overlapping regions and
+    yielded block by block, so that the memory used by the separation does
+    not grow with the track length.
+
+    Parameters
+    ----------
+    audio: np.ndarray [shape=(nb_timesteps, nb_channels)]
+        mixture audio, any array supporting slicing along the first
+        axis (e.g. a `np.memmap`) can be used.
+
+    targets: list of str
+        a list of the separation targets.
+
+    chunk_size: int
+        number of samples of each processed chunk, defaults to 30 seconds
+        at 44.1 kHz.
+
+    chunk_overlap: int
+        number of samples that consecutive chunks overlap and that are
+        crossfaded, defaults to 3 seconds at 44.1 kHz.
+
+    kwargs:
+        all other parameters are passed to `separate`.
+
+    Yields
+    ------
+    estimates: `dict` [`str`, `np.ndarray`]
+        dictionary of consecutive blocks of the estimates.
+        Concatenating all blocks yields estimates with the length of `audio`.
+    """
+    nb_timesteps = audio.shape[0]
+    chunk_hop = chunk_size - chunk_overlap
+    if chunk_overlap < 0 or chunk_hop <= 0:
+        raise ValueError('chunk_overlap must be in [0, chunk_size)')
+
+    stft = load_models(targets, **{
+        name: kwargs[name] for name in ['model_name', 'device', 'quantize',
+                                        'dtype']
+        if name in kwargs
+    })[0].stft
+
+    # complementary linear crossfade
+    fade_in = (np.arange(chunk_overlap) + 0.5)[:, None] / chunk_overlap
+    fade_out = 1 - fade_in
+
+    start = 0
+    tails = None
+    while True:
+        end = start + chunk_size
+        if nb_timesteps - end < stft.n_fft:
+            # a tail shorter than the STFT window is merged into this chunk
+            end = nb_timesteps
+        is_last = end == nb_timesteps
+        # the chunk is separated with the samples around it as context,
+        # so that the padded STFT frames at its edges are not used, and
+        # trimmed afterwards
+        context = min(start, stft.n_fft)
+        estimates = separate(
+            audio[start - context:min(end + stft.n_fft, nb_timesteps)],
+            targets, **kwargs
+        )
+
+        blocks = {}
+        next_tails = {}
+        for name, estimate in estimates.items():
+            # at the end of the track, pad the istft output with zeros
+            estimate = estimate[context:]
+            estimate = np.pad(
+                estimate[:end - start],
+                ((0, max(0, end - start - estimate.shape[0])), (0, 0)),
+                mode='constant'
+            )
+            if tails is not None:
+                estimate[:chunk_overlap] = (
+                    estimate[:chunk_overlap] * fade_in +
+                    tails[name] * fade_out
+                )
+            if not is_last and chunk_overlap > 0:
+                next_tails[name] = estimate[-chunk_overlap:]
+                estimate = estimate[:-chunk_overlap]
+            blocks[name] = estimate
+
+        yield blocks
+        if is_last:
+            break
+
+        tails = next_tails if chunk_overlap > 0 else None
+        start += chunk_hop
+
+
+class StreamingSeparator(object):
+    """
+    Real-time separation of consecutive audio blocks using unidirectional
+    models. The STFT input buffer, the overlap-add output buffer and the
+    LSTM states are kept between calls of `process`.
+
+    The output stream is delayed by `n_fft - n_hop` samples, available as
+    the `latency` attribute, so the first `latency` output samples are
+    separated silence. As each block is only processed once it is
+    complete, the total algorithmic latency is `n_fft - n_hop + block_size`
+    samples (4096 samples, ~93ms, for the default STFT parameters and
+    block size).
+
+    Parameters
+    ----------
+    targets: list of str
+        a list of the separation targets.
+
+    model_name: str
+        name of torchhub model or path to model folder, the models need to
+        be trained with `--unidirectional`.
+
+    block_size: int
+        number of samples per processed block, has to be a multiple of
+        the STFT hop size. Defaults to 1024.
+
+    niter, softmask, alpha, residual_model, device:
+        see `separate`. As the wiener filter only sees the frames of the
+        current block, `niter=0` is the default.
+    """
+    def __init__(
+        self,
+        targets,
+        model_name='umxhq',
+        block_size=1024,
+        niter=0, softmask=False, alpha=1.0,
+        residual_model=False, device='cpu'
+    ):
+        self.unmixes = [
+            load_model(target=target, model_name=model_name, device=device)
+            for target in targets
+        ]
+        for unmix in self.unmixes:
+            if unmix.lstm.bidirectional:
+                raise ValueError('Streaming requires unidirectional models')
+
+        self.source_names = list(targets)
+        if residual_model or len(targets) == 1:
+            self.source_names += (['residual'] if len(targets) > 1
+                                  else ['accompaniment'])
+
+        self.n_fft = self.unmixes[0].stft.n_fft
+        self.n_hop = self.unmixes[0].stft.n_hop
+        if block_size % self.n_hop:
+            raise ValueError('block_size must be a multiple of the hop size')
+
+        self.block_size = block_size
+        self.latency = self.n_fft - self.n_hop
+        self.niter = niter
+        self.softmask = softmask
+        self.alpha = alpha
+        self.residual_model = residual_model
+        self.device = device
+
+        # frames are computed without padding from the buffered input
+        self.stft = model.STFT(
+            n_fft=self.n_fft, n_hop=self.n_hop, center=False
+        ).to(device)
+        self.window = self.stft.window.detach().cpu().numpy()
+        # normalization of the windowed overlap-add for every hop position
+        self.ola_norm = np.sum(
+            self.window.reshape(-1, self.n_hop)**2, axis=0
+        )
+        self.reset()
+
+    def reset(self):
+        """Resets all buffers and states to start a new stream"""
+        self.input_buffer = None
+        self.output_buffer = None
+        self.states = [None] * len(self.unmixes)
+
+    def process(self, block):
+        """
+        Separates the next block of the stream
+
+        Parameters
+        ----------
+        block: np.ndarray [shape=(block_size, nb_channels)]
+            next block of the mixture audio
+
+        Returns
+        -------
+        estimates: `dict` [`str`, `np.ndarray`]
+            dictionary of the estimated blocks of shape
+            (block_size, nb_channels), delayed by `latency` samples.
+        """
+        if block.shape[0] != self.block_size:
+            raise ValueError('Blocks must contain block_size samples')
+        nb_channels = block.shape[1]
+        nb_sources = len(self.source_names)
+        if self.input_buffer is None:
+            self.input_buffer = np.zeros((self.latency, nb_channels))
+            self.output_buffer = np.zeros(
+                (self.latency, nb_channels, nb_sources)
+            )
+
+        audio = np.concatenate([self.input_buffer, block])
+        self.input_buffer = audio[-self.latency:]
+        audio_torch = torch.tensor(audio.T[None, ...]).float().to(self.device)
+
+        with torch.no_grad():
+            X = self.stft(audio_torch)
+            V = []
+            for j, unmix in enumerate(self.unmixes):
+                Vj, self.states[j] = unmix.forward_stateful(
+                    unmix.spec(X), self.states[j]
+                )
+                V.append(Vj)
+            V = torch.stack(V).cpu().numpy()
+        if self.softmask:
+            V = V**self.alpha
+        V = np.transpose(V[:, :, 0, ...], (1, 3, 2, 0))
+
+        X = X.cpu().numpy()
+        X = X[..., 0] + X[..., 1]*1j
+        X = X[0].transpose(2, 1, 0)
+
+        if self.residual_model or len(self.unmixes) == 1:
+            V = norbert.residual_model(
+                V, X, self.alpha if self.softmask else 1
+            )
+
+        Y = norbert.wiener(V, X.astype(np.complex128), self.niter,
+                           use_softmask=self.softmask)
+
+        # windowed overlap-add of all frames of this block
+        frames = np.fft.irfft(Y, n=self.n_fft, axis=1)
+        frames *= self.window[None, :, None, None]
+        output = np.zeros((self.block_size + self.latency,) + Y.shape[2:])
+        output[:self.latency] = self.output_buffer
+        for t in range(frames.shape[0]):
+            output[t*self.n_hop:t*self.n_hop + self.n_fft] += frames[t]
+
+        self.output_buffer = output[self.block_size:]
+        output = output[:self.block_size]
+        output /= np.tile(self.ola_norm, self.block_size // self.n_hop)[
+            :, None, None
+        ]
+
+        return {
+            name: output[..., j] for j, name in enumerate(self.source_names)
+        }
+
+
+def _to_stereo(audio):
+    """Keeps the first two channels and duplicates mono to stereo"""
+    if audio.shape[1] > 2:
+        warnings.warn(
+            'Channel count > 2! '
+            'Only the first two channels will be processed!')
+        audio = audio[:, :2]
+
+    if audio.shape[1] == 1:
+        # if we have mono, let's duplicate it
+        # as the input of OpenUnmix is always stereo
+        audio = np.repeat(audio, 2, axis=1)
+    return audio
+
+
+def read_audio(input_file, samplerate=44100):
+    """
+    Reads an input file for the separation. Only the first two channels are
+    kept, the audio is resampled to `samplerate` and mono is duplicated to
+    stereo.
+
+    Returns
+    -------
+    audio: np.ndarray [shape=(nb_timesteps, nb_channels)]
+    """
+    audio, rate = sf.read(input_file, always_2d=True)
+
+    if rate != samplerate:
+        # resample to model samplerate if needed
+        audio = utils.resample(
+            torch.from_numpy(audio.T), rate, samplerate
+        ).numpy().T
+
+    return _to_stereo(audio)
+
+
+class AudioFile(object):
+    """
+    Audio file that is read from disk slice by slice, e.g. as input of
+    `separate_chunked`, so that the memory does not grow with the track
+    length. The slices are converted like `read_audio`, but not resampled.
+
+    Example
+    -------
+    >>> audio = AudioFile('track.wav')
+    >>> audio.shape
+    (13230000, 2)
+    >>> audio[44100:88200].shape
+    (44100, 2)
+    """
+    def __init__(self, input_file):
+        self.input_file = input_file
+        info = sf.info(input_file)
+        self.samplerate = info.samplerate
+        self.shape = (info.frames, 2)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise IndexError('AudioFile only supports contiguous slices')
+        start, stop, _ = index.indices(self.shape[0])
+        with sf.SoundFile(self.input_file) as f:
+            f.seek(start)
+            audio = f.read(max(0, stop - start), always_2d=True)
+        return _to_stereo(audio)
+
+
+def output_dir(input_file, model_name, outdir=None):
+    """
+    Returns (and creates) the output directory of the estimates of
+    `input_file`, defaults to `<input_stem>_<model_name>`
+    """
+    if not outdir:
+        model_path = Path(model_name)
+        if not model_path.exists():
+            outdir = Path(Path(input_file).stem + '_' + model_name)
+        else:
+            outdir = Path(Path(input_file).stem + '_' + model_path.stem)
+    else:
+        outdir = Path(outdir)
+    outdir.mkdir(exist_ok=True, parents=True)
+    return outdir
+
+
+def write_estimates(estimates, outdir, samplerate=44100):
+    """Writes the estimates of all targets as wav files to `outdir`"""
+    for target, estimate in estimates.items():
+        sf.write(
+            outdir / Path(target).with_suffix('.wav'),
+            estimate,
+            samplerate
+        )
+
+
+class EstimateWriter(object):
+    """
+    Output sink that writes the estimates of all targets block by block to
+    wav files in `outdir`, so that the full-length estimates never have to
+    be held in memory. The files are opened when the first block of their
+    target is written and closed with `close` or at the end of a `with`
+    block.
+
+    Parameters
+    ----------
+    outdir: str or Path
+        directory of the written files, `<target>.wav`
+
+    samplerate: int
+        samplerate of the estimates
+
+    subtype: str or None
+        soundfile subtype of the files, defaults to the soundfile default
+        for wav files, as used by `write_estimates`
+
+    Example
+    -------
+    >>> with EstimateWriter(outdir) as sink:
+    ...     for blocks in separate_chunked(audio, targets):
+    ...         sink.write(blocks)
+    """
+    def __init__(self, outdir, samplerate=44100, subtype=None):
+        self.outdir = Path(outdir)
+        self.samplerate = samplerate
+        self.subtype = subtype
+        self.files = {}
+
+    def write(self, blocks):
+        """
+        Appends `blocks`, a dict of target names and np.ndarray of shape
+        (nb_timesteps, nb_channels), to the files of the targets
+        """
+        for target, block in blocks.items():
+            if target not in self.files:
+                self.files[target] = sf.SoundFile(
+                    str(self.outdir / Path(target).with_suffix('.wav')),
+                    mode='w',
+                    samplerate=self.samplerate,
+                    channels=block.shape[1],
+                    subtype=self.subtype
+                )
+            self.files[target].write(block)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def separate_files(
+    input_files,
+    model_name='umxhq',
+    outdir=None,
+    samplerate=44100,
+    batch_size=1,
+    nb_readers=2,
+    nb_writers=2,
+    queue_size=4,
+    **kwargs
+):
+    """
+    Pipelined separation of a list of files. Reader threads decode and
+    resample the next inputs and writer threads encode the estimates, while
+    the main thread separates the current batch. The stages are connected
+    by bounded queues of `queue_size` items.
+
+    Parameters
+    ----------
+    input_files: list of str
+        paths of the input files
+
+    model_name: str
+        name of pretrained model or path to model directory, see
+        `separate_batch`
+
+    outdir: str
+        output directory, see `output_dir`
+
+    samplerate: int
+        model samplerate
+
+    batch_size: int
+        number of files that are separated in one batch
+
+    nb_readers, nb_writers: int
+        number of reader and writer threads
+
+    kwargs:
+        all other parameters are passed to `separate_batch`
+
+    Returns
+    -------
+    timings: `dict` [`str`, `utils.AverageMeter`]
+        seconds per file spent in each stage. `wait` is the time the
+        separation waited for inputs, a large value means that reading
+        limits the throughput.
+    """
+    timings = {
+        stage: utils.AverageMeter()
+        for stage in ['read', 'separate', 'write', 'wait']
+    }
+    files = queue.Queue()
+    for input_file in input_files:
+        files.put(input_file)
+    read_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                input_file = files.get_nowait()
+            except queue.Empty:
+                break
+            start = time.time()
+            try:
+                audio = read_audio(input_file, samplerate)
+            except Exception as e:
+                # raised by the separation as soon as it is dequeued
+                read_queue.put(e)
+                break
+            with lock:
+                timings['read'].update(time.time() - start)
+            read_queue.put((input_file, audio))
+        # signal the end of this reader
+        read_queue.put(None)
+
+    def writer():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            input_file, estimates = item
+            start = time.time()
+            try:
+                write_estimates(
+                    estimates,
+                    output_dir(input_file, model_name, outdir),
+                    samplerate
+                )
+            except Exception as e:
+                errors.append(e)
+            with lock:
+                timings['write'].update(time.time() - start)
+
+    threads = [
+        threading.Thread(target=reader, daemon=True)
+        for _ in range(nb_readers)
+    ]
+    threads += [
+        threading.Thread(target=writer, daemon=True)
+        for _ in range(nb_writers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    nb_running_readers = nb_readers
+    try:
+        while nb_running_readers:
+            # collect the next batch from the readers
+            batch = []
+            start = time.time()
+            while nb_running_readers and len(batch) < batch_size:
+                item = read_queue.get()
+                if item is None:
+                    nb_running_readers -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    batch.append(item)
+            if not batch:
+                break
+            timings['wait'].update(
+                (time.time() - start) / len(batch), len(batch)
+            )
+
+            start = time.time()
+            estimates = separate_batch(
+                [audio for _, audio in batch], model_name=model_name, **kwargs
+            )
+            timings['separate'].update(
+                (time.time() - start) / len(batch), len(batch)
+            )
+            for (input_file, _), file_estimates in zip(batch, estimates):
+                write_queue.put((input_file, file_estimates))
+    finally:
+        # also on errors, stop the readers, let the writers finish the
+        # queued estimates and join all threads
+        stop.set()
+        while nb_running_readers:
+            if read_queue.get() is None:
+                nb_running_readers -= 1
+        for _ in range(nb_writers):
+            write_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return timings
+
+
 def inference_args(parser, remaining_args):
     inf_parser = argparse.ArgumentParser(
         description=__doc__,
@@ -219,6 +1344,57 @@ def inference_args(parser, remaining_args):
         action='store_true',
         help='create a model for the residual'
     )
+
+    inf_parser.add_argument(
+        '--fused',
+        action='store_true',
+        help='evaluate all targets in one batched forward pass'
+    )
+
+    inf_parser.add_argument(
+        '--wiener-backend',
+        choices=['norbert', 'torch'],
+        default='norbert',
+        help='implementation of the wiener filter post-processing'
+    )
+
+    inf_parser.add_argument(
+        '--backend',
+        default='torch',
+        type=str,
+        help='runtime of the models: `torch`, `onnxruntime` or the path '
+             'of a graph exported with `export.py onnx`'
+    )
+
+    inf_parser.add_argument(
+        '--dtype',
+        choices=['float32', 'bfloat16'],
+        default='float32',
+        help='dtype of the models, the STFT and the wiener filter are '
+             'computed in float32 or higher'
+    )
+
+    inf_parser.add_argument(
+        '--threads',
+        type=int,
+        help='number of CPU cores (torch intra-op threads) used by the '
+             'separation, defaults to the torch default'
+    )
+
+    inf_parser.add_argument(
+        '--target-workers',
+        type=int,
+        default=1,
+        help='number of target models that are evaluated concurrently, '
+             'the --threads are split evenly between them'
+    )
+
+    inf_parser.add_argument(
+        '--quantize',
+        action='store_true',
+        default=False,
+        help='use int8 dynamic quantized models (cpu only)'
+    )
     return inf_parser.parse_args()
 
 
@@ -265,55 +1441,90 @@ if __name__ == '__main__':
         help='disables CUDA inference'
     )
 
-    args, _ = parser.parse_known_args()
-    args = inference_args(parser, args)
+    parser.add_argument(
+        '--chunk-dur',
+        type=float,
+        help='separate in chunks of this duration in seconds '
+             'to limit the memory usage on long inputs'
+    )
 
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
+    parser.add_argument(
+        '--chunk-overlap',
+        type=float,
+        default=3.0,
+        help='overlap of consecutive chunks in seconds'
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1,
+        help='number of input files that are separated in one batch'
+    )
 
-    for input_file in args.input:
-        # handling an input audio path
-        audio, rate = sf.read(input_file, always_2d=True)
+    parser.add_argument(
+        '--readers',
+        type=int,
+        default=2,
+        help='number of threads that read and resample the inputs'
+    )
+
+    parser.add_argument(
+        '--writers',
+        type=int,
+        default=2,
+        help='number of threads that write the estimates'
+    )
 
-        if audio.shape[1] > 2:
-            warnings.warn(
-                'Channel count > 2! '
-                'Only the first two channels will be processed!')
-            audio = audio[:, :2]
+    args = inference_args(parser, None)
 
-        if rate != args.samplerate:
-            # resample to model samplerate if needed
-            audio = resampy.resample(audio, rate, args.samplerate, axis=0)
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
 
-        if audio.shape[1] == 1:
-            # if we have mono, let's duplicate it
-            # as the input of OpenUnmix is always stereo
-            audio = np.repeat(audio, 2, axis=1)
+    separation_kwargs = dict(
+        targets=args.targets,
+        model_name=args.model,
+        niter=args.niter,
+        alpha=args.alpha,
+        softmask=args.softmask,
+        residual_model=args.residual_model,
+        device=device,
+        fused=args.fused,
+        wiener_backend=args.wiener_backend,
+        backend=args.backend,
+        quantize=args.quantize,
+        dtype=getattr(torch, args.dtype),
+        nb_cores=args.threads,
+        nb_workers=args.target_workers
+    )
 
-        estimates = separate(
-            audio,
-            targets=args.targets,
-            model_name=args.model,
-            niter=args.niter,
-            alpha=args.alpha,
-            softmask=args.softmask,
-            residual_model=args.residual_model,
-            device=device
-        )
-        if not args.outdir:
-            model_path = Path(args.model)
-            if not model_path.exists():
-                outdir = Path(Path(input_file).stem + '_' + args.model)
-            else:
-                outdir = Path(Path(input_file).stem + '_' + model_path.stem)
-        else:
-            outdir = Path(args.outdir)
-        outdir.mkdir(exist_ok=True, parents=True)
-
-        # write out estimates
-        for target, estimate in estimates.items():
-            sf.write(
-                outdir / Path(target).with_suffix('.wav'),
-                estimate,
+    if args.chunk_dur:
+        for input_file in args.input:
+            audio = AudioFile(input_file)
+            if audio.samplerate != args.samplerate:
+                # resampling needs the whole track
+                audio = read_audio(input_file, args.samplerate)
+            # the estimates are written block by block as they are separated
+            with EstimateWriter(
+                output_dir(input_file, args.model, args.outdir),
                 args.samplerate
-            )
+            ) as sink:
+                for blocks in separate_chunked(
+                    audio,
+                    chunk_size=int(args.chunk_dur * args.samplerate),
+                    chunk_overlap=int(args.chunk_overlap * args.samplerate),
+                    **separation_kwargs
+                ):
+                    sink.write(blocks)
+    else:
+        timings = separate_files(
+            args.input,
+            outdir=args.outdir,
+            samplerate=args.samplerate,
+            batch_size=args.batch_size,
+            nb_readers=args.readers,
+            nb_writers=args.writers,
+            **separation_kwargs
+        )
+        for stage, meter in timings.items():
+            print("{:<10} {:.3f}s per file".format(stage, meter.avg))
@@ -0,0 +1,164 @@
+import pytest
+import numpy as np
+import torch
+import eval
+import test
+from tests.test_inference import save_models
+
+
+def worker_state(audio, targets, model_name):
+    """Separates `audio` in a worker and returns the model cache state"""
+    misses = test.model_cache.misses
+    estimates = test.separate(audio, targets, model_name=model_name)
+    unmixes = test.load_models(targets, model_name=model_name)
+    return (
+        estimates,
+        test.model_cache.misses - misses,
+        all(
+            parameter.is_shared()
+            for unmix in unmixes for parameter in unmix.parameters()
+        )
+    )
+
+
+def test_init_worker(tmp_path):
+    targets = ['vocals', 'drums']
+    model_dir = save_models(tmp_path, targets)
+    unmixes = test.load_models(targets, model_name=model_dir)
+    for unmix in unmixes:
+        unmix.share_memory()
+
+    np.random.seed(0)
+    audio = np.random.randn(44100, 2) * 0.1
+    reference = test.separate(audio, targets, model_name=model_dir)
+
+    ctx = torch.multiprocessing.get_context('spawn')
+    with ctx.Pool(
+        1,
+        initializer=eval.init_worker,
+        initargs=(unmixes, targets, model_dir, 'cpu', False, None)
+    ) as pool:
+        estimates, misses, shared = pool.apply(
+            worker_state, (audio, targets, model_dir)
+        )
+
+    # the worker uses the shared models instead of loading the weights
+    assert misses == 0
+    assert shared
+    for name in reference:
+        assert np.allclose(estimates[name], reference[name], atol=1e-6)
+
+
+class Track(object):
+    """Picklable stand-in for a musdb track"""
+    def __init__(self, name, audio):
+        self.name = name
+        self.subset = 'test'
+        self.rate = 44100
+        self.audio = audio
+
+
+def energy_scores(track, estimates, eval_dir=None):
+    """Stand-in for `eval.score_track` that does not need museval"""
+    return (
+        (track.name, {
+            name: float(np.sum(estimate**2))
+            for name, estimate in estimates.items()
+        }),
+        0.01
+    )
+
+
+def test_evaluate_pipeline(tmp_path, monkeypatch):
+    import soundfile as sf
+    targets = ['vocals', 'drums']
+    model_dir = save_models(tmp_path, targets)
+    np.random.seed(0)
+    tracks = [
+        Track('track%d' % i, np.random.randn(nb_timesteps, 2) * 0.1)
+        for i, nb_timesteps in enumerate([44100, 30000, 60000, 20000])
+    ]
+    monkeypatch.setattr(eval, 'score_track', energy_scores)
+
+    scores, timings = eval.evaluate_pipeline(
+        tracks, nb_separators=2, nb_scorers=1, queue_size=1,
+        output_dir=str(tmp_path / 'estimates'),
+        targets=targets, model_name=model_dir
+    )
+    assert sorted(name for name, _ in scores) == [
+        track.name for track in tracks
+    ]
+    assert timings['separate'].count == len(tracks)
+    assert timings['score'].count == len(tracks)
+    assert timings['total'].sum > 0
+
+    scores = dict(scores)
+    for track in tracks:
+        reference = test.separate(track.audio, targets, model_name=model_dir)
+        for name in targets:
+            assert np.isclose(
+                scores[track.name][name], np.sum(reference[name]**2)
+            )
+            estimate, rate = sf.read(str(
+                tmp_path / 'estimates' / 'test' / track.name / (name + '.wav')
+            ))
+            assert estimate.shape == reference[name].shape
+    eval.report_throughput(timings, 2, 1)
+
+
+def failing_scores(track, estimates, eval_dir=None):
+    raise ValueError('scoring failed')
+
+
+def test_evaluate_pipeline_errors(tmp_path, monkeypatch):
+    targets = ['vocals']
+    model_dir = save_models(tmp_path, targets)
+    tracks = [Track('track', np.zeros((44100, 2)))]
+    monkeypatch.setattr(eval, 'score_track', failing_scores)
+    with pytest.raises(ValueError):
+        eval.evaluate_pipeline(tracks, targets=targets, model_name=model_dir)
+
+
+def test_separate_cached(tmp_path, monkeypatch):
+    import utils
+    targets = ['vocals', 'drums']
+    model_dir = save_models(tmp_path, targets)
+    cache = utils.EstimateCache(str(tmp_path / 'cache'), dtype='float16')
+    track = Track('track', np.random.randn(44100, 2) * 0.1)
+
+    estimates = eval.separate_cached(
+        track, cache=cache, targets=targets, model_name=model_dir
+    )
+    assert cache.misses == 1
+
+    # cached estimates are returned without separating again
+    def no_separate(*args, **kwargs):
+        raise AssertionError('separated cached track')
+
+    monkeypatch.setattr(test, 'separate', no_separate)
+    cached = eval.separate_cached(
+        track, cache=cache, targets=targets, model_name=model_dir
+    )
+    assert cache.hits == 1
+    for name in targets:
+        assert np.allclose(cached[name], estimates[name], atol=1e-3)
+
+    # other parameters or weights are separate entries
+    key = eval.estimate_key(track, targets, model_dir)
+    assert key != eval.estimate_key(track, targets, model_dir, niter=0)
+    assert key != eval.estimate_key(track, ['vocals'], model_dir)
+    other_dir = tmp_path / 'other'
+    other_dir.mkdir()
+    save_models(other_dir, targets, unidirectional=True)
+    assert key != eval.estimate_key(track, targets, str(other_dir))
+    # the api default dtype and the command line dtype share entries
+    assert key == eval.estimate_key(
+        track, targets, model_dir, dtype=torch.float32
+    )
+    assert key != eval.estimate_key(track, targets, model_dir, fused=True)
+
+    # the weight files are hashed without loading the models again
+    test.weights_hashes.clear()
+    misses = test.model_cache.misses
+    assert key == eval.estimate_key(track, targets, model_dir)
+    assert test.model_cache.misses == misses
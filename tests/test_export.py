@@ -0,0 +1,130 @@
+import os
+import subprocess
+import sys
+import pytest
+import numpy as np
+import torch
+import export
+import model
+import test
+from tests.test_inference import save_models
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    return save_models(tmp_path, ['vocals', 'drums'])
+
+
+@pytest.mark.parametrize('fused', [False, True])
+def test_torchscript(model_dir, tmp_path, fused):
+    targets = ['vocals', 'drums']
+    path = tmp_path / 'bundle.pt'
+    export.export_torchscript(
+        path, targets, model_name=model_dir, fused=fused,
+        example_duration=1.0
+    )
+    bundle, config = export.load_torchscript(path)
+    assert config['targets'] == targets
+    assert config['nfft'] == 1024
+
+    eager = model.OpenUnmixBundle(
+        test.load_models(targets, model_name=model_dir)
+    )
+
+    # the traced bundle accepts other lengths and batch sizes
+    torch.manual_seed(0)
+    for nb_samples, nb_timesteps in [(1, 44100), (2, 30000), (1, 100000)]:
+        audio = torch.rand(nb_samples, 2, nb_timesteps)
+        with torch.no_grad():
+            V, X = bundle(audio)
+            V_eager, X_eager = eager(audio)
+        assert V.shape == V_eager.shape
+        assert torch.allclose(X, X_eager)
+        assert torch.allclose(V, V_eager, rtol=1e-4, atol=1e-5)
+
+
+def test_torchscript_standalone(model_dir, tmp_path):
+    path = tmp_path / 'bundle.pt'
+    export.export_torchscript(
+        path, ['vocals'], model_name=model_dir, example_duration=1.0
+    )
+
+    # load in a fresh interpreter, without the open-unmix code on the path
+    script = (
+        "import sys, torch\n"
+        "bundle = torch.jit.load(sys.argv[1])\n"
+        "V, X = bundle(torch.rand(1, 2, 44100))\n"
+        "assert 'model' not in sys.modules\n"
+        "print(tuple(V.shape))\n"
+    )
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in env.get('PYTHONPATH', '').split(os.pathsep)
+        if p and os.path.abspath(p) != os.getcwd()
+    )
+    output = subprocess.check_output(
+        [sys.executable, '-c', script, str(path)], cwd=str(tmp_path), env=env
+    )
+    assert output.decode().strip() == '(1, 87, 1, 2, 513)'
+
+
+@pytest.mark.parametrize('fused', [False, True])
+def test_onnx(model_dir, tmp_path, fused):
+    onnxruntime = pytest.importorskip('onnxruntime')
+    # required by `torch.onnx.export`
+    pytest.importorskip('onnx')
+    targets = ['vocals', 'drums']
+    unmixes = test.load_models(targets, model_name=model_dir)
+    path = tmp_path / 'bundle.onnx'
+    export.export_onnx(str(path), unmixes, fused=fused)
+    session = onnxruntime.InferenceSession(
+        str(path), providers=['CPUExecutionProvider']
+    )
+
+    # dynamic frame and sample axes
+    torch.manual_seed(0)
+    for nb_frames, nb_samples in [(10, 1), (50, 2)]:
+        spec = torch.rand(nb_frames, nb_samples, 2, 513)
+        V = session.run(None, {'spectrogram': spec.numpy()})[0]
+        with torch.no_grad():
+            V_torch = torch.stack(
+                [unmix.forward_spectrogram(spec) for unmix in unmixes]
+            )
+        assert V.shape == V_torch.shape
+        assert np.allclose(V, V_torch.numpy(), rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('from_file', [False, True])
+def test_onnx_backend(model_dir, tmp_path, from_file):
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('onnx')
+    targets = ['vocals', 'drums']
+    if from_file:
+        backend = str(tmp_path / 'bundle.onnx')
+        export.export_onnx(
+            backend, test.load_models(targets, model_name=model_dir)
+        )
+    else:
+        backend = 'onnxruntime'
+
+    np.random.seed(0)
+    audios = [np.random.randn(nb_timesteps, 2) * 0.1
+              for nb_timesteps in [44100, 30000]]
+    reference = test.separate_batch(audios, targets, model_name=model_dir)
+    estimates = test.separate_batch(
+        audios, targets, model_name=model_dir, backend=backend
+    )
+    for audio_reference, audio_estimates in zip(reference, estimates):
+        for name in audio_reference:
+            assert np.allclose(
+                audio_reference[name], audio_estimates[name], atol=1e-4
+            )
+
+
+def test_unknown_backend(model_dir):
+    pytest.importorskip('onnxruntime')
+    with pytest.raises(ValueError):
+        test.separate(
+            np.zeros((44100, 2)), ['vocals'], model_name=model_dir,
+            backend='tensorflow'
+        )
@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+import torch
+import norbert
+import filtering
+
+
+@pytest.fixture(params=[1, 2, 3])
+def nb_channels(request):
+    return request.param
+
+
+@pytest.fixture(params=[0, 1, 2])
+def niter(request):
+    return request.param
+
+
+@pytest.fixture(params=[True, False])
+def softmask(request):
+    return request.param
+
+
+@pytest.fixture(params=[True, False])
+def residual(request):
+    return request.param
+
+
+@pytest.fixture
+def mixture(nb_channels):
+    np.random.seed(0)
+    nb_frames, nb_bins, nb_sources = 50, 129, 3
+    x = (
+        np.random.randn(nb_frames, nb_bins, nb_channels) +
+        np.random.randn(nb_frames, nb_bins, nb_channels) * 1j
+    ) * np.random.rand(1, nb_bins, 1) * 50
+    v = (
+        np.abs(np.random.randn(nb_frames, nb_bins, nb_channels, nb_sources)) *
+        np.abs(x[..., None]) * np.random.rand(1, 1, 1, nb_sources)
+    )
+    return v, x
+
+
+def to_torch(x):
+    return torch.from_numpy(np.stack([x.real, x.imag], -1)).float()
+
+
+def test_wiener(mixture, niter, softmask, residual):
+    v, x = mixture
+    x_torch = to_torch(x)
+    v_torch = torch.from_numpy(v).float()
+
+    if residual:
+        v = norbert.residual_model(v, x)
+        v_torch = filtering.residual_model(v_torch, x_torch)
+        assert np.allclose(v, v_torch.numpy(), rtol=1e-4, atol=1e-3)
+
+    y = norbert.wiener(v, x.astype(np.complex128), niter, softmask)
+    y_torch = filtering.wiener(v_torch, x_torch, niter, softmask).numpy()
+    y_torch = y_torch[..., 0] + y_torch[..., 1]*1j
+
+    assert y.shape == y_torch.shape
+    # float32 results are within 40 dB of the complex128 reference
+    snr = 10 * np.log10(
+        np.sum(np.abs(y)**2) / np.sum(np.abs(y - y_torch)**2)
+    )
+    assert snr > 40
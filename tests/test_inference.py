@@ -3,6 +3,8 @@ import numpy as np
 import torch
 import model
 import test
+import utils
+import json
 
 
 @pytest.fixture(params=[4096, 4096*10])
@@ -43,3 +45,407 @@ def test_stft(audio, nb_channels, nfft, hop):
     X_complex_np = X[..., 0] + X[..., 1]*1j
     out = test.istft(X_complex_np)
     assert np.sqrt(np.mean((audio.detach().numpy() - out)**2)) < 1e-6
+
+
+def save_models(path, targets, unidirectional=False):
+    torch.manual_seed(0)
+    for target in targets:
+        unmix = model.OpenUnmix(
+            n_fft=1024, n_hop=512, hidden_size=16,
+            max_bin=utils.bandwidth_to_max_bin(44100, 1024, 16000),
+            unidirectional=unidirectional
+        )
+        torch.save(unmix.state_dict(), str(path / (target + '.pth')))
+        with open(str(path / (target + '.json')), 'w') as f:
+            json.dump(
+                {'args': {
+                    'nfft': 1024, 'nhop': 512, 'nb_channels': 2,
+                    'hidden_size': 16, 'bandwidth': 16000,
+                    'unidirectional': unidirectional
+                }},
+                f
+            )
+    return str(path)
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    return save_models(tmp_path, ['vocals', 'drums'])
+
+
+@pytest.fixture
+def unidirectional_model_dir(tmp_path):
+    return save_models(tmp_path, ['vocals', 'drums'], unidirectional=True)
+
+
+def test_model_cache(model_dir):
+    test.model_cache.clear()
+    a = test.load_model('vocals', model_name=model_dir)
+    b = test.load_model('vocals', model_name=model_dir)
+    assert a is b
+    assert test.model_cache.hits == 1
+    assert test.model_cache.misses == 1
+
+    c = test.load_model('vocals', model_name=model_dir, cache=False)
+    assert c is not a
+
+    test.model_cache.resize(0)
+    assert len(test.model_cache) == 0
+    test.model_cache.resize(8)
+
+
+@pytest.mark.skipif(
+    not model.quantization_available(), reason='requires torch >= 1.3'
+)
+def test_load_model_quantized(model_dir):
+    a = test.load_model('vocals', model_name=model_dir)
+    b = test.load_model('vocals', model_name=model_dir, quantize=True)
+    assert a is not b
+    assert b is test.load_model('vocals', model_name=model_dir, quantize=True)
+
+    with pytest.raises(ValueError):
+        test.load_model(
+            'vocals', model_name=model_dir, quantize=True,
+            dtype=torch.float64
+        )
+
+    np.random.seed(0)
+    audio = np.random.randn(44100, 2) * 0.1
+    reference = test.separate(audio, ['vocals'], model_name=model_dir)
+    estimates = test.separate(
+        audio, ['vocals'], model_name=model_dir, quantize=True
+    )
+    assert estimates['vocals'].shape == reference['vocals'].shape
+
+
+@pytest.mark.skipif(
+    not model.bfloat16_available(), reason='requires bfloat16 cpu kernels'
+)
+@pytest.mark.parametrize('fused', [False, True])
+def test_separate_bfloat16(model_dir, fused):
+    np.random.seed(0)
+    audio = np.random.randn(44100, 2) * 0.1
+    targets = ['vocals', 'drums']
+    reference = test.separate(audio, targets, model_name=model_dir)
+    estimates = test.separate(
+        audio, targets, model_name=model_dir, fused=fused,
+        dtype=torch.bfloat16
+    )
+    unmix = test.load_model(
+        'vocals', model_name=model_dir, dtype=torch.bfloat16
+    )
+    assert unmix.fc1.weight.dtype == torch.bfloat16
+    assert unmix.stft.window.dtype == torch.float32
+
+    for name in reference:
+        assert estimates[name].dtype == reference[name].dtype
+        error = np.sum((estimates[name] - reference[name])**2)
+        snr = 10 * np.log10(np.sum(reference[name]**2) / error)
+        assert snr > 20
+
+
+@pytest.mark.parametrize('nb_workers', [1, 2, 3])
+def test_separate_workers(model_dir, nb_workers):
+    np.random.seed(0)
+    audio = np.random.randn(44100, 2) * 0.1
+    targets = ['vocals', 'drums']
+    nb_threads = torch.get_num_threads()
+
+    reference = test.separate(audio, targets, model_name=model_dir)
+    estimates = test.separate(
+        audio, targets, model_name=model_dir, nb_cores=2,
+        nb_workers=nb_workers
+    )
+    assert torch.get_num_threads() == nb_threads
+    for name in reference:
+        assert np.allclose(estimates[name], reference[name], atol=1e-6)
+
+
+def test_load_model_bfloat16_unavailable(model_dir, monkeypatch):
+    monkeypatch.setattr(model, 'bfloat16_available', lambda: False)
+    with pytest.raises(RuntimeError):
+        test.load_model(
+            'vocals', model_name=model_dir, dtype=torch.bfloat16, cache=False
+        )
+
+
+@pytest.mark.parametrize('chunk_overlap', [0, 22050])
+def test_separate_chunked(model_dir, chunk_overlap):
+    np.random.seed(0)
+    audio = np.random.randn(44100 * 6, 2) * 0.1
+    targets = ['vocals', 'drums']
+
+    full = test.separate(audio, targets, model_name=model_dir, niter=0)
+    blocks = list(
+        test.separate_chunked(
+            audio, targets, model_name=model_dir, niter=0,
+            chunk_size=44100 * 2, chunk_overlap=chunk_overlap
+        )
+    )
+    for name, estimate in full.items():
+        chunked = np.concatenate([block[name] for block in blocks])
+        assert chunked.shape == audio.shape
+        # the BiLSTM only sees the context of each chunk,
+        # so results are close but not identical
+        chunked = chunked[:estimate.shape[0]]
+        snr = 10 * np.log10(
+            np.sum(estimate**2) / np.sum((estimate - chunked)**2)
+        )
+        assert snr > 20
+
+
+@pytest.mark.parametrize('nb_timesteps', [44100 * 3, 44100 * 3 + 100])
+def test_separate_chunked_boundaries(model_dir, nb_timesteps):
+    np.random.seed(0)
+    audio = np.random.randn(nb_timesteps, 2) * 0.1
+    targets = ['vocals']
+
+    full = test.separate(audio, targets, model_name=model_dir, niter=0)
+    blocks = list(
+        test.separate_chunked(
+            audio, targets, model_name=model_dir, niter=0,
+            chunk_size=44100, chunk_overlap=0
+        )
+    )
+    # a tail shorter than the STFT window is merged into the last chunk
+    assert [len(block['vocals']) for block in blocks] == [
+        44100, 44100, nb_timesteps - 88200
+    ]
+    for name, estimate in full.items():
+        chunked = np.concatenate([block[name] for block in blocks])
+        # the samples around the chunk boundaries are separated as well,
+        # the residual of the random model is too quiet for its own SNR
+        for boundary in [44100, 88200]:
+            segment = slice(boundary - 512, boundary + 512)
+            error = np.sum((estimate[segment] - chunked[segment])**2)
+            reference = audio if name == 'accompaniment' else estimate
+            assert 10 * np.log10(np.sum(reference[segment]**2) / error) > 20
+
+
+def test_audio_file(tmp_path):
+    import soundfile as sf
+    np.random.seed(0)
+    audio = np.random.randn(10000, 1) * 0.1
+    sf.write(str(tmp_path / 'mono.wav'), audio, 44100, subtype='FLOAT')
+
+    audio_file = test.AudioFile(str(tmp_path / 'mono.wav'))
+    assert audio_file.shape == (10000, 2)
+    reference = test.read_audio(str(tmp_path / 'mono.wav'))
+    assert np.allclose(audio_file[1000:3000], reference[1000:3000])
+    assert np.allclose(audio_file[9000:12000], reference[9000:])
+
+
+def test_estimate_writer(model_dir, tmp_path):
+    import soundfile as sf
+    np.random.seed(0)
+    audio = np.random.randn(44100 * 5, 2) * 0.1
+    targets = ['vocals', 'drums']
+    kwargs = dict(
+        targets=targets, model_name=model_dir, chunk_size=44100 * 2,
+        chunk_overlap=22050
+    )
+
+    with test.EstimateWriter(tmp_path, subtype='FLOAT') as sink:
+        for blocks in test.separate_chunked(audio, **kwargs):
+            sink.write(blocks)
+    assert sink.files == {}
+
+    blocks = list(test.separate_chunked(audio, **kwargs))
+    for target in targets:
+        estimate, rate = sf.read(str(tmp_path / (target + '.wav')))
+        assert rate == 44100
+        reference = np.concatenate([block[target] for block in blocks])
+        assert estimate.shape == reference.shape
+        assert np.allclose(estimate, reference, atol=1e-6)
+
+
+def test_streaming_reconstruction(unidirectional_model_dir):
+    np.random.seed(0)
+    audio = np.random.randn(512 * 40, 2) * 0.1
+    separator = test.StreamingSeparator(
+        ['vocals'], model_name=unidirectional_model_dir,
+        block_size=2048, softmask=True
+    )
+    blocks = [
+        separator.process(audio[i:i + 2048])
+        for i in range(0, audio.shape[0], 2048)
+    ]
+    # softmasks sum to one, so the sources add up to the delayed mixture
+    mix = sum(
+        np.concatenate([block[name] for block in blocks])
+        for name in separator.source_names
+    )
+    latency = separator.latency
+    assert np.allclose(mix[latency:], audio[:-latency], atol=1e-6)
+    assert np.allclose(mix[:latency], 0, atol=1e-6)
+
+
+def test_streaming_state(unidirectional_model_dir):
+    np.random.seed(0)
+    audio = np.random.randn(512 * 40, 2) * 0.1
+    targets = ['vocals', 'drums']
+
+    separator = test.StreamingSeparator(
+        targets, model_name=unidirectional_model_dir, block_size=512
+    )
+    blocks = [
+        separator.process(audio[i:i + 512])
+        for i in range(0, audio.shape[0], 512)
+    ]
+
+    # a single block over the whole signal gives the reference
+    reference = test.StreamingSeparator(
+        targets, model_name=unidirectional_model_dir,
+        block_size=audio.shape[0]
+    ).process(audio)
+
+    for name in targets:
+        streamed = np.concatenate([block[name] for block in blocks])
+        assert np.allclose(streamed, reference[name], atol=1e-5)
+
+
+def test_streaming_bidirectional(model_dir):
+    with pytest.raises(ValueError):
+        test.StreamingSeparator(['vocals'], model_name=model_dir)
+
+
+def test_istft(audio, nfft, hop):
+    stft = model.STFT(n_fft=nfft, n_hop=hop, center=True)
+    istft = model.ISTFT(n_fft=nfft, n_hop=hop, center=True)
+    X = stft(audio)
+    out = istft(X, length=audio.shape[-1])
+    nb_timesteps = out.shape[-1]
+    assert out.shape[:-1] == audio.shape[:-1]
+    assert torch.allclose(audio[..., :nb_timesteps], out, atol=1e-5)
+
+
+def test_fused_model_cache(model_dir):
+    np.random.seed(0)
+    audio = np.random.randn(44100, 2) * 0.1
+    targets = ['vocals', 'drums']
+    reference = test.separate(audio, targets, model_name=model_dir)
+
+    test.fused_models.clear()
+    for _ in range(2):
+        estimates = test.separate(
+            audio, targets, model_name=model_dir, fused=True
+        )
+    # the stacked weights are built once for the cached models
+    assert (test.fused_models.hits, test.fused_models.misses) == (1, 1)
+    for name in reference:
+        assert np.allclose(estimates[name], reference[name], atol=1e-4)
+
+
+@pytest.mark.parametrize('fused', [False, True])
+def test_separate_batch(model_dir, fused):
+    np.random.seed(0)
+    audios = [
+        np.random.randn(nb_timesteps, 2) * 0.1
+        for nb_timesteps in [44100, 30000, 60000]
+    ]
+    targets = ['vocals', 'drums']
+
+    batch_estimates = test.separate_batch(
+        audios, targets, model_name=model_dir, fused=fused
+    )
+    for audio, estimates in zip(audios, batch_estimates):
+        reference = test.separate(
+            audio, targets, model_name=model_dir, fused=fused
+        )
+        for name in reference:
+            assert estimates[name].shape == reference[name].shape
+            assert np.allclose(estimates[name], reference[name], atol=1e-5)
+
+
+@pytest.mark.parametrize('batch_size', [1, 2])
+def test_separate_files(model_dir, tmp_path, monkeypatch, batch_size):
+    import soundfile as sf
+    np.random.seed(0)
+    monkeypatch.chdir(tmp_path)
+    targets = ['vocals', 'drums']
+    audios = {}
+    for i, nb_timesteps in enumerate([44100, 30000, 60000]):
+        input_file = 'track%d.wav' % i
+        audios[input_file] = np.random.randn(nb_timesteps, 2) * 0.1
+        sf.write(
+            str(tmp_path / input_file), audios[input_file], 44100,
+            subtype='FLOAT'
+        )
+
+    timings = test.separate_files(
+        list(audios), batch_size=batch_size, nb_readers=2, nb_writers=2,
+        queue_size=1, targets=targets, model_name=model_dir
+    )
+    assert timings['separate'].count == len(audios)
+
+    for input_file, audio in audios.items():
+        reference = test.separate(audio, targets, model_name=model_dir)
+        outdir = test.output_dir(input_file, model_dir)
+        for target in targets:
+            estimate, rate = sf.read(str(outdir / (target + '.wav')))
+            assert rate == 44100
+            assert estimate.shape == reference[target].shape
+            assert np.allclose(estimate, reference[target], atol=1e-4)
+
+
+def test_separate_files_errors(model_dir, tmp_path, monkeypatch):
+    import soundfile as sf
+    import threading
+    monkeypatch.chdir(tmp_path)
+    np.random.seed(0)
+    input_files = []
+    for i in range(4):
+        input_files.append('track%d.wav' % i)
+        sf.write(
+            str(tmp_path / input_files[-1]), np.random.randn(4096, 2) * 0.1,
+            44100, subtype='FLOAT'
+        )
+    nb_threads = threading.active_count()
+    kwargs = dict(
+        nb_readers=2, nb_writers=2, queue_size=1, targets=['vocals'],
+        model_name=model_dir
+    )
+
+    def failing(*args, **kwargs):
+        raise ValueError('separation failed')
+
+    # the threads are stopped and joined when the separation fails
+    monkeypatch.setattr(test, 'separate_batch', failing)
+    with pytest.raises(ValueError):
+        test.separate_files(input_files, **kwargs)
+    assert threading.active_count() == nb_threads
+
+    # reader errors are raised before the remaining files are separated
+    calls = []
+
+    def counting(audios, **kwargs):
+        calls.append(audios)
+        return [{} for _ in audios]
+
+    monkeypatch.setattr(test, 'separate_batch', counting)
+    with pytest.raises(Exception):
+        test.separate_files(
+            ['missing.wav'] + input_files, **dict(kwargs, nb_readers=1)
+        )
+    assert calls == []
+    assert threading.active_count() == nb_threads
+
+
+def test_separate_files_default_model(tmp_path, monkeypatch):
+    import soundfile as sf
+    monkeypatch.chdir(tmp_path)
+    sf.write(
+        str(tmp_path / 'track.wav'), np.zeros((4096, 2)), 44100,
+        subtype='FLOAT'
+    )
+    calls = []
+
+    def separating(audios, **kwargs):
+        calls.append(kwargs)
+        return [{'vocals': audio} for audio in audios]
+
+    monkeypatch.setattr(test, 'separate_batch', separating)
+    test.separate_files(['track.wav'], targets=['vocals'])
+    # without `model_name`, the default model is used and named in the output
+    assert calls[0]['model_name'] == 'umxhq'
+    assert (test.output_dir('track.wav', 'umxhq') / 'vocals.wav').exists()
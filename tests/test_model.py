@@ -71,3 +71,101 @@ def test_shape(
     X = spec(audio)
     Y = unmix(X)
     assert X.shape == Y.shape
+
+
+@pytest.fixture(params=[1, 4])
+def nb_targets(request):
+    return request.param
+
+
+def random_eval_model(nb_channels, unidirectional):
+    unmix = model.OpenUnmix(
+        n_fft=1024,
+        n_hop=512,
+        nb_channels=nb_channels,
+        unidirectional=unidirectional,
+        hidden_size=32,
+        max_bin=400
+    )
+    # randomize scalers and statistics so that folding is not identity
+    for p in [
+        unmix.input_mean, unmix.input_scale,
+        unmix.output_mean, unmix.output_scale
+    ]:
+        torch.nn.init.uniform_(p, 0.5, 1.5)
+    for bn in [unmix.bn1, unmix.bn2, unmix.bn3]:
+        torch.nn.init.uniform_(bn.weight, 0.5, 1.5)
+        torch.nn.init.uniform_(bn.bias, -0.5, 0.5)
+        bn.running_mean.uniform_(-1, 1)
+        bn.running_var.uniform_(0.5, 2)
+    unmix.eval()
+    return unmix
+
+
+def test_fused(audio, nb_channels, unidirectional, nb_targets):
+    unmixes = [
+        random_eval_model(nb_channels, unidirectional)
+        for j in range(nb_targets)
+    ]
+
+    fused = model.FusedOpenUnmix(unmixes)
+    with torch.no_grad():
+        Y = torch.stack([unmix(audio) for unmix in unmixes])
+        Y_fused = fused(audio)
+    assert Y.shape == Y_fused.shape
+    assert torch.allclose(Y, Y_fused, rtol=1e-4, atol=1e-3)
+
+
+def test_fuse(audio, nb_channels, unidirectional):
+    unmix = random_eval_model(nb_channels, unidirectional)
+    with torch.no_grad():
+        Y = unmix(audio)
+        unmix.fuse()
+        Y_fused = unmix(audio)
+    assert isinstance(unmix.bn1, model.NoOp)
+    assert Y.shape == Y_fused.shape
+    assert torch.allclose(Y, Y_fused, rtol=1e-4, atol=1e-3)
+
+    # fused models can be batched as well
+    with torch.no_grad():
+        Y_batched = model.FusedOpenUnmix([unmix])(audio)[0]
+    assert torch.allclose(Y_fused, Y_batched, rtol=1e-4, atol=1e-3)
+
+    with pytest.raises(ValueError):
+        random_eval_model(nb_channels, unidirectional).train().fuse()
+
+
+@pytest.mark.skipif(
+    not model.quantization_available(), reason='requires torch >= 1.3'
+)
+def test_quantize(audio, nb_channels, unidirectional):
+    torch.manual_seed(0)
+    unmix = model.OpenUnmix(
+        n_fft=1024,
+        n_hop=512,
+        nb_channels=nb_channels,
+        unidirectional=unidirectional,
+        hidden_size=32,
+        max_bin=400
+    )
+    unmix.eval()
+
+    quantized = model.quantize(unmix)
+    assert not isinstance(quantized.fc1, torch.nn.Linear)
+    # the original model is not modified
+    assert isinstance(unmix.fc1, torch.nn.Linear)
+
+    with torch.no_grad():
+        Y = unmix(audio)
+        Y_quantized = quantized(audio)
+    assert Y.shape == Y_quantized.shape
+    assert torch.norm(Y - Y_quantized) < 0.1 * torch.norm(Y)
+
+    with pytest.raises(ValueError):
+        model.FusedOpenUnmix([quantized, quantized])
+
+
+def test_quantize_unavailable(monkeypatch):
+    monkeypatch.setattr(model, 'quantization_available', lambda: False)
+    with pytest.raises(RuntimeError):
+        model.quantize(model.OpenUnmix(n_fft=1024, hidden_size=16).eval())
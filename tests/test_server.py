@@ -0,0 +1,82 @@
+import threading
+import pytest
+import numpy as np
+import server
+import test
+from tests.test_inference import save_models
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    return save_models(tmp_path, ['vocals', 'drums'])
+
+
+@pytest.fixture
+def url(model_dir):
+    separation_server = server.make_server(
+        port=0,
+        max_batch_size=4,
+        max_latency=0.5,
+        targets=['vocals', 'drums'],
+        model_name=model_dir
+    )
+    thread = threading.Thread(
+        target=separation_server.serve_forever, daemon=True
+    )
+    thread.start()
+    yield 'http://localhost:%d' % separation_server.server_address[1]
+    separation_server.shutdown()
+    separation_server.server_close()
+
+
+def test_separate_remote(url, model_dir):
+    np.random.seed(0)
+    audios = [
+        np.random.randn(nb_timesteps, 2) * 0.1
+        for nb_timesteps in [44100, 30000, 60000]
+    ]
+
+    # concurrent requests are batched by the server
+    results = [None] * len(audios)
+
+    def client(i):
+        results[i] = server.separate_remote(audios[i], url)
+
+    threads = [
+        threading.Thread(target=client, args=(i,))
+        for i in range(len(audios))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for audio, estimates in zip(audios, results):
+        # the audio is sent as float32 wav
+        reference = test.separate(
+            audio.astype(np.float32), ['vocals', 'drums'],
+            model_name=model_dir
+        )
+        assert set(estimates) == set(reference)
+        for name in reference:
+            assert estimates[name].shape == reference[name].shape
+            assert np.allclose(estimates[name], reference[name], atol=1e-5)
+
+    stats = server.server_stats(url)
+    assert stats['nb_requests'] == len(audios)
+    assert stats['queue_depth'] == 0
+    assert stats['mean_batch_size'] > 1
+    assert 0 < stats['latency_p50'] <= stats['latency_p99']
+
+
+def test_server_errors(url):
+    import urllib.error
+    import urllib.request
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(url + '/unknown')
+    assert e.value.code == 404
+
+    request = urllib.request.Request(url + '/separate', data=b'no audio')
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request)
+    assert e.value.code == 400
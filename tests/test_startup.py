@@ -0,0 +1,22 @@
+import subprocess
+import sys
+import pytest
+import benchmark
+
+
+@pytest.mark.parametrize('script', ['test.py', 'eval.py', 'sweep.py'])
+def test_help_without_heavy_imports(script):
+    # `--help` must not load the modules needed for the separation
+    seconds, modules = benchmark.import_times([script, '--help'])
+    assert 'argparse' in modules
+    for name in ['torch', 'numpy', 'norbert', 'soundfile', 'musdb']:
+        assert name not in modules
+
+
+def test_lazy_import_cli():
+    # the lazily imported modules are loaded on first use
+    code = (
+        'import sys, test; assert "torch" not in sys.modules; '
+        'test.torch.zeros(1); assert "torch" in sys.modules'
+    )
+    subprocess.check_call([sys.executable, '-c', code])
@@ -0,0 +1,109 @@
+import pytest
+import torch
+import hubconf
+import store
+import test
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    root = tmp_path / 'store'
+    monkeypatch.setenv('UMX_STORE', str(root))
+    monkeypatch.delenv('UMX_OFFLINE', raising=False)
+    return root
+
+
+def save_weights(path, target, seed=0):
+    """Saves random `umxhq` weights as `<target>-<sha256 prefix>.pth`"""
+    torch.manual_seed(seed)
+    unmix = hubconf.umxhq(target=target, pretrained=False)
+    tmp = path / 'weights.pth'
+    torch.save(unmix.state_dict(), str(tmp))
+    weights = path / '{}-{}.pth'.format(target, store.sha256sum(tmp)[:8])
+    tmp.rename(weights)
+    return weights
+
+
+def test_parse_filename():
+    assert store.parse_filename('vocals-b62c91ce.pth') == (
+        'vocals', 'b62c91ce'
+    )
+    assert store.parse_filename('/a/b/vocals.pth') == ('vocals', None)
+    with pytest.raises(ValueError):
+        store.parse_filename('vocals.json')
+
+
+def test_import(root, tmp_path):
+    weights = save_weights(tmp_path, 'vocals')
+    sha256 = store.import_weights(weights, 'umxhq')
+    assert weights.name.startswith('vocals-' + sha256[:8])
+    assert store.resolve('umxhq', 'vocals') == root / 'objects' / (
+        sha256 + '.pth'
+    )
+    assert store.resolve('umxhq', 'drums') is None
+    assert store.resolve('umx', 'vocals') is None
+
+    # objects are content addressed and shared between models
+    assert store.import_path(tmp_path, 'other-model') == {'vocals': sha256}
+    assert len(list((root / 'objects').iterdir())) == 1
+    assert store.verify() == []
+
+
+def test_import_hash_mismatch(root, tmp_path):
+    weights = save_weights(tmp_path, 'vocals')
+    corrupted = tmp_path / 'drums-00000000.pth'
+    corrupted.write_bytes(weights.read_bytes())
+    with pytest.raises(ValueError):
+        store.import_weights(corrupted, 'umxhq')
+    assert store.resolve('umxhq', 'drums') is None
+
+
+def test_fetch(root, tmp_path):
+    weights = save_weights(tmp_path, 'vocals')
+    url = weights.as_uri()
+
+    with pytest.raises(RuntimeError):
+        store.fetch(url, 'umxhq', 'vocals', offline=True)
+
+    path = store.fetch(url, 'umxhq', 'vocals')
+    assert store.sha256sum(path) == path.stem
+
+    # the weights are resolved from the store without downloading them
+    weights.unlink()
+    assert store.fetch(url, 'umxhq', 'vocals', offline=True) == path
+
+
+def test_load_model_offline(root, tmp_path, monkeypatch):
+    weights = save_weights(tmp_path, 'vocals')
+    store.import_weights(weights, 'umxhq')
+    monkeypatch.setenv('UMX_OFFLINE', '1')
+
+    def no_network(*args, **kwargs):
+        raise AssertionError('network access in offline mode')
+
+    monkeypatch.setattr(store, 'download_url_to_file', no_network)
+    monkeypatch.setattr(torch.hub, 'load', no_network)
+
+    unmix = test.load_model('vocals', 'umxhq', cache=False)
+    reference = torch.load(str(weights))
+    for name, value in unmix.state_dict().items():
+        assert torch.equal(value, reference[name])
+
+    with pytest.raises(RuntimeError):
+        test.load_model('drums', 'umxhq', cache=False)
+    with pytest.raises(NameError):
+        test.load_model('vocals', 'unknown-model', cache=False)
+
+
+def test_download_fallback(tmp_path, monkeypatch):
+    # torch < 1.4 only has the private `_download_url_to_file`
+    calls = []
+    monkeypatch.delattr(torch.hub, 'download_url_to_file')
+    monkeypatch.setattr(
+        torch.hub, '_download_url_to_file',
+        lambda *args: calls.append(args), raising=False
+    )
+    store.download_url_to_file('http://host/a.pth', tmp_path / 'a.pth')
+    assert calls == [
+        ('http://host/a.pth', str(tmp_path / 'a.pth'), None, False)
+    ]
@@ -0,0 +1,81 @@
+import numpy as np
+import sweep
+import test
+import utils
+from tests.test_eval import Track
+from tests.test_inference import save_models
+
+
+def energy_scores(track, estimates):
+    """Stand-in for `sweep.score` that does not need museval"""
+    return {
+        name: {metric: float(np.sum(estimate**2)) for metric in sweep.METRICS}
+        for name, estimate in estimates.items()
+    }
+
+
+def test_grid():
+    configs = sweep.grid(niter=[0, 1], alpha=[1.0, 2.0], softmask=[True])
+    assert len(configs) == 4
+    assert dict(
+        niter=1, alpha=2.0, softmask=True, residual_model=False
+    ) in configs
+
+
+def test_sweep_track(tmp_path, monkeypatch):
+    targets = ['vocals', 'drums']
+    model_dir = save_models(tmp_path, targets)
+    monkeypatch.setattr(sweep, 'score', energy_scores)
+
+    calls = []
+    estimate_spectrograms = test.estimate_spectrograms
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return estimate_spectrograms(*args, **kwargs)
+
+    monkeypatch.setattr(test, 'estimate_spectrograms', counting)
+
+    np.random.seed(0)
+    track = Track('track', np.random.randn(44100, 2) * 0.1)
+    configs = sweep.grid(niter=[0, 1], softmask=[False, True])
+    cache = utils.EstimateCache(str(tmp_path / 'cache'))
+
+    rows = sweep.sweep_track(
+        track, configs, targets, model_name=model_dir, cache=cache
+    )
+    # the models run once for all settings
+    assert len(calls) == 1
+    assert len(rows) == len(configs) * len(targets)
+
+    # every setting matches a separation with the same parameters
+    for config in configs:
+        reference = test.separate(
+            track.audio, targets, model_name=model_dir, **config
+        )
+        for target in targets:
+            row, = [
+                row for row in rows
+                if row['target'] == target
+                and all(row[name] == value for name, value in config.items())
+            ]
+            expected = energy_scores(track, reference)[target]['SDR']
+            assert np.isclose(row['SDR'], expected, rtol=1e-4)
+
+    # a second sweep reads the spectrograms from the cache
+    calls.clear()
+    cached = sweep.sweep_track(
+        track, configs, targets, model_name=model_dir, cache=cache
+    )
+    assert len(calls) == 0
+    assert cache.hits == 1
+    for row, cached_row in zip(rows, cached):
+        assert np.isclose(row['SDR'], cached_row['SDR'], rtol=1e-4)
+
+    summary = sweep.summarize(rows + cached)
+    assert len(summary) == len(rows)
+    assert all(row['nb_tracks'] == 2 for row in summary)
+
+    sweep.write_table(rows, str(tmp_path / 'sweep.csv'))
+    with open(str(tmp_path / 'sweep.csv')) as f:
+        assert len(f.readlines()) == len(rows) + 1
@@ -0,0 +1,210 @@
+import pytest
+import numpy as np
+import torch
+import utils
+
+
+def test_lru_cache():
+    cache = utils.LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    # `b` is the least recently used item
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_torch_threads():
+    nb_threads = torch.get_num_threads()
+    with utils.torch_threads(3):
+        assert torch.get_num_threads() == 3
+    assert torch.get_num_threads() == nb_threads
+    with utils.torch_threads(None):
+        assert torch.get_num_threads() == nb_threads
+
+
+@pytest.mark.parametrize('orig_sr, target_sr', [
+    (44100, 16000), (22050, 44100), (48000, 44100), (8000, 8000)
+])
+def test_resample_length(orig_sr, target_sr):
+    audio = torch.rand(3, 2, 12345)
+    resampled = utils.resample(audio, orig_sr, target_sr)
+    assert resampled.shape == (3, 2, int(12345 * target_sr / orig_sr))
+
+
+@pytest.mark.parametrize('orig_sr, target_sr', [
+    (44100, 16000), (22050, 44100), (48000, 44100)
+])
+def test_resample_sine(orig_sr, target_sr):
+    freq = 1000.
+    audio = torch.sin(
+        2 * np.pi * freq * torch.arange(orig_sr, dtype=torch.float64) /
+        orig_sr
+    )
+    expected = torch.sin(
+        2 * np.pi * freq * torch.arange(target_sr, dtype=torch.float64) /
+        target_sr
+    )
+    resampled = utils.resample(audio, orig_sr, target_sr)
+    # ignore the filter transients at the borders
+    valid = slice(target_sr // 10, -(target_sr // 10))
+    assert torch.allclose(resampled[valid], expected[valid], atol=1e-5)
+
+
+def test_resample_coprime():
+    # the polyphase kernel of 44100 -> 22051 Hz would have ~1e9 elements
+    orig_sr, target_sr = 44100, 22051
+    audio = torch.sin(
+        2 * np.pi * 1000. * torch.arange(orig_sr, dtype=torch.float64) /
+        orig_sr
+    )
+    expected = torch.sin(
+        2 * np.pi * 1000. * torch.arange(target_sr, dtype=torch.float64) /
+        target_sr
+    )
+    resampled = utils.resample(audio, orig_sr, target_sr)
+    assert resampled.shape == (target_sr,)
+    assert resampled.dtype == audio.dtype
+    valid = slice(target_sr // 10, -(target_sr // 10))
+    assert torch.allclose(resampled[valid], expected[valid], atol=1e-5)
+
+    # the fallback matches the polyphase kernel on small rate pairs
+    audio = audio[None, :4410].repeat(2, 1)
+    reference = utils.resample(audio, 44100, 16000)
+    fallback = utils.resample(audio, 44100, 16000, max_kernel_size=0)
+    assert fallback.shape == reference.shape
+    valid = slice(200, -200)
+    assert torch.allclose(fallback[:, valid], reference[:, valid], atol=1e-5)
+
+
+def test_resample_channels():
+    audio = torch.rand(2, 44100)
+    resampled = utils.resample(audio, 44100, 48000)
+    for channel in range(2):
+        assert torch.allclose(
+            resampled[channel],
+            utils.resample(audio[channel], 44100, 48000)
+        )
+
+
+def test_resample_kernel_cache():
+    utils.resample_kernels.clear()
+    audio = torch.rand(2, 4410)
+    utils.resample(audio, 44100, 16000)
+    utils.resample(audio, 44100, 16000)
+    assert (utils.resample_kernels.hits, utils.resample_kernels.misses) == (
+        1, 1
+    )
+
+
+def test_resample_resampy():
+    resampy = pytest.importorskip('resampy')
+    np.random.seed(0)
+    audio = np.random.randn(2, 48000)
+    # band-limit the noise below the nyquist frequency of both rates
+    spectrum = np.fft.rfft(audio)
+    spectrum[:, int(0.7 * 44100 / 2):] = 0
+    audio = np.fft.irfft(spectrum, audio.shape[-1])
+
+    reference = resampy.resample(audio, 48000, 44100, axis=-1)
+    resampled = utils.resample(torch.from_numpy(audio), 48000, 44100).numpy()
+    assert resampled.shape == reference.shape
+    valid = slice(4410, -4410)
+    assert np.allclose(resampled[:, valid], reference[:, valid], atol=1e-3)
+
+
+def test_lazy_import():
+    assert utils.lazy_import('torch') is torch
+    module = utils.LazyModule('json')
+    assert module.dumps([1]) == '[1]'
+    with pytest.raises(ImportError):
+        utils.lazy_import('no_such_module')
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_estimate_cache(tmp_path, dtype):
+    cache = utils.EstimateCache(str(tmp_path), dtype=dtype)
+    estimates = {'vocals': np.random.randn(1000, 2) * 0.1}
+    key = utils.EstimateCache.key(track='a', niter=1)
+    assert key == utils.EstimateCache.key(niter=1, track='a')
+    assert key != utils.EstimateCache.key(track='a', niter=0)
+
+    assert cache.get(key) is None
+    cache.put(key, estimates)
+    cached = cache.get(key)
+    assert cached['vocals'].dtype == np.float32
+    assert np.allclose(
+        cached['vocals'], estimates['vocals'],
+        atol=1e-3 if dtype == 'float16' else 1e-7
+    )
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_estimate_cache_eviction(tmp_path):
+    import os
+    import time
+    cache = utils.EstimateCache(str(tmp_path))
+    estimates = {'vocals': np.zeros((1000, 2))}
+    for key in ['a', 'b', 'c']:
+        cache.put(key, estimates)
+        # distinct modification times
+        os.utime(cache.path(key), (time.time() - 10, time.time() - 10))
+        time.sleep(0.01)
+    # `a` becomes the most recently used entry
+    assert cache.get('a') is not None
+
+    entry_size = cache.size() // 3
+    cache.maxsize = 2 * entry_size
+    cache.evict()
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_sdr():
+    torch.manual_seed(0)
+    references = torch.randn(3, 2, 2, 1000)
+    noise = torch.randn(3, 2, 2, 1000)
+    estimates = references + 0.1 * noise
+
+    scores = utils.sdr(estimates, references, window=300)
+    assert scores.shape == (3, 2, 3)
+    # a single window matches the definition over all channels
+    expected = 10 * torch.log10(
+        references[0, 0].pow(2).sum() / (0.1 * noise[0, 0]).pow(2).sum()
+    )
+    assert torch.allclose(
+        utils.sdr(estimates, references)[0, 0, 0], expected, atol=1e-4
+    )
+
+    # the SI-SDR does not change with the gain of the estimates
+    assert torch.allclose(
+        utils.si_sdr(2 * estimates, references, window=300),
+        utils.si_sdr(estimates, references, window=300), atol=1e-4
+    )
+    assert (utils.sdr(2 * estimates, references) < 1).all()
+
+
+def test_sdr_silence():
+    references = torch.randn(2, 1000)
+    references[:, 500:] = 0
+    scores = utils.sdr(references + 0.01, references, window=500)
+    assert torch.isfinite(scores[0]) and torch.isnan(scores[1])
+
+
+def test_sdr_empty():
+    empty = torch.zeros(3, 2, 0)
+    assert utils.sdr(empty, empty, window=300).shape == (3, 0)
+    assert utils.sdr(empty, empty, scale_invariant=True).shape == (3, 0)
+
+
+def test_lazy_import_rebinding(monkeypatch):
+    module = utils.LazyModule('json')
+    assert module.dumps([1]) == '[1]'
+    # changes of the imported module are visible through the placeholder
+    import json
+    monkeypatch.setattr(json, 'dumps', lambda obj: 'patched')
+    assert module.dumps([1]) == 'patched'
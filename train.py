@@ -37,15 +37,40 @@ def train(args, unmix, device, train_sampler, optimizer):
 
 def valid(args, unmix, device, valid_sampler):
     losses = utils.AverageMeter()
+    sdrs = utils.AverageMeter()
+    si_sdrs = utils.AverageMeter()
+    istft = model.ISTFT(
+        n_fft=unmix.stft.n_fft, n_hop=unmix.stft.n_hop
+    ).to(device)
+    window = int(args.valid_window * valid_sampler.dataset.sample_rate)
+    trim = unmix.stft.n_fft
     unmix.eval()
     with torch.no_grad():
         for x, y in valid_sampler:
             x, y = x.to(device), y.to(device)
-            Y_hat = unmix(x)
+            X = unmix.stft(x)
+            X_mag = unmix.spec(X)
+            Y_hat = unmix.forward_spectrogram(X_mag)
             Y = unmix.transform(y)
             loss = torch.nn.functional.mse_loss(Y_hat, Y)
             losses.update(loss.item(), Y.size(1))
-        return losses.avg
+
+            # time domain estimate with the phase of the mixture, without
+            # the edges where the frames do not fully overlap
+            mask = (Y_hat / (X_mag + 1e-10)).permute(1, 2, 3, 0)
+            y_hat = istft(X * mask[..., None])[..., trim:-trim]
+            y = y[..., trim:trim + y_hat.shape[-1]]
+            if y_hat.shape[-1] == 0:
+                # the item is not longer than the trimmed edges
+                continue
+            for metric, meter in [(utils.sdr, sdrs), (utils.si_sdr, si_sdrs)]:
+                # median over the windows of each track
+                scores = np.nanmedian(
+                    metric(y_hat, y, window=window).cpu().numpy(), axis=-1
+                )
+                for score in scores[np.isfinite(scores)]:
+                    meter.update(float(score))
+        return losses.avg, sdrs.avg, si_sdrs.avg
 
 
 def get_statistics(args, dataset):
@@ -110,6 +135,10 @@ def main():
                         help='weight decay')
     parser.add_argument('--seed', type=int, default=42, metavar='S',
                         help='random seed (default: 42)')
+    parser.add_argument('--valid-window', type=float, default=1.0,
+                        help='window duration in seconds of the validation '
+                        'SDR, the median over the windows of each track is '
+                        'averaged over all tracks (default: 1.0)')
 
     # Model Parameters
     parser.add_argument('--seq-dur', type=float, default=6.0,
@@ -186,6 +215,7 @@ def main():
         n_fft=args.nfft,
         n_hop=args.nhop,
         max_bin=max_bin,
+        unidirectional=args.unidirectional,
         sample_rate=train_dataset.sample_rate
     ).to(device)
 
@@ -223,6 +253,8 @@ def main():
         )
         train_losses = results['train_loss_history']
         valid_losses = results['valid_loss_history']
+        valid_sdrs = results.get('valid_sdr_history', [])
+        valid_si_sdrs = results.get('valid_si_sdr_history', [])
         train_times = results['train_time_history']
         best_epoch = results['best_epoch']
         es.best = results['best_loss']
@@ -232,6 +264,8 @@ def main():
         t = tqdm.trange(1, args.epochs + 1, disable=args.quiet)
         train_losses = []
         valid_losses = []
+        valid_sdrs = []
+        valid_si_sdrs = []
         train_times = []
         best_epoch = 0
 
@@ -239,13 +273,17 @@ def main():
         t.set_description("Training Epoch")
         end = time.time()
         train_loss = train(args, unmix, device, train_sampler, optimizer)
-        valid_loss = valid(args, unmix, device, valid_sampler)
+        valid_loss, valid_sdr, valid_si_sdr = valid(
+            args, unmix, device, valid_sampler
+        )
         scheduler.step(valid_loss)
         train_losses.append(train_loss)
         valid_losses.append(valid_loss)
+        valid_sdrs.append(valid_sdr)
+        valid_si_sdrs.append(valid_si_sdr)
 
         t.set_postfix(
-            train_loss=train_loss, val_loss=valid_loss
+            train_loss=train_loss, val_loss=valid_loss, val_sdr=valid_sdr
         )
 
         stop = es.step(valid_loss)
@@ -273,6 +311,8 @@ def main():
             'best_epoch': best_epoch,
             'train_loss_history': train_losses,
             'valid_loss_history': valid_losses,
+            'valid_sdr_history': valid_sdrs,
+            'valid_si_sdr_history': valid_si_sdrs,
             'train_time_history': train_times,
             'num_bad_epochs': es.num_bad_epochs,
             'commit': commit
@@ -1,7 +1,53 @@
 import shutil
-import torch
 import os
-import numpy as np
+import json
+import hashlib
+import tempfile
+import sys
+import types
+import threading
+import importlib
+import importlib.util
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class LazyModule(types.ModuleType):
+    """
+    Placeholder of the module `name`, that is imported when one of its
+    attributes is first accessed, see `lazy_import`
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self._lock = threading.Lock()
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = importlib.import_module(self.__name__)
+                self._module = module
+        # attributes are looked up on the module every time, so that later
+        # changes of the module (e.g. by monkeypatching) are visible
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """
+    Returns the module `name`, which is only imported when one of its
+    attributes is first accessed. Command line entry points use it for
+    heavy modules, so that e.g. `--help` does not load torch.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ImportError("No module named '%s'" % name, name=name)
+    return LazyModule(name)
+
+
+torch = lazy_import('torch')
+np = lazy_import('numpy')
 
 
 def _sndfile_available():
@@ -103,9 +149,124 @@ def load_info(path):
     return loader(path)
 
 
-def load_audio(path, start=0, dur=None):
+def load_audio(path, start=0, dur=None, sample_rate=None):
+    """
+    Loads `dur` seconds of audio starting at `start` seconds as tensor of
+    shape (nb_channels, nb_timesteps). If `sample_rate` is given, the audio
+    is resampled to it, see `resample`.
+    """
     loader = get_loading_backend()
-    return loader(path, start=start, dur=dur)
+    audio = loader(path, start=start, dur=dur)
+    if sample_rate is not None:
+        rate = load_info(path)['samplerate']
+        if rate != sample_rate:
+            audio = resample(audio, rate, sample_rate)
+    return audio
+
+
+def _resample_width(orig, new, zero_crossings, rolloff):
+    """Returns the half length of the filters of `_resample_kernel`"""
+    cutoff = min(orig, new) * rolloff
+    return int(np.ceil(zero_crossings * orig / cutoff))
+
+
+def _resample_kernel(orig, new, zero_crossings, rolloff, beta):
+    """
+    Returns the windowed sinc filters of the `new` output phases for
+    resampling from `orig` to `new` (reduced by their gcd) as array of shape
+    (new, 2 * width + orig), and the padding `width` of the input.
+    """
+    # cutoff relative to the input rate, below the nyquist of both rates
+    cutoff = min(orig, new) * rolloff
+    width = _resample_width(orig, new, zero_crossings, rolloff)
+    # input positions relative to each output phase, in input samples
+    idx = np.arange(-width, width + orig)[None, :] / orig
+    t = (idx - np.arange(new)[:, None] / new) * cutoff
+    t = np.clip(t, -zero_crossings, zero_crossings)
+    # kaiser window
+    window = np.i0(beta * np.sqrt(1 - (t / zero_crossings)**2)) / np.i0(beta)
+    kernel = np.sinc(t) * window * cutoff / orig
+    return kernel, width
+
+
+def resample(
+    audio, orig_sr, target_sr, zero_crossings=32, rolloff=0.945,
+    beta=14.769656459379492, max_kernel_size=2**22
+):
+    """
+    Band-limited polyphase resampling with a kaiser windowed sinc filter,
+    applied to all channels at once. The filter kernels are cached per
+    rate pair in `resample_kernels`. The defaults approximate the
+    `kaiser_best` filter of `resampy`, with a shorter filter.
+
+    The kernel has one filter per output phase, i.e. `target_sr / gcd`
+    filters of about `orig_sr / gcd` taps. For nearly coprime rates (e.g.
+    44100 to 22051 Hz) that would not fit into memory, so rate pairs whose
+    kernel exceeds `max_kernel_size` elements are resampled with
+    `scipy.signal.resample_poly` instead.
+
+    Parameters
+    ----------
+    audio: torch.Tensor [shape=(..., nb_timesteps)]
+        input audio
+
+    orig_sr, target_sr: int
+        sample rates of the input and the output
+
+    zero_crossings: int
+        number of zero crossings of the sinc filter on each side, longer
+        filters are more accurate and slower
+
+    rolloff: float
+        cutoff of the low pass filter relative to the lower nyquist rate
+
+    beta: float
+        shape parameter of the kaiser window
+
+    max_kernel_size: int
+        maximum number of elements of the polyphase kernel
+
+    Returns
+    -------
+    audio: torch.Tensor [shape=(..., int(nb_timesteps * target_sr / orig_sr))]
+        resampled audio
+    """
+    if orig_sr == target_sr:
+        return audio
+
+    gcd = np.gcd(int(orig_sr), int(target_sr))
+    orig, new = int(orig_sr) // gcd, int(target_sr) // gcd
+    nb_timesteps = int(audio.shape[-1] * new / orig)
+
+    width = _resample_width(orig, new, zero_crossings, rolloff)
+    if new * (2 * width + orig) > max_kernel_size:
+        import scipy.signal
+        resampled = scipy.signal.resample_poly(
+            audio.detach().cpu().numpy(), new, orig, axis=-1,
+            window=('kaiser', beta)
+        )
+        return torch.as_tensor(
+            resampled[..., :nb_timesteps], dtype=audio.dtype
+        ).to(audio.device)
+
+    key = (orig, new, zero_crossings, rolloff, beta, audio.dtype, audio.device)
+    entry = resample_kernels.get(key)
+    if entry is None:
+        kernel, width = _resample_kernel(
+            orig, new, zero_crossings, rolloff, beta
+        )
+        kernel = torch.as_tensor(kernel[:, None, :], dtype=audio.dtype)
+        entry = (kernel.to(audio.device), width)
+        resample_kernels.put(key, entry)
+    kernel, width = entry
+
+    shape = audio.shape
+    x = audio.reshape(-1, 1, shape[-1])
+    x = torch.nn.functional.pad(x, (width, width + orig))
+    # (nb_batch, new, nb_blocks): every output phase of every input block
+    y = torch.nn.functional.conv1d(x, kernel, stride=orig)
+    y = y.transpose(1, 2).reshape(x.shape[0], -1)
+    return y[:, :nb_timesteps].reshape(shape[:-1] + (nb_timesteps,))
 
 
 def bandwidth_to_max_bin(rate, n_fft, bandwidth):
@@ -117,6 +278,80 @@ def bandwidth_to_max_bin(rate, n_fft, bandwidth):
     return np.max(np.where(freqs <= bandwidth)[0]) + 1
 
 
+def sdr(estimates, references, window=None, scale_invariant=False, eps=1e-8):
+    """Time domain signal to distortion ratio in dB
+
+    Computes `10 log10(|s|^2 / |s - s_hat|^2)` jointly over all channels of
+    each window of `window` samples, in one pass for all leading dimensions.
+    With `scale_invariant`, the references are first scaled by their least
+    squares gain to the estimates (SI-SDR). As in BSSEval, windows of silent
+    references are nan and the last incomplete window is dropped. This is a
+    cheap estimate of the BSSEval SDR, which allows a filtered distortion of
+    the references.
+
+    Args:
+        estimates (Tensor): (..., nb_channels, nb_timesteps)
+        references (Tensor): (..., nb_channels, nb_timesteps), the longer of
+            both signals is truncated
+        window (int): samples per window, `None` for a single window
+        scale_invariant (bool): compute the SI-SDR
+    Returns:
+        Tensor: (..., nb_windows), without windows for empty signals
+    """
+    nb_timesteps = min(estimates.shape[-1], references.shape[-1])
+    if nb_timesteps == 0:
+        # no windows for empty signals
+        return estimates.new_empty(estimates.shape[:-2] + (0,))
+    if window is None or window > nb_timesteps:
+        window = nb_timesteps
+    nb_windows = nb_timesteps // window
+
+    def frames(x):
+        # (..., nb_channels, nb_timesteps) -> (..., nb_windows, samples)
+        x = x[..., :nb_windows * window]
+        x = x.reshape(x.shape[:-1] + (nb_windows, window)).transpose(-3, -2)
+        return x.reshape(x.shape[:-2] + (-1,))
+
+    estimates, references = frames(estimates), frames(references)
+    energy = references.pow(2).sum(-1)
+    if scale_invariant:
+        gain = (estimates * references).sum(-1, keepdim=True) / (
+            energy.unsqueeze(-1) + eps
+        )
+        references = gain * references
+
+    signal = references.pow(2).sum(-1)
+    distortion = (estimates - references).pow(2).sum(-1)
+    ratio = 10 * torch.log10((signal + eps) / (distortion + eps))
+    return torch.where(
+        energy > 0, ratio, torch.full_like(ratio, float('nan'))
+    )
+
+
+def si_sdr(estimates, references, window=None, eps=1e-8):
+    """Scale invariant SDR in dB, see `sdr`"""
+    return sdr(
+        estimates, references, window=window, scale_invariant=True, eps=eps
+    )
+
+
+@contextmanager
+def torch_threads(nb_threads):
+    """
+    Sets the number of torch intra-op threads within the context and
+    restores the previous number afterwards. `None` keeps the current one.
+    """
+    if nb_threads is None:
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(nb_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
 def save_checkpoint(
     state, is_best, path, target
 ):
@@ -190,3 +425,161 @@ class EarlyStopping(object):
             self.is_better = lambda a, best: a < best - min_delta
         if mode == 'max':
             self.is_better = lambda a, best: a > best + min_delta
+
+
+class LRUCache(object):
+    """Key/value store with least-recently-used eviction and hit counters
+
+    Args:
+        maxsize (int): maximum number of stored items. `None` disables the
+            size limit, `0` disables caching.
+    """
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        if key in self.items:
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        self.items[key] = value
+        self.items.move_to_end(key)
+        self.evict()
+
+    def evict(self):
+        if self.maxsize is None:
+            return
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self.evict()
+
+    def clear(self):
+        self.items.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class EstimateCache(object):
+    """On-disk store of separated estimates with a size limit
+
+    Every entry is a `.npz` file in `root` holding the estimates of all
+    targets as compact `dtype` arrays. Reading an entry updates its
+    modification time, when the files exceed `maxsize` bytes the least
+    recently used entries are removed. Several processes can share the
+    same `root`.
+
+    Args:
+        root (str): directory of the cache
+        maxsize (int): maximum size in bytes, `None` disables the limit
+        dtype (str): dtype of the stored estimates, `float32` or `float16`
+    """
+    def __init__(self, root, maxsize=None, dtype='float32'):
+        if dtype not in ('float32', 'float16'):
+            raise ValueError('dtype must be float32 or float16')
+        self.root = root
+        self.maxsize = maxsize
+        self.dtype = dtype
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(**params):
+        """Returns the hex digest of the json encoded `params`"""
+        encoded = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key + '.npz')
+
+    def get(self, key):
+        """Returns the cached estimates (as float32) or None"""
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                estimates = {
+                    name: data[name].astype(np.float32)
+                    for name in data.files
+                }
+            os.utime(path)
+        except (OSError, ValueError):
+            # missing, evicted by another process or incomplete
+            self.misses += 1
+            return None
+        self.hits += 1
+        return estimates
+
+    def put(self, key, estimates):
+        """Stores `estimates`, a dict of target names and np.ndarray"""
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **{
+                    name: np.asarray(estimate, dtype=self.dtype)
+                    for name, estimate in estimates.items()
+                })
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        """Returns (mtime, size, path) of all entries, oldest first"""
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        if self.maxsize is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        # keep at least the most recent entry
+        for _, size, path in entries[:-1]:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+        self.hits = 0
+        self.misses = 0
+
+
+# windowed sinc kernels of `resample`, keyed by the resampling parameters
+resample_kernels = LRUCache(maxsize=16)